@@ -1,25 +1,19 @@
 import os
-import sys
 import time
 import math
 # import queue
-from collections import deque
-from collections.abc import Sequence
-import kdtree
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.collections import LineCollection
 
-import env, plotting, utils, queue
+import env, utils, profiling, spatial_index, tree_file, robot_prediction, sampling
 
-class Node(Sequence):
-    # inherits from Sequence to support indexing and thus kd-tree support
+class Node:
     def __init__(self, n, cost_to_goal=np.inf):
-        self.n = n # make iterable for kd-tree insertion
+        self.n = n
         self.x = n[0]
         self.y = n[1]
         self.cost_to_goal = cost_to_goal
         self.parent = None
+        self.parent_dist = 0.0 # length of the edge to the parent
         self.children = set([])
 
     def __eq__(self, other):
@@ -29,35 +23,32 @@ class Node(Sequence):
         # this is required for storing Nodes to sets
         return hash(self.n)
 
-    def __getitem__(self, i):
-        # this is required for kd-tree insertion
-        return self.n[i]
-    
-    def __len__(self):
-        # this is required for kd-tree insertion
-        return 2
-   
     def set_parent(self, new_parent):
         # if a parent exists already
         if self.parent:
-            self.parent.children.remove(self)
+            # discard, an equal node (same position) may already have taken this one's place in the set
+            self.parent.children.discard(self)
         self.parent = new_parent
+        self.parent_dist = self.distance(new_parent)
         new_parent.children.add(self)
 
     def distance(self, other):
         return math.hypot(self.x - other.x, self.y - other.y)
 
-    def update_costs_recursive(self):
-        # update cost-to-goal of all children recursively
-        self.cost_to_goal = self.parent.cost_to_goal + self.distance(self.parent)
-        for child in self.children:
-            child.update_costs_recursive()
+    def update_costs(self):
+        # update cost-to-goal of this node and its whole subtree, with a stack so deep trees can't hit the recursion limit
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            node.cost_to_goal = node.parent.cost_to_goal + node.parent_dist
+            stack.extend(node.children)
 
 class DRRTStar:
 
     def __init__(self, x_start, x_goal, robot_radius, step_len, move_dist, gamma_FOS, 
                  bot_sample_rate, waypoint_sample_rate, starting_nodes, node_limit=3000, 
-                 multi_robot=False, iter_max=10_000, plot_params=None):
+                 multi_robot=False, iter_max=10_000, plot_params=None, robot_horizon=None, headless=False,
+                 profile=False, lazy_edges=False, sampler=None, seed=None):
         self.s_start = Node(x_start)
         self.s_goal = Node(x_goal, cost_to_goal=0.0)
         self.s_bot = self.s_start
@@ -69,19 +60,36 @@ class DRRTStar:
         self.starting_nodes = starting_nodes
         self.node_limit = node_limit
         self.plot_params = plot_params
-        self.kd_tree = kdtree.create([self.s_goal])
-        sys.setrecursionlimit(3000) # for the kd-tree cus it searches recursively
+        self.sampler = sampling.UniformSampler() if sampler is None else sampler # where random nodes go, see sampling.py
+        self.rng = sampling.RandomStream(seed) # random numbers of this planner only, see sampling.py
+        self.spatial_index = spatial_index.SpatialIndex(step_len / 4, [self.s_goal]) # grid cells a quarter step wide
         self.tree_nodes = set([self.s_goal])
+        self.position_index = spatial_index.PositionIndex([self.s_goal]) # tree nodes by position, for membership checks
         self.waypoints = []
         self.robot_position = [self.s_bot.x, self.s_bot.y]
         self.robot_speed = 1.0 # m/s
         self.distance_travelled = 0.0
-        self.path = []
+        self.path_points = [] # nodes on the path when it was found, where regrowing places waypoints
         self.other_robots = [] # list of DRRT objects
         self.other_robot_obstacles = [] # list of circular obstacles (x, y, r)
+        self.robot_obs_delta = 0.5 # distance another robot must move before its obstacle is updated
+        # with a horizon (in steps), other robots are predicted corridors instead of disks at their last position
+        self.predictor = None if robot_horizon is None else robot_prediction.RobotPredictor(robot_horizon, self.robot_obs_delta)
+        # lazy_edges: edges other robots move onto are only marked suspect, and checked once the robot's path or a new
+        # node needs them (see validate()) instead of all being checked and cut right away
+        # predicted corridors are always cut right away, validate() only knows the disks, so the two don't combine
+        if lazy_edges and robot_horizon is not None:
+            raise ValueError('lazy_edges does not work with robot_horizon, predicted corridors are always cut eagerly')
+        self.lazy_edges = lazy_edges
+        self.suspect = {} # id(node) -> node whose edge to its parent another robot may have moved onto
 
         self.env = env.Env()
-        self.plotting = plotting.Plotting(x_start, x_goal)
+        # headless planners never import matplotlib, renderers only need plot_params and the tree
+        if headless:
+            self.plotting = None
+        else:
+            import plotting
+            self.plotting = plotting.Plotting(x_start, x_goal)
         self.utils = utils.Utils()
 
         self.x_range = self.env.x_range
@@ -106,68 +114,104 @@ class DRRTStar:
         # single robot stuff
         if not multi_robot:
             # plotting
-            self.fig, self.ax = plt.subplots(figsize=(12, 8))
-            self.fig.suptitle('DRRT')
-            self.ax.set_xlim(self.env.x_range[0], self.env.x_range[1]+1)
-            self.ax.set_ylim(self.env.y_range[0], self.env.y_range[1]+1)
-            self.bg = self.fig.canvas.copy_from_bbox(self.ax.bbox)
-            self.nodes_scatter = self.ax.scatter([], [], s=4, c='gray', alpha=0.5)
-            self.edge_col = LineCollection([], colors='blue', linewidths=0.5)
-            self.path_col = LineCollection([], colors='red', linewidths=1.0)
-            self.ax.add_collection(self.edge_col)
-            self.ax.add_collection(self.path_col)
+            if not headless:
+                import matplotlib.pyplot as plt
+                from matplotlib.collections import LineCollection
+                self.fig, self.ax = plt.subplots(figsize=(12, 8))
+                self.fig.suptitle('DRRT')
+                self.ax.set_xlim(self.env.x_range[0], self.env.x_range[1]+1)
+                self.ax.set_ylim(self.env.y_range[0], self.env.y_range[1]+1)
+                self.bg = self.fig.canvas.copy_from_bbox(self.ax.bbox)
+                self.nodes_scatter = self.ax.scatter([], [], s=4, c='gray', alpha=0.5)
+                self.edge_col = LineCollection([], colors='blue', linewidths=0.5)
+                self.path_col = LineCollection([], colors='red', linewidths=1.0)
+                self.ax.add_collection(self.edge_col)
+                self.ax.add_collection(self.path_col)
 
             # other
             self.iter_max = iter_max
 
+        # opt-in per-phase timers and counters, a time series in self.profiler.records (see profiling.py)
+        self.profiler = profiling.StepProfiler(self) if profile else None
+
     def step(self):
         # if we reached the goal, just return
         if self.reached_goal:
             return
+        self.move_robot()
+        self.plan()
 
-        # check if planning time is over
-        if not self.started and len(self.tree_nodes) > self.starting_nodes:
-            self.started = True
-        
+    def move_robot(self):
         # if planning time is over and we have a path, we can move the robot
-        if self.started and self.path_to_goal:
+        if self.ready_to_move():
             # update robot position and maybe the node it is at
-            self.s_bot, self.robot_position = self.utils.update_robot_position(
+            self.apply_motion(*self.utils.update_robot_position(
                 self.robot_position, self.s_bot, self.robot_speed, self.move_dist
-            )
-            self.distance_travelled += self.robot_speed * self.move_dist # weird but this is how it works
+            ))
+        self.check_goal()
+
+    def ready_to_move(self):
+        # check if planning time is over
+        if not self.started and len(self.tree_nodes) > self.starting_nodes:
+            self.started = True
+        return self.started and self.path_to_goal
 
+    def apply_motion(self, s_bot, robot_position):
+        # split out of move_robot() so BatchSimulator can compute the motion of many robots at once
+        self.s_bot, self.robot_position = s_bot, robot_position
+        self.distance_travelled += self.robot_speed * self.move_dist # weird but this is how it works
+
+    def check_goal(self):
         if self.s_bot == self.s_goal:
             self.reached_goal = True
 
+    def plan(self, idx_changed=None):
+        # idx_changed: indices of other robots known to have moved, None to check here
         ''' MAIN ALGORITHM BEGINS '''
 
         self.search_radius = self.shrinking_ball_radius()
 
-        self.update_robot_obstacles(delta=0.5) # update other robots as obstacles of this robot
+        self.update_robot_obstacles(self.robot_obs_delta, idx_changed) # update other robots as obstacles of this robot
 
         # don't add nodes past limit unless there's currently no path
         if len(self.tree_nodes) >= self.node_limit and self.path_to_goal:
             return
 
+        # samples are plain (x, y) points, a node is only allocated for one with a collision free edge
         if self.regrowing:
-            v = self.random_node_regrow()
+            x_rand = self.random_node_regrow()
         else:
-            v = self.random_node()
+            x_rand = self.random_node()
 
-        v_nearest = self.nearest(v)
-        v = self.saturate(v_nearest, v)
+        v_nearest = self.nearest(x_rand)
+        x_new = self.saturate(v_nearest, x_rand)
 
-        if v and not self.utils.is_collision(v_nearest, v):
+        if not self.utils.is_collision_segment(v_nearest.x, v_nearest.y, x_new[0], x_new[1]):
+            v = Node(x_new)
             V_near = self.near(v)
-            self.extend(v, V_near, v_nearest)
+            collisions = self.extend(v, V_near, v_nearest)
             if v.parent:
-                self.rewire(v, V_near)
+                self.rewire(v, V_near, collisions)
+
+    def published_path(self, length, from_node=False):
+        # points along the path this robot is about to drive, from its position and about length long
+        # from_node starts at the node the robot is leaving instead, so the segments stay the same while it drives
+        path = [(self.s_bot.x, self.s_bot.y) if from_node else (self.robot_position[0], self.robot_position[1])]
+        if not (self.started and self.path_to_goal):
+            return path
+        node = self.s_bot.parent # update_robot_position() drives towards the parent of s_bot
+        while node and length > 0:
+            length -= math.hypot(node.x - path[-1][0], node.y - path[-1][1])
+            path.append((node.x, node.y))
+            node = node.parent
+        return path
 
     def set_other_robots(self, other_robots):
         # set the other robots that this robot should know about, called by multirobot.py
         self.other_robots = other_robots
         self.other_robot_obstacles = []
+        if self.predictor is not None:
+            self.predictor.clear()
         for robot in other_robots:
             self.other_robot_obstacles.append([
                     robot.robot_position[0],
@@ -178,33 +222,48 @@ class DRRTStar:
     def extend(self, v, V_near, v_nearest):
         if not V_near:
             V_near.append(v_nearest)
-        self.find_parent(v, V_near)
+        collisions = self.find_parent(v, V_near)
         if not v.parent:
-            return
+            return collisions
         self.add_node(v)
-        v.update_costs_recursive()
+        # v is new, so it has no subtree and find_parent() already set its cost
+        return collisions
 
     def find_parent(self, v, U):
+        # cheapest collision free u in U becomes the parent
+        # returns the collision flag of every edge (u, v), U itself is left as it is
         costs = [v.distance(u) + u.cost_to_goal for u in U]
-        if costs:
-            min_idx = int(np.argmin(costs))
-            best_u = U[min_idx]
-            if not self.utils.is_collision(best_u, v):
-                v.set_parent(best_u)
-                v.cost_to_goal = costs[min_idx]
-            else:
-                del U[min_idx]
-                self.find_parent(v, U)
-
-    def rewire(self, v, V_near):
-        for u in V_near:
-            if u == v.parent or self.utils.is_collision(u, v):
+        collisions = self.utils.is_collision_batch(U, v)
+        # stable sort keeps argmin's tie breaking
+        cut = False
+        for idx in np.argsort(costs, kind='stable'):
+            if collisions[idx]:
+                continue
+            if self.lazy_edges and not self.validate(U[idx]):
+                cut = True # its way to the goal was blocked and cut off, maybe with other nodes of U
+                continue
+            v.set_parent(U[idx])
+            v.cost_to_goal = costs[idx]
+            break
+        if cut:
+            # nodes no longer in the tree must not be rewired onto v either
+            for k, u in enumerate(U):
+                if self.position_index.find(u.x, u.y) is not u:
+                    collisions[k] = True
+        return collisions
+
+    def rewire(self, v, V_near, collisions=None):
+        # collisions: flags of the edges (u, v) for V_near if already checked, see find_parent()
+        if collisions is None:
+            collisions = self.utils.is_collision_batch(V_near, v)
+        for u, collides in zip(V_near, collisions):
+            if collides or u == v.parent:
                 continue
             new_cost = v.cost_to_goal + v.distance(u)
             if new_cost < u.cost_to_goal:
                 u.set_parent(v)
-                u.cost_to_goal = new_cost
-                u.update_costs_recursive()
+                u.update_costs()
+                self.suspect.pop(id(u), None) # its old edge is not in the tree anymore
 
     def update_click_obstacles(self, event):
         if event.button == 1: # add obstacle
@@ -216,35 +275,119 @@ class DRRTStar:
             if obs:
                 self.remove_obstacle(obs, shape)
 
-    def update_robot_obstacles(self, delta):
+    def update_robot_obstacles(self, delta, idx_changed=None):
         # delta is distance that robot needs to move for obstackes to be updated
-        idx_changed = []
-        for idx, other in enumerate(self.other_robots):
-            # check if this other robot has moved significantly
-            if math.hypot(other.robot_position[0] - self.other_robot_obstacles[idx][0],
-                          other.robot_position[1] - self.other_robot_obstacles[idx][1]) > delta:
-                idx_changed.append(idx)
-
-        # remove obstacles from their old positions
-        for idx in idx_changed:
-            self.remove_obstacle(self.other_robot_obstacles[idx], 'robot')
-
-        # add obstacles to their new positions
-        for idx in idx_changed:
-            # first manage obstacle lists
-            self.other_robot_obstacles[idx] = [
-                self.other_robots[idx].robot_position[0], 
-                self.other_robots[idx].robot_position[1], 
+        # idx_changed can be passed in by a caller that has already done this check (BatchSimulator)
+        if self.predictor is not None:
+            self.update_predicted_obstacles()
+            return
+        if idx_changed is None:
+            idx_changed = []
+            for idx, other in enumerate(self.other_robots):
+                # check if this other robot has moved significantly
+                if math.hypot(other.robot_position[0] - self.other_robot_obstacles[idx][0],
+                              other.robot_position[1] - self.other_robot_obstacles[idx][1]) > delta:
+                    idx_changed.append(idx)
+
+        # move obstacles to their new positions, all in one pass
+        if idx_changed:
+            self.move_obstacles({idx: [
+                self.other_robots[idx].robot_position[0],
+                self.other_robots[idx].robot_position[1],
                 self.other_robots[idx].robot_radius
-            ]
-            self.add_new_obstacle(self.other_robot_obstacles[idx], robot=True)
+            ] for idx in idx_changed})
+
+    def move_obstacle(self, idx, obs):
+        # move the obstacle of other robot idx to obs = (x, y, r)
+        self.move_obstacles({idx: obs})
+
+    def move_obstacles(self, moves):
+        # moves: other robot index -> new (x, y, r)
+        # edges under an obstacle are deleted with their subtrees rather than blocked, so the old disks have
+        # nothing to restore and only edges under the new disks need checking, for all moved robots at once
+        for idx, obs in moves.items():
+            self.other_robot_obstacles[idx] = obs
+        if self.lazy_edges:
+            self.mark_suspect(list(moves.values()))
+            self.validate(self.s_bot) # the path the robot is on can't wait until it is used
+            return
+        self.remove_subtrees(self.edges_in_circles(list(moves.values())))
+
+    def mark_suspect(self, circles):
+        # lazy_edges, the edge to its parent of every node near one of the circles (x, y, r) may be blocked now,
+        # the same nodes edges_in_circles() would check
+        for x, y, r in circles:
+            for u in self.find_nodes_in_range((x, y), r + self.step_len + self.utils.delta):
+                if u.parent:
+                    self.suspect[id(u)] = u
+
+    def validate(self, node):
+        # lazy_edges, checks the suspect edges on the way from node to the goal against the other robots and cuts off
+        # the blocked ones with their subtrees, returns whether node is (still) in the tree
+        if self.position_index.find(node.x, node.y) is not node:
+            return False
+        if not self.suspect:
+            return True
+        chain = []
+        while node.parent:
+            if id(node) in self.suspect:
+                chain.append(node)
+            node = node.parent
+        if not chain:
+            return True
+        for u in chain:
+            del self.suspect[id(u)]
+        circles = self.other_robot_obstacles
+        if len(chain) * len(circles) < self.utils.batch_min:
+            # numpy call overhead is larger than a few single checks
+            blocked = [u for u in chain if any(self.utils.is_intersect_circle((u.x, u.y), (u.parent.x, u.parent.y),
+                                                                              (x, y), r) for x, y, r in circles)]
+        else:
+            hits = self.utils.is_intersect_circles_batch([(u.x, u.y, u.parent.x, u.parent.y) for u in chain], circles)
+            blocked = [u for u, hit in zip(chain, hits.any(axis=1)) if hit]
+        if not blocked:
+            return True
+        self.remove_subtrees(blocked)
+        return False
+
+    def update_predicted_obstacles(self):
+        # cut the edges in the corridor of every other robot whose prediction conflicts with the path ahead of this robot
+        path = self.published_path(self.robot_speed * self.move_dist * self.predictor.horizon, from_node=True)
+        path_segs = [(a[0], a[1], b[0], b[1]) for a, b in zip(path[:-1], path[1:])]
+        E = []
+        for idx, other in enumerate(self.other_robots):
+            self.predictor.observe(idx, other)
+            if path_segs and any(self.predictor.segments_collide(idx, path_segs)):
+                E.extend(self.edges_in_corridor(idx))
+        if E:
+            self.remove_subtrees(list(set(E)))
+
+    def edges_in_corridor(self, idx):
+        # nodes whose edge to their parent other robot idx is predicted to sweep over
+        nearby_nodes = set()
+        for x, y, r in self.predictor.search_regions(idx, self.step_len + self.utils.delta):
+            nearby_nodes.update(self.find_nodes_in_range((x, y), r))
+        E = [u for u in nearby_nodes if u.parent]
+        hits = self.predictor.segments_collide(idx, [(u.x, u.y, u.parent.x, u.parent.y) for u in E])
+        return [u for u, hit in zip(E, hits) if hit]
+
+    def edges_in_circles(self, circles):
+        # nodes whose edge to their parent intersects any of the circles (x, y, r), checked in one batch
+        nearby_nodes = set()
+        for x, y, r in circles:
+            nearby_nodes.update(self.find_nodes_in_range((x, y), r + self.step_len + self.utils.delta))
+        E = [u for u in nearby_nodes if u.parent]
+        if not E:
+            return []
+        hits = self.utils.is_intersect_circles_batch([(u.x, u.y, u.parent.x, u.parent.y) for u in E], circles)
+        return [u for u, hit in zip(E, hits.any(axis=1)) if hit]
 
     def add_new_obstacle(self, obs, robot=False):
         x, y, r = obs
         if not robot:
             print("Add circle obstacle at: s =", x, ",", "y =", y)
             self.obs_circle.append(obs)
-            self.plotting.update_obs(self.obs_circle, self.obs_boundary, self.obs_rectangle) # for plotting obstacles
+            self.update_plot_obs() # for plotting obstacles
             self.utils.update_obs(self.obs_circle, self.obs_boundary, self.obs_rectangle) # for collision checking
         else:
             self.obs_robot.append(obs)
@@ -252,29 +395,33 @@ class DRRTStar:
         self.update_gamma() # free space volume changed, so gamma must change too
 
         # get possible affected edges to check for collision with new obstacle
-        nearby_nodes = self.find_nodes_in_range((x, y), r + self.step_len + self.utils.delta)
-        E = [u for u in nearby_nodes if u.parent and self.utils.is_intersect_circle(u.n, u.parent.n, [x, y], r)]
+        self.remove_subtrees(self.edges_in_circles([(x, y, r)]))
+
+    def remove_subtrees(self, E):
+        # E: nodes whose edge to their parent is now blocked
+        if not E:
+            return
+
+        # cut them off their parents, or later walks of the parents' subtrees would visit them again
+        for u in E:
+            u.parent.children.discard(u)
 
-        # remove children from tree recursively
-        q = deque(E)
-        while q:
-            node = q.pop()
+        # collect the whole invalid subtree first, then take it out of the tree and its indexes at once
+        subtree = []
+        stack = list(E)
+        while stack:
+            node = stack.pop()
             if node == self.s_bot:
                 self.path_to_goal = False
                 self.regrowing = True
-            for child in node.children:
-                q.appendleft(child)
-
-            if node in self.tree_nodes:
-                self.tree_nodes.remove(node)
-                self.kd_tree.remove(node)
+            subtree.append(node)
+            stack.extend(node.children)
+        self.remove_nodes(subtree)
 
-        # update waypoints
+        # update waypoints, up to the first node of the old path still in the tree
         self.waypoints = []
-        for edge in self.path:
-            pos = tuple(edge[0,:])
-            node = Node(pos)
-            if node not in self.tree_nodes:
+        for pos in self.path_points:
+            if self.position_index.find(pos[0], pos[1]) is None:
                 self.waypoints.append(pos)
             else:
                 break
@@ -286,62 +433,69 @@ class DRRTStar:
         # remove obstacle from list if applicable
         if shape == 'circle':
             self.obs_circle.remove(obs)
-            self.plotting.update_obs(self.obs_circle, self.obs_boundary, self.obs_rectangle) # for plotting obstacles
+            self.update_plot_obs() # for plotting obstacles
             self.utils.update_obs(self.obs_circle, self.obs_boundary, self.obs_rectangle) # for collision checking
         elif shape == 'rectangle':
             self.obs_rectangle.remove(obs)
-            self.plotting.update_obs(self.obs_circle, self.obs_boundary, self.obs_rectangle) # for plotting obstacles
+            self.update_plot_obs() # for plotting obstacles
             self.utils.update_obs(self.obs_circle, self.obs_boundary, self.obs_rectangle) # for collision checking
 
         self.update_gamma() # free space volume changed, so gamma must change too
 
     def random_node(self):
-        delta = self.utils.delta
+        # (x, y) of the next sample
+        if not self.path_to_goal and self.rng.random() < self.bot_sample_rate:
+            return self.s_bot.n
 
-        if not self.path_to_goal and np.random.random() < self.bot_sample_rate:
-            return Node(self.s_bot.n)
-
-        return Node((np.random.uniform(self.x_range[0] + delta, self.x_range[1] - delta),
-                     np.random.uniform(self.y_range[0] + delta, self.y_range[1] - delta)))
+        return self.sampler.sample(self)
 
     def random_node_regrow(self):
-        delta = self.utils.delta
-        p = np.random.random()
+        p = self.rng.random()
 
         if not self.path_to_goal and p < self.bot_sample_rate:
-            return Node(self.s_bot.n)
+            return self.s_bot.n
         elif len(self.waypoints) > 1 and self.bot_sample_rate < p < self.bot_sample_rate + self.waypoint_sample_rate:
-            return Node(self.waypoints[np.random.randint(0, len(self.waypoints) - 1)])
+            return self.waypoints[self.rng.integers(0, len(self.waypoints) - 1)]
         else:
-            return Node((np.random.uniform(self.x_range[0] + delta, self.x_range[1] - delta),
-                         np.random.uniform(self.y_range[0] + delta, self.y_range[1] - delta)))
+            return self.sampler.sample(self)
 
     def add_node(self, node_new):
-        if node_new not in self.tree_nodes:
+        if node_new not in self.position_index:
             self.tree_nodes.add(node_new)
-            self.kd_tree.add(node_new)
+            self.spatial_index.insert(node_new)
+            self.position_index.insert(node_new)
         # if new node is at start, then path to goal is found
         if node_new == self.s_bot:
             self.s_bot = node_new
             self.path_to_goal = True
             self.regrowing = False
-            self.update_path(self.s_bot) # update path to goal for plotting
-
-    def saturate(self, v_nearest, v):
-        dist, theta = self.get_distance_and_angle(v_nearest, v)
-        dist = min(self.step_len, dist)
-        node_new = Node((v_nearest.x + dist * math.cos(theta),
-                         v_nearest.y + dist * math.sin(theta)))
-        return node_new
+            self.update_path(self.s_bot) # remember the path for placing waypoints
+
+    def remove_nodes(self, nodes):
+        # removes nodes from the tree, skipping the ones that are not in it themselves, e.g. a node equal to one
+        # already there (see add_node()), returns the removed ones
+        removed = [node for node in nodes if self.position_index.remove(node)]
+        self.tree_nodes.difference_update(removed)
+        self.spatial_index.bulk_remove(removed)
+        if self.suspect:
+            for node in removed:
+                self.suspect.pop(id(node), None)
+        return removed
+
+    def saturate(self, v_nearest, pos):
+        # the point at most step_len from v_nearest towards pos
+        dx, dy = pos[0] - v_nearest.x, pos[1] - v_nearest.y
+        dist, theta = min(self.step_len, math.hypot(dx, dy)), math.atan2(dy, dx)
+        return (v_nearest.x + dist * math.cos(theta), v_nearest.y + dist * math.sin(theta))
 
     def near(self, v):
-        return self.kd_tree.search_nn_dist((v.x, v.y), self.search_radius)
+        return self.spatial_index.radius_query((v.x, v.y), self.search_radius)
 
-    def nearest(self, v):
-        return self.kd_tree.search_nn((v.x, v.y))[0].data
+    def nearest(self, pos):
+        return self.spatial_index.nearest(pos)
 
     def find_nodes_in_range(self, pos, r):
-        return self.kd_tree.search_nn_dist((pos[0], pos[1]), r)
+        return self.spatial_index.radius_query((pos[0], pos[1]), r)
 
     def update_gamma(self):
         '''
@@ -363,11 +517,64 @@ class DRRTStar:
         '''
         return min(self.step_len, self.gamma * np.log(len(self.tree_nodes)+1) / len(self.tree_nodes))
 
+    def save_tree(self, path):
+        # saves the tree for planners with the same goal and obstacles to start from, see tree_file.py
+        # children are not saved, they are rebuilt from the parents
+        nodes = [self.s_goal] + [node for node in self.tree_nodes if node is not self.s_goal]
+        coords, parent = tree_file.node_arrays(nodes)
+        cost_to_goal = np.array([node.cost_to_goal for node in nodes], dtype=float)
+        tree_file.save(path, self, 'DRRTStar', coords=coords, parent=parent, cost_to_goal=cost_to_goal)
+
+    def load_tree(self, path):
+        # replaces the tree with one saved by save_tree(), ValueError if it was grown for another goal or map
+        # the robot stays where it is, and is on the new tree if a node sits at the node it is at
+        data = tree_file.load(path, self, 'DRRTStar')
+        coords = data['coords']
+        nodes = [Node(n, cost) for n, cost in zip(map(tuple, coords.tolist()), data['cost_to_goal'].tolist())]
+        tree_file.link(nodes, data['parent'])
+        for node in nodes:
+            if node.parent:
+                node.parent_dist = node.distance(node.parent)
+        bot = self.s_bot.n
+        self.s_goal = nodes[0]
+        self.tree_nodes = set(nodes)
+        self.spatial_index.clear()
+        self.spatial_index.bulk_insert(nodes, coords)
+        self.position_index = spatial_index.PositionIndex(nodes)
+        self.suspect = {}
+        self.waypoints = []
+        self.path_points = []
+        self.regrowing = False
+        self.set_other_robots(self.other_robots) # the new tree is not checked against the other robots yet
+
+        node = self.position_index.find(bot[0], bot[1])
+        if node is not None:
+            self.s_bot = node
+            self.path_to_goal = True
+            self.update_path(self.s_bot)
+        else:
+            self.s_bot = Node(bot)
+            self.path_to_goal = False
+
     def update_path(self, node):
-        self.path = []
+        self.path_points = []
         while node.parent:
-            self.path.append(np.array([[node.x, node.y], [node.parent.x, node.parent.y]]))
+            self.path_points.append((node.x, node.y))
             node = node.parent
+
+    @property
+    def path(self):
+        # segments of the current path to goal, only built when a renderer asks for them
+        path = []
+        node = self.s_bot
+        while node.parent:
+            path.append(np.array([[node.x, node.y], [node.parent.x, node.parent.y]]))
+            node = node.parent
+        return path
+
+    def update_plot_obs(self):
+        if self.plotting is not None:
+            self.plotting.update_obs(self.obs_circle, self.obs_boundary, self.obs_rectangle)
     
     def find_obstacle(self, a, b):
         for (x, y, r) in self.obs_circle:
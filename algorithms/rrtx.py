@@ -1,89 +1,146 @@
 import os
-import sys
 import time
 import math
-import heapq
 from collections import deque
-from collections.abc import Sequence
-import kdtree
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.collections import LineCollection
-
-import env, plotting, utils
-
-class Node(Sequence):
-    # inherits from Sequence to support indexing and thus kd-tree support
-    def __init__(self, n, lmc=np.inf, cost_to_goal=np.inf):
-        self.n = n # make iterable for kd-tree insertion
-        self.x = n[0]
-        self.y = n[1]
-        self.parent = None
-        self.children = set([])
-        self.cost_to_goal = cost_to_goal
-        self.lmc = lmc
-        self.infinite_dist_nodes = set([]) # set of nodes u where d_pi(v,u) has been set to infinity after adding an obstacle
-        self.N_o_plus = set([]) # outgoing original neighbours
-        self.N_o_minus = set([]) # incoming original neighbours
-        self.N_r_plus = set([]) # outgoing running in neighbours
-        self.N_r_minus = set([]) # incoming running in neighbours
 
-    def __eq__(self, other):
-        # this is required for the checking if a node is "in" self.Q, but idk what the condition should be
-        return id(self) == id(other) or self.get_key() == other.get_key() or \
-            math.hypot(self.x - other.x, self.y - other.y) < 1e-6
-        # return self.get_key() == other.get_key()
-        # return self.x == other.x and self.y == other.y
+import env, utils, profiling, priority_queue, spatial_index, tree_store, tree_file, robot_prediction, sampling
+
+class Node:
+    # lightweight handle into a tree_store.TreeStore, all node data lives in the store's buffers
+    __slots__ = ('tree', 'idx')
+
+    def __init__(self, tree, idx):
+        self.tree = tree
+        self.idx = idx
+
+    @property
+    def x(self):
+        return self.tree.x[self.idx]
+
+    @property
+    def y(self):
+        return self.tree.y[self.idx]
+
+    @property
+    def n(self):
+        return (self.tree.x[self.idx], self.tree.y[self.idx])
+
+    @property
+    def parent(self):
+        p = self.tree.parent[self.idx]
+        return None if p == tree_store.NO_PARENT else self.tree.handles[p]
+
+    @parent.setter
+    def parent(self, node):
+        self.tree.parent[self.idx] = tree_store.NO_PARENT if node is None else node.idx
+
+    @property
+    def cost_to_goal(self):
+        return self.tree.cost_to_goal[self.idx]
+
+    @cost_to_goal.setter
+    def cost_to_goal(self, value):
+        self.tree.cost_to_goal[self.idx] = value
+
+    @property
+    def lmc(self):
+        return self.tree.lmc[self.idx]
 
-    def __lt__(self, other):
-        # this is just in case their keys are the same, so a ValueError is not thrown
-        return 1
+    @lmc.setter
+    def lmc(self, value):
+        self.tree.lmc[self.idx] = value
+
+    # read-only views of the neighbour sets, use the add_*/remove_* methods to change them
+    @property
+    def children(self):
+        return self.tree.get(self.tree.children, self.idx)
+
+    @property
+    def infinite_dist_nodes(self):
+        return self.tree.get(self.tree.infinite_dist_nodes, self.idx)
+
+    @property
+    def N_o(self):
+        # original neighbours, N_o+ and N_o- in the paper: they are only ever added together by
+        # add_original_neighbor() and only dropped with the slot, so one set serves as both the outgoing and incoming ones
+        return self.tree.get(self.tree.N_o, self.idx)
+
+    @property
+    def N_r_plus(self):
+        # outgoing running in neighbours
+        return self.tree.get(self.tree.N_r_plus, self.idx)
+
+    @property
+    def N_r_minus(self):
+        # incoming running in neighbours
+        return self.tree.get(self.tree.N_r_minus, self.idx)
+
+    def __eq__(self, other):
+        # a node is its slot, the same thing __hash__ uses, see coincides() for nodes at the same position
+        return self is other or (isinstance(other, Node) and self.tree is other.tree and self.idx == other.idx)
 
     def __hash__(self):
-        # this is required for storing Nodes to sets
-        return hash(self.n)
+        # slots are unique per live node, so this is cheaper than hashing coordinates
+        return self.idx
 
-    def __getitem__(self, i):
-        # this is required for kd-tree insertion
-        return self.n[i]
-    
-    def __len__(self):
-        # this is required for kd-tree insertion
-        return 2
+    def coincides(self, other):
+        # whether other sits at the same position (within 1e-6), e.g. a new node placed on the robot
+        tree, i, j = self.tree, self.idx, other.idx
+        return math.hypot(tree.x[i] - other.tree.x[j], tree.y[i] - other.tree.y[j]) < 1e-6
+
+    def add_original_neighbor(self, u):
+        self.tree.add(self.tree.N_o, self.idx, u)
+
+    def add_running_neighbor(self, u):
+        # u becomes an outgoing and incoming running neighbour of this node
+        self.tree.add(self.tree.N_r_plus, self.idx, u)
+        self.tree.add(self.tree.N_r_minus, self.idx, u)
+
+    def add_infinite_dist(self, u):
+        self.tree.add(self.tree.infinite_dist_nodes, self.idx, u)
+
+    def remove_child(self, child):
+        return self.tree.discard(self.tree.children, self.idx, child)
 
     def all_out_neighbors(self):
-        return self.N_o_plus.union(self.N_r_plus)
+        # callers only read the result, so skip the union when one side is empty
+        N_o, N_r = self.N_o, self.N_r_plus
+        if not N_r:
+            return N_o
+        if not N_o:
+            return N_r
+        return N_o | N_r
     
     def all_in_neighbors(self):
-        return self.N_o_minus.union(self.N_r_minus)
+        N_o, N_r = self.N_o, self.N_r_minus
+        if not N_r:
+            return N_o
+        if not N_o:
+            return N_r
+        return N_o | N_r
    
     def set_parent(self, new_parent):
         # if a parent exists already
-        if self.parent:
-            try:
-                self.parent.children.remove(self)
-            except:
-                print('KeyError in set parent')
+        parent = self.parent
+        if parent and not parent.remove_child(self):
+            print('KeyError in set parent')
         self.parent = new_parent
-        new_parent.children.add(self)
+        self.tree.add(self.tree.children, new_parent.idx, self)
 
     def get_key(self):
-        return (min(self.cost_to_goal, self.lmc), self.cost_to_goal)
+        cost_to_goal = self.cost_to_goal
+        return (min(cost_to_goal, self.lmc), cost_to_goal)
 
     def cull_neighbors(self, r):
         # Algorithm 3
-        N_r_plus_list = list(self.N_r_plus) # can't remove from set while iterating over it
-        for u in N_r_plus_list:
-            # switched order of conditions in if statement to be faster
-            if self.parent and self.parent != u and r < self.distance(u):
-                N_r_plus_list.remove(u)
-                try:
-                    u.N_r_minus.remove(self)
-                except KeyError:
-                    # print('KeyError in RRTX.cull_neighbors(), skipping remove')
-                    pass
-
-        self.N_r_plus = set(N_r_plus_list)
+        parent = self.parent
+        if not parent:
+            return
+        for u in list(self.N_r_plus): # can't remove from set while iterating over it
+            if parent != u and r < self.distance(u):
+                self.tree.discard(self.tree.N_r_plus, self.idx, u)
+                self.tree.discard(self.tree.N_r_minus, u.idx, self)
 
     def update_LMC(self, orphan_nodes, r, epsilon, utils):
         # Algorithm 14
@@ -99,16 +156,27 @@ class Node(Sequence):
             self.set_parent(p_prime) # not sure if we need this or literally just set the parent manually without propagating
 
     def distance(self, other):
-        return np.inf if other in self.infinite_dist_nodes else math.hypot(self.x - other.x, self.y - other.y)
+        tree, i, j = self.tree, self.idx, other.idx
+        inf_nodes = tree.infinite_dist_nodes.get(i)
+        if inf_nodes and other in inf_nodes:
+            return np.inf
+        return math.hypot(tree.x[i] - tree.x[j], tree.y[i] - tree.y[j])
+
+
+# neighbour sets of the tree store, saved with the tree by save_tree()
+RELATIONS = ('children', 'infinite_dist_nodes', 'N_o', 'N_r_plus', 'N_r_minus')
 
 
 class RRTX:
 
     def __init__(self, x_start, x_goal, robot_radius, step_len, move_dist, gamma_FOS, epsilon, 
                  bot_sample_rate, starting_nodes, node_limit=3000, multi_robot=False,
-                 iter_max=10_000, plot_params=None):
-        self.s_start = Node(x_start)
-        self.s_goal = Node(x_goal, lmc=0.0, cost_to_goal=0.0)
+                 iter_max=10_000, plot_params=None, robot_horizon=None, headless=False,
+                 profile=False, repair_max_pops=None, repair_max_time=None, sampler=None,
+                 seed=None):
+        self.tree = tree_store.TreeStore(Node) # storage for every node of this planner
+        self.s_start = self.tree.new_node(x_start)
+        self.s_goal = self.tree.new_node(x_goal, lmc=0.0, cost_to_goal=0.0)
         self.s_bot = self.s_start
         self.robot_radius = robot_radius
         self.step_len = step_len
@@ -119,22 +187,40 @@ class RRTX:
         self.node_limit = node_limit
         self.plot_params = plot_params
         self.search_radius = 0.0
-        self.kd_tree = kdtree.create([self.s_goal])
-        sys.setrecursionlimit(3000) # for the kd-tree cus it searches recursively
-        self.all_nodes_coor = []
-        self.tree_nodes = [self.s_goal] # this is V_T in the paper
+        self.sampler = sampling.UniformSampler() if sampler is None else sampler # where random nodes go, see sampling.py
+        self.rng = sampling.RandomStream(seed) # random numbers of this planner only, see sampling.py
+        self.spatial_index = spatial_index.SpatialIndex(step_len / 4, [self.s_goal]) # grid cells a quarter step wide
+        self.tree_nodes = set([self.s_goal]) # this is V_T in the paper
         self.orphan_nodes = set([]) # this is V_T^C in the paper, i.e., nodes that have been disconnected from tree due to obstacles
-        self.Q = [] # priority queue of ComparableNodes
+        # repairs can be spread over several steps, propagate_descendants() and reduce_inconsistency() stop after
+        # repair_max_pops nodes or repair_max_time seconds each step and resume in the next one (None is no limit)
+        self.repair_max_pops = repair_max_pops
+        self.repair_max_time = repair_max_time
+        self.propagating = False # propagate_descendants() has started on orphan_nodes but not finished
+        self.orphan_queue = deque() # orphans whose children have not been made orphans yet
+        self.robot_orphan_check = False # whether propagate_descendants() still has to check if the robot got orphaned
+        self.orphans_to_clear = None # orphans to cut from the tree once all of them are known, in order
+        self.orphans_cleared = set() # orphans already cut from the tree
+        self.freed_nodes = deque() # nodes next to edges robots moved off of, still to look for a better parent
+        self.Q = priority_queue.IndexedPriorityQueue() # priority queue of nodes keyed by get_key()
         self.robot_position = [self.s_bot.x, self.s_bot.y]
         self.robot_speed = 1.0 # m/s
         self.distance_travelled = 0.0 # for stats
-        self.path = []
         self.other_robots = [] # list of RRTX objects
         self.other_robot_obstacles = [] # list of circular obstacles (x, y, r)
+        self.robot_obs_delta = 0.5 # distance another robot must move before its obstacle is updated
+        self.robot_blocked = {} # other robot index -> set of edges (v, u) its obstacle currently blocks
+        # with a horizon (in steps), other robots are predicted corridors instead of disks at their last position
+        self.predictor = None if robot_horizon is None else robot_prediction.RobotPredictor(robot_horizon, self.robot_obs_delta)
 
         self.env = env.Env()
-        self.plotting = plotting.Plotting(x_start, x_goal)
-        self.utils = utils.Utils()
+        # headless planners never import matplotlib, renderers only need plot_params and the tree
+        if headless:
+            self.plotting = None
+        else:
+            import plotting
+            self.plotting = plotting.Plotting(x_start, x_goal)
+        self.utils = utils.Utils(cache_edges=True) # the same edges get checked again in update_LMC, rewiring and repairs
 
         self.x_range = self.env.x_range
         self.y_range = self.env.y_range
@@ -156,66 +242,109 @@ class RRTX:
         # single robot stuff
         if not multi_robot:
             # plotting
-            self.fig, self.ax = plt.subplots(figsize=(12, 8))
-            self.fig.suptitle('RRTX')
-            self.ax.set_xlim(self.env.x_range[0], self.env.x_range[1]+1)
-            self.ax.set_ylim(self.env.y_range[0], self.env.y_range[1]+1)
-            self.bg = self.fig.canvas.copy_from_bbox(self.ax.bbox)
-            self.nodes_scatter = self.ax.scatter([], [], s=4, c='gray', alpha=0.5)
-            self.edge_col = LineCollection([], colors='blue', linewidths=0.5)
-            self.path_col = LineCollection([], colors='red', linewidths=1.0)
-            self.ax.add_collection(self.edge_col)
-            self.ax.add_collection(self.path_col)
+            if not headless:
+                import matplotlib.pyplot as plt
+                from matplotlib.collections import LineCollection
+                self.fig, self.ax = plt.subplots(figsize=(12, 8))
+                self.fig.suptitle('RRTX')
+                self.ax.set_xlim(self.env.x_range[0], self.env.x_range[1]+1)
+                self.ax.set_ylim(self.env.y_range[0], self.env.y_range[1]+1)
+                self.bg = self.fig.canvas.copy_from_bbox(self.ax.bbox)
+                self.nodes_scatter = self.ax.scatter([], [], s=4, c='gray', alpha=0.5)
+                self.edge_col = LineCollection([], colors='blue', linewidths=0.5)
+                self.path_col = LineCollection([], colors='red', linewidths=1.0)
+                self.ax.add_collection(self.edge_col)
+                self.ax.add_collection(self.path_col)
 
             # other
             self.iter_max = iter_max
 
+        # opt-in per-phase timers and counters, a time series in self.profiler.records (see profiling.py)
+        self.profiler = profiling.StepProfiler(self) if profile else None
+
     def step(self):
         # if we reached the goal, just return
         if self.reached_goal:
             return
+        self.move_robot()
+        self.plan()
 
-        # check if planning time is over
-        if not self.started and len(self.tree_nodes) > self.starting_nodes:
-            self.started = True
-        
+    def move_robot(self):
         # if planning time is over and we have a path, we can move the robot
-        if self.started and self.path_to_goal:
+        if self.ready_to_move():
             # update robot position and maybe the node it is at
-            self.s_bot, self.robot_position = self.utils.update_robot_position(
+            self.apply_motion(*self.utils.update_robot_position(
                 self.robot_position, self.s_bot, self.robot_speed, self.move_dist
-            )
-            self.distance_travelled += self.robot_speed * self.move_dist # weird but this is how it works
+            ))
+        self.check_goal()
 
+    def ready_to_move(self):
+        # check if planning time is over
+        if not self.started and len(self.tree_nodes) > self.starting_nodes:
+            self.started = True
+        return self.started and self.path_to_goal
+
+    def apply_motion(self, s_bot, robot_position):
+        # split out of move_robot() so BatchSimulator can compute the motion of many robots at once
+        self.s_bot, self.robot_position = s_bot, robot_position
+        self.distance_travelled += self.robot_speed * self.move_dist # weird but this is how it works
+
+    def check_goal(self):
         if self.s_bot.cost_to_goal < np.inf:
             self.path_to_goal = True
-            if self.s_bot == self.s_goal:
+            if self.s_bot.coincides(self.s_goal):
                 self.reached_goal = True
 
+    def plan(self, idx_changed=None):
+        # idx_changed: indices of other robots known to have moved, None to check here
         ''' MAIN ALGORITHM BEGINS '''
 
         self.search_radius = self.shrinking_ball_radius()
 
-        self.update_robot_obstacles(delta=0.5) # update other robots as obstacles of this robot
+        self.update_robot_obstacles(self.robot_obs_delta, idx_changed) # update other robots as obstacles of this robot
+
+        # no new nodes while orphans are still being cut off, they could pick an orphan as parent
+        if self.propagating:
+            return
 
         # don't add nodes past limit unless there's currently no path
         if len(self.tree_nodes) >= self.node_limit and self.path_to_goal:
             return
 
-        v = self.random_node()
-        v_nearest = self.nearest(v)
-        v = self.saturate(v_nearest, v)
+        # samples are plain (x, y) points, a node is only allocated for one with a collision free edge
+        x_rand = self.random_node()
+        v_nearest = self.nearest(x_rand)
+        x_new = self.saturate(v_nearest, x_rand)
 
-        if v and not self.utils.is_collision(v_nearest, v):
+        if not self.utils.is_collision_segment(v_nearest.x, v_nearest.y, x_new[0], x_new[1]):
+            v = self.tree.new_node(x_new)
             self.extend(v, v_nearest)
             if v.parent:
                 self.rewire_neighbours(v)
-                self.reduce_inconsistency()
+                self.reduce_inconsistency(self.repair_max_pops, self.repair_max_time)
+            else:
+                self.tree.release(v) # never joined the tree, give its slot back
+
+    def published_path(self, length, from_node=False):
+        # points along the path this robot is about to drive, from its position and about length long
+        # from_node starts at the node the robot is leaving instead, so the segments stay the same while it drives
+        path = [(self.s_bot.x, self.s_bot.y) if from_node else (self.robot_position[0], self.robot_position[1])]
+        if not (self.started and self.path_to_goal):
+            return path
+        node = self.s_bot.parent # update_robot_position() drives towards the parent of s_bot
+        while node and length > 0:
+            length -= math.hypot(node.x - path[-1][0], node.y - path[-1][1])
+            path.append((node.x, node.y))
+            node = node.parent
+        return path
 
     def set_other_robots(self, other_robots):
         # set the other robots that this robot should know about, called by multirobot.py
         self.other_robots = other_robots
         self.other_robot_obstacles = []
+        if self.predictor is not None:
+            self.predictor.clear()
+        self.robot_blocked = {}
         for robot in other_robots:
             self.other_robot_obstacles.append([
                     robot.robot_position[0],
@@ -231,18 +360,16 @@ class RRTX:
         if not V_near:
             V_near.append(v_nearest)
 
-        self.find_parent(v, V_near)
+        collisions = self.find_parent(v, V_near)
         if not v.parent:
             return
         self.add_node(v)
         # child has already been added to parent's children in call to set_parent()
-        for u in V_near:
-            # collisions are symmetric for us
-            if not self.utils.is_collision(u, v):
-                v.N_o_plus.add(u)
-                v.N_o_minus.add(u)
-                u.N_r_plus.add(v)
-                u.N_r_minus.add(v)
+        # collisions are symmetric for us, so the edges checked for the parent are the neighbour edges too
+        for u, collides in zip(V_near, collisions):
+            if not collides:
+                v.add_original_neighbor(u)
+                u.add_running_neighbor(v)
                 
     def update_click_obstacles(self, event):
         # Algorithm 8, for obstacles added by clicking
@@ -252,7 +379,6 @@ class RRTX:
             self.add_new_obstacle([x, y, 2])
             self.propagate_descendants()
             self.verify_queue(self.s_bot)
-            heapq.heapify(self.Q)
             self.reduce_inconsistency()
         if event.button == 3 : # remove obstacle on right click
             # find which obstacle was clicked
@@ -261,44 +387,148 @@ class RRTX:
                 self.remove_obstacle(obs, shape)
             self.reduce_inconsistency()
 
-    def update_robot_obstacles(self, delta):
+    def update_robot_obstacles(self, delta, idx_changed=None):
         # Algorithm 8, for robot obstacles
         # delta is distance that robot needs to move for obstackes to be updated
-        idx_changed = []
-        for idx, other in enumerate(self.other_robots):
-            # check if this other robot has moved significantly
-            if math.hypot(other.robot_position[0] - self.other_robot_obstacles[idx][0],
-                          other.robot_position[1] - self.other_robot_obstacles[idx][1]) > delta:
-                idx_changed.append(idx)
-
-        # remove obstacles from their old positions
-        for idx in idx_changed:
-            self.remove_obstacle(self.other_robot_obstacles[idx], 'robot')
-
-        self.reduce_inconsistency()
-
-        # add obstacles to their new positions
-        for idx in idx_changed:
-            # first manage obstacle lists
-            self.other_robot_obstacles[idx] = [
-                self.other_robots[idx].robot_position[0], 
-                self.other_robots[idx].robot_position[1], 
+        # idx_changed can be passed in by a caller that has already done this check (BatchSimulator)
+        if self.predictor is not None:
+            idx_changed = []
+            self.update_predicted_obstacles()
+        elif idx_changed is None:
+            idx_changed = []
+            for idx, other in enumerate(self.other_robots):
+                # check if this other robot has moved significantly
+                if math.hypot(other.robot_position[0] - self.other_robot_obstacles[idx][0],
+                              other.robot_position[1] - self.other_robot_obstacles[idx][1]) > delta:
+                    idx_changed.append(idx)
+
+        # move obstacles to their new positions, all in one repair pass
+        if idx_changed:
+            self.move_obstacles({idx: [
+                self.other_robots[idx].robot_position[0],
+                self.other_robots[idx].robot_position[1],
                 self.other_robots[idx].robot_radius
-            ]
-            self.add_new_obstacle(self.other_robot_obstacles[idx], robot=True)
+            ] for idx in idx_changed})
+
+        # with a repair budget, each part only gets the time the ones before it left over
+        start = time.perf_counter()
+        if not self.update_freed_nodes(self.repair_max_pops, self.repair_time_left(start)):
+            return
+        if not self.propagate_descendants(self.repair_max_pops, self.repair_time_left(start)):
+            return
+        self.verify_queue(self.s_bot)
+        self.reduce_inconsistency(self.repair_max_pops, self.repair_time_left(start))
 
+    def repair_time_left(self, start):
+        if self.repair_max_time is None:
+            return None
+        return max(0.0, self.repair_max_time - (time.perf_counter() - start))
+
+    def update_freed_nodes(self, max_nodes=None, max_time=None):
+        # nodes next to edges a robot moved off of look for a better parent
+        # returns False if it stopped after max_nodes nodes or max_time seconds, call again to resume
+        deadline = None if max_time is None else time.perf_counter() + max_time
+        done = 0
+        while self.freed_nodes:
+            if self.out_of_budget(done, max_nodes, deadline):
+                return False
+            node = self.freed_nodes.popleft()
+            if node in self.tree_nodes and node not in self.orphan_nodes: # could have been cut off since
+                node.update_LMC(self.orphan_nodes, self.search_radius, self.epsilon, self.utils)
+                if node.lmc != node.cost_to_goal:
+                    self.verify_queue(node)
+            done += 1
+        return True
+
+    def move_obstacle(self, idx, obs):
+        # move the obstacle of other robot idx to obs = (x, y, r) and repair the tree
+        self.move_obstacles({idx: obs})
+        self.update_freed_nodes()
         self.propagate_descendants()
         self.verify_queue(self.s_bot)
-        heapq.heapify(self.Q)
         self.reduce_inconsistency()
 
+    def move_obstacles(self, moves):
+        # Algorithms 11 and 12 for moving robot obstacles, moves: other robot index -> new (x, y, r)
+        # instead of removing the old disk and adding the new one, only edges that changed state are touched:
+        # edges blocked by the old disk only are restored, edges blocked by the new disk only are cut
+        # callers still need to run propagate_descendants() and reduce_inconsistency()
+        idxs = list(moves)
+        for idx in idxs:
+            self.other_robot_obstacles[idx] = moves[idx]
+        self.set_blocked_edges(dict(zip(idxs, self.edges_in_circles([moves[idx] for idx in idxs]))))
+
+    def update_predicted_obstacles(self):
+        # block the corridor of every other robot whose prediction conflicts with the path ahead of this robot
+        # blocked edges stay blocked until that robot gets a new prediction
+        path = self.published_path(self.robot_speed * self.move_dist * self.predictor.horizon, from_node=True)
+        path_segs = [(a[0], a[1], b[0], b[1]) for a, b in zip(path[:-1], path[1:])]
+        blocked = {}
+        for idx, other in enumerate(self.other_robots):
+            new_prediction = self.predictor.observe(idx, other)
+            if path_segs and any(self.predictor.segments_collide(idx, path_segs)):
+                blocked[idx] = self.edges_in_corridor(idx)
+            elif new_prediction and self.robot_blocked.get(idx):
+                blocked[idx] = set()
+        if blocked:
+            self.set_blocked_edges(blocked)
+
+    def set_blocked_edges(self, blocked):
+        # blocked: other robot index -> set of edges (v, u) its obstacle blocks from now on
+        blocked_before = set().union(*self.robot_blocked.values())
+        self.robot_blocked.update(blocked)
+        blocked_after = set().union(*self.robot_blocked.values())
+
+        # restore edges the robots moved off of, unless a static obstacle was added on them meanwhile
+        freed = [(v, u) for v, u in blocked_before - blocked_after if (u, v) not in blocked_after]
+        if freed:
+            hits = self.utils.is_collision_edges(freed)
+            affected = set()
+            for (v, u), hit in zip(freed, hits):
+                if not hit:
+                    self.tree.discard(self.tree.infinite_dist_nodes, v.idx, u)
+                    self.tree.discard(self.tree.infinite_dist_nodes, u.idx, v)
+                    affected.update((v, u))
+            self.freed_nodes.extend(affected & self.tree_nodes - self.orphan_nodes)
+            if self.repair_max_pops is None and self.repair_max_time is None:
+                self.update_freed_nodes() # right away, before the edges below are cut
+
+        # cut edges the robots moved onto
+        for v, u in blocked_after - blocked_before:
+            if (u, v) in blocked_before:
+                continue
+            v.add_infinite_dist(u)
+            u.add_infinite_dist(v)
+            if v.parent and v.parent == u:
+                self.verify_orphan(v)
+
+    def edges_in_circles(self, circles):
+        # for each circle (x, y, r), the set of edges (v, u) that intersect it, checked in one batch
+        nearby_nodes = set()
+        for x, y, r in circles:
+            nearby_nodes.update(self.find_nodes_in_range((x, y), r + self.step_len + self.utils.delta))
+        E = [(v, u) for v in nearby_nodes for u in v.all_out_neighbors()]
+        if not E:
+            return [set() for _ in circles]
+        hits = self.utils.is_intersect_circles_batch([(u.x, u.y, v.x, v.y) for v, u in E], circles)
+        return [{E[k] for k in np.flatnonzero(hits[:, j])} for j in range(len(circles))]
+
+    def edges_in_corridor(self, idx):
+        # edges (v, u) that other robot idx is predicted to sweep over
+        nearby_nodes = set()
+        for x, y, r in self.predictor.search_regions(idx, self.step_len + self.utils.delta):
+            nearby_nodes.update(self.find_nodes_in_range((x, y), r))
+        E = [(v, u) for v in nearby_nodes for u in v.all_out_neighbors()]
+        hits = self.predictor.segments_collide(idx, [(u.x, u.y, v.x, v.y) for v, u in E])
+        return {edge for edge, hit in zip(E, hits) if hit}
+
     def add_new_obstacle(self, obs, robot=False):
         # Algorithm 12
         x, y, r = obs
         if not robot:
             print("Add circle obstacle at: s =", x, ",", "y =", y)
             self.obs_circle.append(obs)
-            self.plotting.update_obs(self.obs_circle, self.obs_boundary, self.obs_rectangle) # for plotting obstacles
+            self.update_plot_obs() # for plotting obstacles
             self.utils.update_obs(self.obs_circle, self.obs_boundary, self.obs_rectangle) # for collision checking
         else:
             self.obs_robot.append(obs)
@@ -306,22 +536,16 @@ class RRTX:
         self.update_gamma() # free space volume changed, so gamma must change too
 
         # get all edges that intersect the new circle obstacle
-        nearby_nodes = self.find_nodes_in_range((x, y), r + self.step_len + self.utils.delta)
-        E_O = [(v, u) for v in nearby_nodes for u in v.all_out_neighbors() 
-               if self.utils.is_intersect_circle(u.n, v.n, (x, y), r)]
-        if not E_O:
-            return
+        E_O, = self.edges_in_circles([(x, y, r)])
 
         for v, u in E_O:
-            v.infinite_dist_nodes.add(u)
-            u.infinite_dist_nodes.add(v)
+            v.add_infinite_dist(u)
+            u.add_infinite_dist(v)
             if v.parent and v.parent == u:
                 self.verify_orphan(v)
                 # should theoretically check if the robot is on this edge now, but we do not
                 # v.parent.children.remove(v) # these two lines are from the Julia code
                 # v.parent = None 
-                
-        heapq.heapify(self.Q) # reheapify after removing a bunch of elements and ruining queue
 
     def remove_obstacle(self, obs, shape):
         # Algorithm 11
@@ -336,12 +560,12 @@ class RRTX:
         # remove obstacle from list if applicable
         if shape == 'circle':
             self.obs_circle.remove(obs)
-            self.plotting.update_obs(self.obs_circle, self.obs_boundary, self.obs_rectangle) # for plotting obstacles
+            self.update_plot_obs() # for plotting obstacles
             self.utils.update_obs(self.obs_circle, self.obs_boundary, self.obs_rectangle) # for collision checking\
             self.update_gamma() # free space volume changed, so gamma must change too
         elif shape == 'rectangle':
             self.obs_rectangle.remove(obs)
-            self.plotting.update_obs(self.obs_circle, self.obs_boundary, self.obs_rectangle) # for plotting obstacles
+            self.update_plot_obs() # for plotting obstacles
             self.utils.update_obs(self.obs_circle, self.obs_boundary, self.obs_rectangle) # for collision checking\
             self.update_gamma() # free space volume changed, so gamma must change too
 
@@ -349,138 +573,227 @@ class RRTX:
             node.update_LMC(self.orphan_nodes, self.search_radius, self.epsilon, self.utils)
             if node.lmc != node.cost_to_goal:
                 self.verify_queue(node)
-        heapq.heapify(self.Q)
  
     def verify_orphan(self, v):
         # Algorithm 10
         # if v is in Q, remove it from Q and add it to orphan_nodes
-        key = self.node_in_queue(v)
-        if key is not None:
-            self.Q.remove((key, v))
+        self.Q.remove(v)
         self.orphan_nodes.add(v)
-
-    def propagate_descendants(self):
-        # Algorithm 9
+        if self.propagating:
+            # its subtree still has to be found, the clearing order has to include it, and it may be above the robot
+            self.orphan_queue.append(v)
+            self.orphans_to_clear = None
+            self.robot_orphan_check = True
+
+    def propagate_descendants(self, max_nodes=None, max_time=None):
+        # Algorithm 9, returns False if it stopped after max_nodes nodes or max_time seconds, call again to resume
         if not self.orphan_nodes:
-            return
+            return True
+        deadline = None if max_time is None else time.perf_counter() + max_time
+        done = 0
+
+        if not self.propagating:
+            self.propagating = True
+            self.orphan_queue = deque(list(self.orphan_nodes))
+            self.robot_orphan_check = True
+
+        # check if robot node got orphaned, right away so the robot stops before its subtree is found
+        # once per propagation (and again if verify_orphan() added an orphan), not on every resumed call
+        if self.robot_orphan_check:
+            self.robot_orphan_check = False
+            node = self.s_bot
+            while node:
+                if node in self.orphan_nodes:
+                    # print('robot node got orphaned')
+                    self.path_to_goal = False
+                    self.s_bot.cost_to_goal = np.inf # or check_goal() would find the path again
+                    break
+                node = node.parent
+
         # recursively add children of nodes in orphan_nodes to orphan_nodes using BFS
-        orphan_queue = deque(list(self.orphan_nodes))
-        while orphan_queue:
-            node = orphan_queue.pop()
+        while self.orphan_queue:
+            if self.out_of_budget(done, max_nodes, deadline):
+                return False
+            node = self.orphan_queue.pop()
             for child in node.children:
-                orphan_queue.append(child)
+                self.orphan_queue.append(child)
                 self.orphan_nodes.add(child)
-
-        # check if robot node got orphaned
-        if self.s_bot in self.orphan_nodes:
-            # print('robot node got orphaned')
-            self.path_to_goal = False
-        
-        # put all outgoing neighbours of orphan nodes in Q and tell them to rewire
-        for v in self.orphan_nodes:
+            done += 1
+
+        if self.orphans_to_clear is None:
+            self.orphans_to_clear = deque(v for v in self.orphan_nodes if v not in self.orphans_cleared)
+        while self.orphans_to_clear:
+            if self.out_of_budget(done, max_nodes, deadline):
+                return False
+            v = self.orphans_to_clear.popleft()
+            # put all outgoing neighbours of orphan nodes in Q and tell them to rewire
             for u in (v.all_out_neighbors().union(set([v.parent]))) - self.orphan_nodes:
                 u.cost_to_goal = np.inf
                 self.verify_queue(u)
-        heapq.heapify(self.Q) # reheapify after keys changed to re-sort queue
-
-        # clear orphans, set their costs to infinity, empty their parent
-        for v in self.orphan_nodes:
-            # self.orphan_nodes.remove(v)
+            # clear orphans, set their costs to infinity, empty their parent
             v.cost_to_goal = np.inf
             v.lmc = np.inf
             if v.parent:
-                v.infinite_dist_nodes.add(v.parent)
-                v.parent.infinite_dist_nodes.add(v)
-                v.parent.children.remove(v)
+                v.add_infinite_dist(v.parent)
+                v.parent.add_infinite_dist(v)
+                v.parent.remove_child(v)
                 v.parent = None
-            try:
-                self.tree_nodes.remove(v) # NOT IN THE PSEUDOCODE
-                self.kd_tree.remove(v)
-            except ValueError:
-                pass
+            self.tree_nodes.discard(v) # NOT IN THE PSEUDOCODE
+            self.spatial_index.remove(v)
+            self.orphans_cleared.add(v)
+            done += 1
 
         self.orphan_nodes = set([]) # reset orphan_nodes to empty set
+        self.orphans_cleared = set()
+        self.orphans_to_clear = None
+        self.propagating = False
+        return True
+
+    @staticmethod
+    def out_of_budget(done, max_nodes, deadline):
+        return (max_nodes is not None and done >= max_nodes) or (deadline is not None and time.perf_counter() >= deadline)
 
     def verify_queue(self, v):
         # Algorithm 13
-        # this does not do the updating, it is done after all changes are made (in propagate_descendants)
-        # if v is in Q, update its cost and position, otherwise just add it
-        key = self.node_in_queue(v)
-        # if v is already in Q, remove it first before adding it with updated cost
-        if key is not None:
-            self.Q.remove((key, v))
-        heapq.heappush(self.Q, (v.get_key(), v))
-
-    def reduce_inconsistency(self):
-        # Algorithm 5
-        while len(self.Q) > 0 and (self.Q[0][0] < self.s_bot.get_key() \
-                or self.s_bot.lmc != self.s_bot.cost_to_goal or np.isinf(self.s_bot.cost_to_goal) \
-                or self.s_bot in list(zip(*self.Q))[1]):
-
-            try:
-                v = heapq.heappop(self.Q)[1]
-            except TypeError:
-                print('something went wrong with the queue')
+        # if v is in Q, update its key in place (decrease/increase-key), otherwise just add it
+        self.Q.push(v, v.get_key())
+
+    def reduce_inconsistency(self, max_pops=None, max_time=None):
+        # Algorithm 5, returns False if it stopped after max_pops pops or max_time seconds, the rest stays in Q
+        deadline = None if max_time is None else time.perf_counter() + max_time
+        pops = 0
+        while self.robot_inconsistent():
+            if self.out_of_budget(pops, max_pops, deadline):
+                return False
+            pops += 1
+            v = self.Q.pop()
         
             if v.cost_to_goal - v.lmc > self.epsilon:
                 v.update_LMC(self.orphan_nodes, self.search_radius, self.epsilon, self.utils)
                 self.rewire_neighbours(v)
             
             v.cost_to_goal = v.lmc
+        return True
+
+    def robot_inconsistent(self):
+        # the loop condition of reduce_inconsistency()
+        return bool(self.Q) and (self.Q.top_key() < self.s_bot.get_key() \
+                or self.s_bot.lmc != self.s_bot.cost_to_goal or np.isinf(self.s_bot.cost_to_goal) \
+                or self.s_bot in self.Q)
+
+    def repair_backlog(self):
+        # outstanding repair work: orphans still to cut off, nodes still to look for a parent after an edge was
+        # freed, queued nodes, and whether the robot's node is consistent yet
+        orphans = len(self.orphan_nodes) - len(self.orphans_cleared) if self.propagating else len(self.orphan_nodes)
+        return {
+            'orphans': orphans,
+            'freed': len(self.freed_nodes),
+            'queued': len(self.Q),
+            'robot_consistent': not self.orphan_nodes and not self.robot_inconsistent(),
+        }
+
+    def save_tree(self, path):
+        # saves the tree for planners with the same goal and obstacles to start from, see tree_file.py
+        # edges blocked by other robots and unfinished repairs belong to this run, not to the map
+        if self.orphan_nodes or self.freed_nodes or any(self.robot_blocked.values()):
+            raise ValueError('save_tree() needs a tree without edges blocked by other robots or repairs left to do')
+        tree = self.tree
+        n = len(tree.handles)
+        arrays = {name: tree.array(name) for name in ('x', 'y', 'cost_to_goal', 'lmc', 'parent')}
+        for name in RELATIONS:
+            arrays[name + '_offsets'], arrays[name + '_slots'] = tree_file.pack(getattr(tree, name), n)
+        queued = list(self.Q) # in heap order, pushing them back in this order rebuilds the same heap
+        tree_file.save(path, self, 'RRTX', free_slots=np.array(tree.free_slots, dtype=np.int64),
+                       tree_nodes=np.array(sorted(node.idx for node in self.tree_nodes), dtype=np.int64),
+                       goal_slot=self.s_goal.idx, queued=np.array([node.idx for node in queued], dtype=np.int64),
+                       queued_keys=np.array([self.Q.get_key(node) for node in queued], dtype=float).reshape(-1, 2),
+                       **arrays)
+
+    def load_tree(self, path):
+        # replaces the tree with one saved by save_tree(), ValueError if it was grown for another goal or map
+        # the robot stays where it is, and is on the new tree if a node sits at the node it is at
+        data = tree_file.load(path, self, 'RRTX')
+        tree = tree_store.TreeStore.from_arrays(Node, data['x'], data['y'], data['cost_to_goal'], data['lmc'],
+                                                data['parent'], data['free_slots'].tolist())
+        handles = tree.handles
+        for name in RELATIONS:
+            setattr(tree, name, tree_file.unpack(data[name + '_offsets'], data[name + '_slots'], handles))
+        bot = (self.s_bot.x, self.s_bot.y)
+        self.tree = tree
+        self.s_goal = handles[int(data['goal_slot'])]
+        slots = data['tree_nodes']
+        nodes = [handles[idx] for idx in slots.tolist()]
+        self.tree_nodes = set(nodes)
+        self.spatial_index.clear()
+        self.spatial_index.bulk_insert(nodes, tree.coords(slots))
+        self.Q.clear() # in place, a StepProfiler keeps its counters on this queue object
+        for idx, key in zip(data['queued'].tolist(), data['queued_keys'].tolist()):
+            self.Q.push(handles[idx], tuple(key))
+
+        # repairs of the old tree have nothing left to do, and no edge of the new one is blocked by other robots yet
+        self.orphan_nodes = set()
+        self.propagating = False
+        self.orphan_queue = deque()
+        self.robot_orphan_check = False
+        self.orphans_to_clear = None
+        self.orphans_cleared = set()
+        self.freed_nodes = deque()
+        self.set_other_robots(self.other_robots)
+
+        node = self.spatial_index.nearest(bot)
+        if node is not None and math.hypot(node.x - bot[0], node.y - bot[1]) < 1e-6:
+            self.s_bot = node
+            self.path_to_goal = True
+        else:
+            self.s_bot = tree.new_node(bot)
+            self.path_to_goal = False
 
     def add_node(self, node_new):
-        self.all_nodes_coor.append(np.array([node_new.x, node_new.y])) # for plotting
-        self.tree_nodes.append(node_new)
-        self.kd_tree.add(node_new)
+        self.tree_nodes.add(node_new)
+        self.spatial_index.insert(node_new)
         # if new node is at start, then path to goal is found
-        if node_new == self.s_bot:
+        if node_new.coincides(self.s_bot):
             self.s_bot = node_new
             self.path_to_goal = True
-            self.update_path(self.s_bot) # update path to goal for plotting
 
-    def saturate(self, v_nearest, v):
-        dist, theta = self.get_distance_and_angle(v_nearest, v)
-        dist = min(self.step_len, dist)
-        node_new = Node((v_nearest.x + dist * math.cos(theta),
-                         v_nearest.y + dist * math.sin(theta)))
-        return node_new
+    def saturate(self, v_nearest, pos):
+        # the point at most step_len from v_nearest towards pos
+        dx, dy = pos[0] - v_nearest.x, pos[1] - v_nearest.y
+        dist, theta = min(self.step_len, math.hypot(dx, dy)), math.atan2(dy, dx)
+        return (v_nearest.x + dist * math.cos(theta), v_nearest.y + dist * math.sin(theta))
 
     def find_parent(self, v, U):
-        # Algorithm 6
+        # Algorithm 6, cheapest collision free u in U becomes the parent
+        # returns the collision flag of every edge (u, v), U itself is left as it is
         costs = [math.sqrt((v.x - u.x)**2 + (v.y - u.y)**2) + u.lmc for u in U]
-        if not costs:
-            return
-        min_idx = int(np.argmin(costs))
-        best_u = U[min_idx]
-        if not self.utils.is_collision(best_u, v):
-            v.set_parent(best_u)
-            v.lmc = costs[min_idx]
-        else:
-            del U[min_idx]
-            self.find_parent(v, U)
+        collisions = self.utils.is_collision_batch(U, v)
+        # stable sort keeps argmin's tie breaking
+        for idx in np.argsort(costs, kind='stable'):
+            if not collisions[idx]:
+                v.set_parent(U[idx])
+                v.lmc = costs[idx]
+                break
+        return collisions
         
     def rewire_neighbours(self, v):
         # Algorithm 4
         if v.cost_to_goal - v.lmc > self.epsilon:
             v.cull_neighbors(self.search_radius)
-            for u in v.all_in_neighbors() - set([v.parent]):
-                if u.lmc > v.distance(u) + v.lmc and not self.utils.is_collision(u, v): # added collision check (Julia)
+            U = [u for u in v.all_in_neighbors() - set([v.parent]) if u.lmc > v.distance(u) + v.lmc]
+            collisions = self.utils.is_collision_batch(U, v) # added collision check (Julia)
+            for u, collides in zip(U, collisions):
+                if not collides:
                     u.lmc = v.distance(u) + v.lmc
                     u.set_parent(v)
                     if u.cost_to_goal - u.lmc > self.epsilon:
                         self.verify_queue(u)
-        heapq.heapify(self.Q)
-
-        self.update_path(self.s_bot) # update path to goal for plotting
 
     def random_node(self):
-        delta = self.utils.delta
-
-        if not self.path_to_goal and np.random.random() < self.bot_sample_rate:
-            return Node((self.s_bot.x, self.s_bot.y))
+        # (x, y) of the next sample
+        if not self.path_to_goal and self.rng.random() < self.bot_sample_rate:
+            return (self.s_bot.x, self.s_bot.y)
 
-        return Node((np.random.uniform(self.x_range[0] + delta, self.x_range[1] - delta),
-                     np.random.uniform(self.y_range[0] + delta, self.y_range[1] - delta)))
+        return self.sampler.sample(self)
 
     def update_gamma(self):
         '''
@@ -503,26 +816,33 @@ class RRTX:
         return min(self.step_len, self.gamma * np.log(len(self.tree_nodes)+1) / len(self.tree_nodes))
 
     def near(self, v):
-        return self.kd_tree.search_nn_dist((v.x, v.y), self.search_radius)
+        return self.spatial_index.radius_query((v.x, v.y), self.search_radius)
 
-    def nearest(self, v):
-        return self.kd_tree.search_nn((v.x, v.y))[0].data
+    def nearest(self, pos):
+        return self.spatial_index.nearest(pos)
 
-    def update_path(self, node):
-        self.path = []
+    @property
+    def path(self):
+        # segments of the current path to goal, only built when a renderer asks for them
+        path = []
+        node = self.s_bot
         while node.parent:
-            self.path.append(np.array([[node.x, node.y], [node.parent.x, node.parent.y]]))
+            path.append(np.array([[node.x, node.y], [node.parent.x, node.parent.y]]))
             node = node.parent
+        return path
+
+    def update_plot_obs(self):
+        if self.plotting is not None:
+            self.plotting.update_obs(self.obs_circle, self.obs_boundary, self.obs_rectangle)
+
+    @property
+    def all_nodes_coor(self):
+        # (N, 2) coordinates of every node the tree still stores, for the stray nodes plot
+        return self.tree.coords(self.tree.used_slots())
     
     def node_in_queue(self, node):
-        if not self.Q:
-            return None
-        keys, nodes = list(zip(*self.Q))
-        try:
-            idx = nodes.index(node)
-            return keys[idx]
-        except ValueError:
-            return None
+        # returns the key node is queued with, or None if it is not in Q
+        return self.Q.get_key(node)
 
     def find_obstacle(self, a , b):
         for (x, y, r) in self.obs_circle:
@@ -534,13 +854,7 @@ class RRTX:
                 return ([x, y, w, h], 'rectangle')
 
     def find_nodes_in_range(self, pos, r):
-        return self.kd_tree.search_nn_dist((pos[0], pos[1]), r)
-
-    @staticmethod
-    def get_distance_and_angle(node_start, node_end):
-        dx = node_end.x - node_start.x
-        dy = node_end.y - node_start.y
-        return math.hypot(dx, dy), math.atan2(dy, dx)
+        return self.spatial_index.radius_query((pos[0], pos[1]), r)
 
     @staticmethod
     def get_distance(node_start, node_end):
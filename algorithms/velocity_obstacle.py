@@ -1,13 +1,12 @@
 import math
 import numpy as np
-import matplotlib.pyplot as plt
 
-import env, plotting
+import env, spatial_index
 
 
 class Velocity_Obstacle:
     def __init__(self, start, goal, robot_radius, move_dist, iter_max, obstacle_FOS, robot_FOS, obstacle_radius,
-                 plot_params=None):
+                 plot_params=None, velocity_grid=(20, 5), headless=False):
         self.start = np.append(np.array(start), [0, 0])  # x, y, velx, vely
         self.goal = np.append(np.array(goal), [0, 0])
 
@@ -24,14 +23,16 @@ class Velocity_Obstacle:
 
         self.vmax = 1
         self.desired_vel = 0
+        self.set_velocity_grid(*velocity_grid) # (directions, speeds) of the candidate velocities
 
-        self.obstacle_robots = None
-        self.obs_robot = []
         self.other_robots = None
 
         self.obstacle_FOS = obstacle_FOS
         self.robot_FOS = robot_FOS
         self.obstacle_radius = obstacle_radius  # how close robot needs to be to see obstacle
+        # how close robot needs to be to see a rectangle or boundary wall: the safety distance plus one step
+        # a wall's closest point is a static cone with no time horizon, seen from further away it blocks goals near walls
+        self.wall_radius = (2 * robot_radius + obstacle_FOS) * robot_radius + self.vmax * self.timestep
 
         self.env = env.Env()
         self.x_range = self.env.x_range
@@ -40,20 +41,36 @@ class Velocity_Obstacle:
         self.obs_rectangle = self.env.obs_rectangle
         self.obs_boundary = self.env.obs_boundary
 
+        # broad phase over obstacles and other robots, own one unless set_broad_phase() shares one between agents
+        # (share_broad_phase() does that for the agents of a multi-robot run), the own one is rebuilt every step
+        self.broad_phase = spatial_index.ObstacleGrid(max(obstacle_radius, 1.0), self.obs_circle,
+                                                      self.obs_rectangle + self.obs_boundary)
+        self.shared_broad_phase = False
+
         self.plot_params = plot_params
-        self.plotting = plotting.Plotting(start, goal)
+        # headless agents never import matplotlib, renderers only need plot_params and the robot state
+        if headless:
+            self.plotting = None
+        else:
+            import plotting
+            self.plotting = plotting.Plotting(start, goal)
 
     def set_other_robots(self, other_robots):
         self.other_robots = other_robots
-        self.obstacle_robots = []
-        for robot in other_robots:
-            self.obstacle_robots.append(robot.robot_state)
+        if not self.shared_broad_phase:
+            self.broad_phase.rebuild(other_robots)
+
+    def set_broad_phase(self, broad_phase):
+        # share one ObstacleGrid between agents, whoever owns it calls rebuild() with all robots once per tick
+        self.broad_phase = broad_phase
+        self.shared_broad_phase = True
 
     def update_other_robots(self):
-        self.obs_robot = []
-        for idx, robot in enumerate(self.other_robots):
-            self.obstacle_robots[idx] = robot.robot_state
-            self.obs_robot.append(list(np.append(robot.robot_state[:2], robot.robot_radius)))
+        if not self.shared_broad_phase:
+            self.broad_phase.rebuild(self.other_robots)
+
+    def update_static_obstacles(self):
+        self.broad_phase.set_static(self.obs_circle, self.obs_rectangle + self.obs_boundary)
 
     def update_click_obstacles(self, event):
         if event.button == 1:  # add obstacle
@@ -69,17 +86,24 @@ class Velocity_Obstacle:
         x, y, r = obs
         print("Add circle obstacle at: s =", x, ",", "y =", y)
         self.obs_circle.append(obs)
-        self.plotting.update_obs(self.obs_circle, self.obs_boundary, self.obs_rectangle)  # for plotting obstacles
+        self.update_plot_obs()  # for plotting obstacles
+        self.update_static_obstacles()
 
     def remove_obstacle(self, obs, shape):
         # remove obstacle from list if applicable
         if shape == 'circle':
             self.obs_circle.remove(obs)
-            self.plotting.update_obs(self.obs_circle, self.obs_boundary, self.obs_rectangle)  # for plotting obstacles
+            self.update_plot_obs()  # for plotting obstacles
+            self.update_static_obstacles()
 
         elif shape == 'rectangle':
             self.obs_rectangle.remove(obs)
-            self.plotting.update_obs(self.obs_circle, self.obs_boundary, self.obs_rectangle)  # for plotting obstacles
+            self.update_plot_obs()  # for plotting obstacles
+            self.update_static_obstacles()
+
+    def update_plot_obs(self):
+        if self.plotting is not None:
+            self.plotting.update_obs(self.obs_circle, self.obs_boundary, self.obs_rectangle)
 
     def find_obstacle(self, a, b):
         for (x, y, r) in self.obs_circle:
@@ -93,7 +117,7 @@ class Velocity_Obstacle:
     def step(self):
         self.started = True
         # if reached goal, stop and return
-        if (abs(self.robot_state[0] - self.goal[0]) < 0.01) and (abs(self.robot_state[1] - self.goal[1]) < 0.01):
+        if self.reached_goal:
             return
         if self.other_robots is not None:
             self.update_other_robots()
@@ -107,6 +131,7 @@ class Velocity_Obstacle:
 
     def single_robot_simulation(self):
         # start with plotting stuff
+        import matplotlib.pyplot as plt
 
         self.fig, self.ax = plt.subplots(figsize=(12, 8))
         self.fig.suptitle('Velocity Obstacle Simulation')
@@ -134,132 +159,88 @@ class Velocity_Obstacle:
     def compute_desired_velocity(self):
         disp_vec = (self.goal - self.robot_state)[:2]
         norm = np.linalg.norm(disp_vec)
-        if norm < self.robot_radius / 5:
-            return np.zeros(2)
+        if norm < 1e-12:
+            # sitting on the goal, there is no direction to head in
+            self.desired_vel = np.zeros(2)
+            return
         disp_vec = disp_vec / norm
-        np.shape(disp_vec)
 
-        self.desired_vel = self.vmax * disp_vec
+        # full speed towards the goal, slowing down within one step of it
+        self.desired_vel = min(self.vmax, norm / self.timestep) * disp_vec
 
     def compute_velocity(self):
         pA = self.robot_state[:2]
-        vA = self.robot_state[-2:]
         # Compute the constraints
         # for each velocity obstacles
         robot_obstacles, circle_obstacles = self.nearby_obstacles()
-        number_of_obstacles = len(robot_obstacles) + len(circle_obstacles)
-        Amat = np.empty((number_of_obstacles * 2, 2))
-        bvec = np.empty((number_of_obstacles * 2))
-
-        for i in range(len(robot_obstacles)):
-            # other robot obstacles
-            obstacle = robot_obstacles[i]  # obstacle = [x , y, vx, vy]
-            pB = obstacle[:2]
-            vB = obstacle[2:]
-            dispBA = pA - pB
-            distBA = np.linalg.norm(dispBA)  # displacement vector between robot and obstacle
-            thetaBA = np.arctan2(dispBA[1], dispBA[0])
-            if (
-                    2 * self.robot_radius + self.robot_FOS) * self.robot_radius > distBA:  # if robot is close enough to obstacle
-                distBA = (2 * self.robot_radius + self.robot_FOS) * self.robot_radius
-            phi_obst = np.arcsin((2 * self.robot_radius + self.robot_FOS) * self.robot_radius / distBA)
-            phi_left = thetaBA + phi_obst
-            phi_right = thetaBA - phi_obst
-
-            # VO
-            translation = vB
-            Atemp, btemp = self.create_constraints(translation, phi_left, "left")
-            Amat[i * 2, :] = Atemp
-            bvec[i * 2] = btemp
-            Atemp, btemp = self.create_constraints(translation, phi_right, "right")
-            Amat[i * 2 + 1, :] = Atemp
-            bvec[i * 2 + 1] = btemp
-
-        for j in range(len(circle_obstacles)):
-            # circle obstacle
-            obstacle = circle_obstacles[j]
-            pB = np.array(obstacle[:2])
-            vB = np.array([0, 0])  # static obstacle
-            dispBA = pA - pB  # distance between robot and closest edge of obstacle
-            distBA = np.linalg.norm(dispBA) - obstacle[2]  # displacement vector between robot and obstacle
-            thetaBA = np.arctan2(dispBA[1], dispBA[0])
-            if (
-                    2 * self.robot_radius + self.obstacle_FOS) * self.robot_radius > distBA:  # if robot is close enough to obstacle
-                distBA = (2 * self.robot_radius + self.obstacle_FOS) * self.robot_radius
-            phi_obst = np.arcsin((2 * self.robot_radius + self.obstacle_FOS) * self.robot_radius / distBA)
-            phi_left = thetaBA + phi_obst
-            phi_right = thetaBA - phi_obst
-
-            # VO
-            i = j + len(robot_obstacles)
-            translation = vB
-            Atemp, btemp = self.create_constraints(translation, phi_left, "left")
-            Amat[i * 2, :] = Atemp
-            bvec[i * 2] = btemp
-            Atemp, btemp = self.create_constraints(translation, phi_right, "right")
-            Amat[i * 2 + 1, :] = Atemp
-            bvec[i * 2 + 1] = btemp
-
-        # Create search-space
-        th = np.linspace(0, 2 * np.pi, 20)
-        vel = np.linspace(0, self.vmax, 5)
-
-        vv, thth = np.meshgrid(vel, th)
-
-        vx_sample = (vv * np.cos(thth)).flatten()
-        vy_sample = (vv * np.sin(thth)).flatten()
-
-        v_sample = np.stack((vx_sample, vy_sample))
+        n_robot, n_circle = len(robot_obstacles), len(circle_obstacles)
+        M = n_robot + n_circle
+        if M == 0:
+            feasible = self.no_constraints
+        else:
+            # stack all obstacles: position, velocity (translation of the VO), distance and safety distance
+            pB = np.empty((M, 2))
+            vB = np.zeros((M, 2)) # circle obstacles are static
+            dist_extra = np.zeros(M)
+            if n_robot:
+                robots = np.asarray(robot_obstacles, dtype=float).reshape(-1, 4)
+                pB[:n_robot] = robots[:, :2]
+                vB[:n_robot] = robots[:, 2:]
+            if n_circle:
+                circles = np.asarray(circle_obstacles, dtype=float).reshape(-1, 3)
+                pB[n_robot:] = circles[:, :2]
+                dist_extra[n_robot:] = circles[:, 2] # distance to the closest edge of the obstacle
+            safe_dist = np.full(M, (2 * self.robot_radius + self.obstacle_FOS) * self.robot_radius)
+            safe_dist[:n_robot] = (2 * self.robot_radius + self.robot_FOS) * self.robot_radius
 
-        v_satisfying_constraints = self.check_constraints(v_sample, Amat, bvec)
+            dispBA = pA - pB
+            distBA = np.hypot(dispBA[:, 0], dispBA[:, 1]) - dist_extra
+            thetaBA = np.arctan2(dispBA[:, 1], dispBA[:, 0])
+            phi_obst = np.arcsin(safe_dist / np.maximum(distBA, safe_dist)) # clamped when robot is close to obstacle
+
+            # half-planes through the VO apex along both cone edges, left and right rows interleaved
+            # left: (sin, -cos) . v < sin * vx - cos * vy, right: (-sin, cos) . v < cos * vy - sin * vx
+            A, b = self.constraint_buffers(M)
+            phi = np.empty((M, 2))
+            phi[:, 0] = thetaBA + phi_obst
+            phi[:, 1] = thetaBA - phi_obst
+            sin, cos = np.sin(phi), np.cos(phi)
+            sign = np.array([1.0, -1.0])
+            A[:, 0] = (sign * sin).ravel()
+            A[:, 1] = (-sign * cos).ravel()
+            b[:] = (sign * (sin * vB[:, 0, None] - cos * vB[:, 1, None])).ravel()
+
+            # a candidate is inside a VO if it satisfies both of its half-planes, one (2M x N) product for all
+            inside = np.matmul(A, self.v_sample, out=self.constraint_out[:2 * M]) < b[:, None]
+            feasible = ~(inside[0::2] & inside[1::2]).any(axis=0)
 
         # Objective function
-        if np.any(v_satisfying_constraints):
-            size = np.shape(v_satisfying_constraints)[1]
-            diffs = v_satisfying_constraints - \
-                    ((self.desired_vel).reshape(2, 1) @ np.ones(size).reshape(1, size))
-            norm = np.linalg.norm(diffs, axis=0)
-            min_index = np.where(norm == np.amin(norm))[0][0]
-            self.cmd_vel = (v_satisfying_constraints[:, min_index])
+        # the zero velocity candidates alone count as no feasible velocity
+        if np.any(self.v_sample[:, feasible]):
+            norm = np.where(feasible, np.linalg.norm(self.v_sample - np.reshape(self.desired_vel, (2, 1)), axis=0), np.inf)
+            self.cmd_vel = self.v_sample[:, np.argmin(norm)]
         else:
             self.cmd_vel = np.zeros(2)
 
-    def check_constraints(self, v_sample, Amat, bvec):
-        length = np.shape(bvec)[0]
-
-        for i in range(int(length / 2)):
-            if np.any(v_sample):
-                v_sample = self.check_inside(v_sample, Amat[2 * i:2 * i + 2, :], bvec[2 * i:2 * i + 2])
-            else:
-                # print('No feasible velocity found')
-                return
-
-        return v_sample
-
-    def check_inside(self, v, Amat, bvec):
-        v_out = []
-        for i in range(np.shape(v)[1]):
-            if not ((Amat @ v[:, i] < bvec).all()):
-                v_out.append(v[:, i])
-        return np.array(v_out).T
-
-    def create_constraints(self, translation, angle, side):
-        origin = np.array([0, 0, 1])
-        point = np.array([np.cos(angle), np.sin(angle)])
-        line = np.cross(origin, point)
-        line = self.translate_line(line, translation)
-        if side == "left":
-            line *= -1
-
-        A = line[:2]
-        b = -line[2]
-
-        return A, b
-
-    def translate_line(self, line, translation):
-        matrix = np.eye(3)
-        matrix[2, :2] = -translation[:2]
-        return matrix @ line
+    def set_velocity_grid(self, n_angles, n_speeds):
+        # candidate velocities, polar grid of n_angles directions and n_speeds speeds from 0 to vmax
+        th = np.linspace(0, 2 * np.pi, n_angles)
+        vel = np.linspace(0, self.vmax, n_speeds)
+        vv, thth = np.meshgrid(vel, th)
+        self.v_sample = np.stack(((vv * np.cos(thth)).flatten(), (vv * np.sin(thth)).flatten()))
+        self.no_constraints = np.ones(self.v_sample.shape[1], dtype=bool)
+        self.constraint_A = np.empty((0, 2))
+        self.constraint_b = np.empty(0)
+        self.constraint_out = np.empty((0, self.v_sample.shape[1]))
+
+    def constraint_buffers(self, M):
+        # (2M, 2) and (2M,) views into buffers that only grow, so steps do not allocate them again
+        if len(self.constraint_b) < 2 * M:
+            size = max(2 * M, 2 * len(self.constraint_b))
+            self.constraint_A = np.empty((size, 2))
+            self.constraint_b = np.empty(size)
+            self.constraint_out = np.empty((size, self.v_sample.shape[1]))
+        return self.constraint_A[:2 * M], self.constraint_b[:2 * M]
 
     def update_state(self):
         new_state = np.empty((4))
@@ -270,17 +251,26 @@ class Velocity_Obstacle:
 
     def nearby_obstacles(self):
         # Finds obstacles within a certain radius of the robot
-        # Returns a list of obstacles
-        robot_obstacles = []
-        circle_obstacles = []
-        if self.other_robots is not None:
-            for i in range(len(self.obstacle_robots)):
-                if np.linalg.norm(self.obstacle_robots[i][:2] - self.robot_state[:2]) < self.obstacle_radius:
-                    robot_obstacles.append(self.obstacle_robots[i])
-        for i in range(len(self.obs_circle)):
-            if np.linalg.norm(self.obs_circle[i][:2] - self.robot_state[:2]) < self.obstacle_radius:
-                circle_obstacles.append(self.obs_circle[i])
-        return robot_obstacles, circle_obstacles
+        # Returns other robot states and circles, rectangles and boundaries show up as their closest point once the
+        # robot is within wall_radius of them
+        robot_obstacles, circle_obstacles, rectangle_points = self.broad_phase.query(
+            self.robot_state[:2], self.obstacle_radius, exclude=self, rectangle_r=self.wall_radius)
+        return robot_obstacles, np.vstack((circle_obstacles, rectangle_points))
+
+
+def share_broad_phase(robots):
+    # hands one ObstacleGrid to every Velocity Obstacle agent among robots, so a tick rebuilds it once instead of once
+    # per agent, the caller calls rebuild(robots) at the start of every tick
+    # returns the grid, None if there are no Velocity Obstacle agents
+    agents = [robot for robot in robots if isinstance(robot, Velocity_Obstacle)]
+    if not agents:
+        return None
+    broad_phase = spatial_index.ObstacleGrid(agents[0].broad_phase.cell_size, agents[0].obs_circle,
+                                             agents[0].obs_rectangle + agents[0].obs_boundary)
+    for agent in agents:
+        agent.set_broad_phase(broad_phase)
+    broad_phase.rebuild(robots)
+    return broad_phase
 
 
 if __name__ == "__main__":
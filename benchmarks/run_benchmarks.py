@@ -0,0 +1,216 @@
+"""
+Benchmarks every planner headless over fixed seeds, robot counts, obstacle densities and node limits
+Reports robot steps per second, time per phase and peak memory of each case, saves them as JSON and compares them
+against a baseline saved on the same machine
+
+    python run_benchmarks.py                                  # full matrix, see scenarios.py
+    python run_benchmarks.py --quick                          # 1 and 4 robots, default obstacles, one node limit
+    python run_benchmarks.py --planners rrtx --robots 16 64   # any subset
+    python run_benchmarks.py --save-baseline                  # store the results as the baseline to compare against
+
+No baseline ships with the repo, timings only compare on the machine that recorded them: save one locally first
+A case is only compared with the baseline case of the same settings and --steps
+
+Each case runs in its own worker process so peak memory (max RSS) belongs to that case alone
+Phase times are exclusive: time spent in a nested phase (e.g. a collision check inside rewiring) only counts there,
+see profiling.py
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import time
+import multiprocessing
+import numpy as np
+
+import scenarios
+import profiling
+from algorithms.velocity_obstacle import share_broad_phase
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(HERE, 'baseline.json')
+
+# planner methods (and Utils methods) timed as each phase by profiling.StepProfiler, whichever exist on the planner
+PHASES = {
+    'sample': ['random_node', 'random_node_regrow', 'saturate'],
+    'nearest': ['nearest', 'near', 'find_nodes_in_range', 'nearby_obstacles'],
+    'collision': ['utils.is_collision', 'utils.is_collision_segment', 'utils.is_collision_batch',
+                  'utils.is_collision_edges', 'compute_velocity'],
+    'rewire': ['extend', 'find_parent', 'rewire', 'rewire_neighbours'],
+    'repair': ['update_robot_obstacles', 'propagate_descendants', 'reduce_inconsistency', 'remove_subtrees', 'validate'],
+}
+
+
+def peak_memory_mb():
+    # max RSS of this process, ru_maxrss is in kB on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if sys.platform == 'darwin' else rss / 2**10
+
+
+def run_case(case):
+    planner, n_robots, density, node_limit, seed, steps = case
+    robots = scenarios.make_scenario(planner, n_robots, density, node_limit, seed)
+    profilers = [profiling.StepProfiler(robot, PHASES, boundary='step', series=False) for robot in robots]
+    broad_phase = share_broad_phase(robots) # Velocity Obstacle agents share one, rebuilt once per tick
+
+    # same stepping as run_simulation() in experiments/comparison_experiment.py
+    # a planner that raises ends the case early, the error is reported with it instead of stopping the whole run
+    robot_steps = 0
+    tick = 0
+    error = None
+    start = time.perf_counter()
+    try:
+        for tick in range(steps):
+            if broad_phase is not None:
+                broad_phase.rebuild(robots)
+            for robot in robots:
+                robot.step()
+                robot_steps += 1
+            if all(robot.reached_goal for robot in robots):
+                break
+    except Exception as e:
+        error = f'{type(e).__name__}: {e} (tick {tick})'
+    elapsed = time.perf_counter() - start
+
+    totals = {phase: sum(profiler.totals[phase] for profiler in profilers) for phase in PHASES}
+    phases = {phase: round(t, 6) for phase, t in totals.items()}
+    phases['other'] = round(max(0.0, elapsed - sum(totals.values())), 6)
+    counts = {counter: int(sum(profiler.counts[counter] for profiler in profilers)) for counter in profiling.COUNTERS}
+    return {
+        'key': case_key(planner, n_robots, density, node_limit, seed, steps),
+        'planner': planner,
+        'robots': n_robots,
+        'density': density,
+        'node_limit': node_limit,
+        'seed': seed,
+        'steps': steps,
+        'ticks': tick + 1,
+        'robot_steps': robot_steps,
+        'time': round(elapsed, 6),
+        'steps_per_s': round(robot_steps / elapsed, 3),
+        'phases': phases,
+        'counts': counts,
+        'peak_mem_mb': round(peak_memory_mb(), 2),
+        'reached_goal': sum(bool(robot.reached_goal) for robot in robots),
+        'tree_nodes': sum(len(getattr(robot, 'tree_nodes', ())) for robot in robots),
+        'error': error,
+    }
+
+
+def case_key(planner, n_robots, density, node_limit, seed, steps):
+    # steps is part of the key so runs of different lengths are never compared with each other
+    return f'{planner}/{n_robots}/{density}/{node_limit}/{seed}/{steps}'
+
+
+def build_cases(args):
+    cases = []
+    for planner in args.planners:
+        # Velocity Obstacle has no tree, so no node limit to vary
+        node_limits = [None] if planner == 'vel_obs' else args.node_limits
+        for n_robots in args.robots:
+            for density in args.densities:
+                for node_limit in node_limits:
+                    for seed in args.seeds:
+                        cases.append((planner, n_robots, density, node_limit, seed, args.steps))
+    return cases
+
+
+def compare(results, baseline, tolerance):
+    # prints the change in steps per second and peak memory for every case the baseline has too
+    # returns the keys of the cases that got more than tolerance slower
+    # timings from another machine say nothing about a regression, so those baselines are not compared at all
+    machine = baseline.get('meta', {}).get('machine')
+    if machine != results['meta']['machine']:
+        print(f'\nBaseline was recorded on {machine or "an unknown machine"}, not {results["meta"]["machine"]}, '
+              f'not comparing, save one here with --save-baseline')
+        return []
+    old = {case['key']: case for case in baseline['cases']}
+    regressions = []
+    print(f'\n{"case":<34} {"steps/s":>10} {"baseline":>10} {"change":>8} {"mem MB":>8} {"baseline":>9}')
+    for case in results['cases']:
+        ref = old.get(case['key'])
+        if ref is None or case['error'] or ref.get('error'):
+            continue # only cases that ran to the end in both are comparable
+        change = case['steps_per_s'] / ref['steps_per_s'] - 1
+        flag = ''
+        if change < -tolerance:
+            regressions.append(case['key'])
+            flag = '  SLOWER'
+        print(f'{case["key"]:<34} {case["steps_per_s"]:>10.1f} {ref["steps_per_s"]:>10.1f} {change:>+8.1%} '
+              f'{case["peak_mem_mb"]:>8.1f} {ref["peak_mem_mb"]:>9.1f}{flag}')
+    missing = set(old) - {case['key'] for case in results['cases']}
+    if missing:
+        print(f'{len(missing)} baseline cases were not run')
+    new = {case['key'] for case in results['cases']} - set(old)
+    if new:
+        print(f'{len(new)} cases are not in the baseline (other settings or --steps), not compared')
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the planners headless over fixed seeds')
+    parser.add_argument('--planners', nargs='+', default=scenarios.PLANNERS, choices=scenarios.PLANNERS)
+    parser.add_argument('--robots', nargs='+', type=int, default=scenarios.ROBOT_COUNTS)
+    parser.add_argument('--densities', nargs='+', default=scenarios.DENSITIES, choices=scenarios.DENSITIES)
+    parser.add_argument('--node-limits', nargs='+', type=int, default=scenarios.NODE_LIMITS)
+    parser.add_argument('--seeds', nargs='+', type=int, default=[0])
+    parser.add_argument('--steps', type=int, default=1000, help='ticks per case (every robot steps once per tick)')
+    parser.add_argument('--quick', action='store_true', help='1 and 4 robots, default obstacles, smallest node limit')
+    parser.add_argument('--jobs', type=int, default=1, help='cases run at once, more than 1 makes timings noisier')
+    parser.add_argument('--out', default=None, help='results JSON (default: results_<time>.json here)')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='baseline JSON to compare against')
+    parser.add_argument('--save-baseline', action='store_true', help='also write the results to --baseline')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='slowdown that counts as a regression')
+    args = parser.parse_args()
+    if args.quick:
+        args.robots = [n for n in args.robots if n <= 4] or [1, 4]
+        args.densities = ['default']
+        args.node_limits = [min(args.node_limits)]
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    cases = build_cases(args)
+    print(f'Running {len(cases)} benchmark cases')
+
+    # a fresh worker per case so max RSS and caches do not carry over
+    pool = multiprocessing.Pool(processes=args.jobs, maxtasksperchild=1)
+    results = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'machine': platform.node(),
+            'processor': platform.processor(),
+            'steps': args.steps,
+        },
+        'cases': [],
+    }
+    for case in pool.imap(run_case, cases):
+        results['cases'].append(case)
+        phases = ' '.join(f'{phase} {t:.2f}s' for phase, t in case['phases'].items())
+        print(f'{case["key"]:<34} {case["steps_per_s"]:>10.1f} steps/s  {case["peak_mem_mb"]:>7.1f} MB  {phases}')
+        if case['error']:
+            print(f'{"":<34} stopped early, {case["error"]}')
+    pool.close()
+
+    out = args.out or os.path.join(HERE, f'results_{time.strftime("%Y%m%d-%H%M%S")}.json')
+    with open(out, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'Saved results to {out}')
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'Saved baseline to {args.baseline}')
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f'{len(regressions)} cases more than {args.tolerance:.0%} slower than the baseline')
+            sys.exit(1)
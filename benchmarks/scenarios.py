@@ -0,0 +1,152 @@
+"""
+Seeded benchmark scenarios
+A scenario is a planner class, a robot count, an obstacle density and a node limit, everything random in it
+(extra obstacles, starts and goals, the planners' own sampling) comes from the one seed, every robot's planner gets
+its own stream spawned from it
+"""
+
+import os
+import sys
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(1, ROOT)
+sys.path.insert(1, os.path.join(ROOT, 'algorithms'))
+
+import env
+from algorithms.rrtx import RRTX
+from algorithms.drrt import DRRT
+from algorithms.drrt_star import DRRTStar
+from algorithms.velocity_obstacle import Velocity_Obstacle
+
+PLANNERS = ['rrtx', 'drrt', 'drrt_star', 'vel_obs']
+ROBOT_COUNTS = [1, 4, 16, 64]
+DENSITIES = ['empty', 'default', 'dense']
+NODE_LIMITS = [1000, 3000]
+
+# same settings as experiments/agent_instances.py, starting_nodes is capped by the node limit
+planner_params = {
+    'rrtx': {
+        'robot_radius': 0.5,
+        'step_len': 5.0,
+        'move_dist': 0.03,
+        'gamma_FOS': 5.0,
+        'epsilon': 0.05,
+        'bot_sample_rate': 0.10,
+        'starting_nodes': 500,
+    },
+    'drrt': {
+        'robot_radius': 0.5,
+        'step_len': 3.0,
+        'move_dist': 0.01,
+        'bot_sample_rate': 0.1,
+        'waypoint_sample_rate': 0.5,
+        'starting_nodes': 500,
+    },
+    'drrt_star': {
+        'robot_radius': 0.5,
+        'step_len': 3.0,
+        'move_dist': 0.01,
+        'gamma_FOS': 20.0,
+        'bot_sample_rate': 0.1,
+        'waypoint_sample_rate': 0.5,
+        'starting_nodes': 500,
+    },
+    'vel_obs': {
+        'robot_radius': 0.5,
+        'move_dist': 0.01,
+        'iter_max': 100_000,
+        'obstacle_FOS': 1,
+        'robot_FOS': 2,
+        'obstacle_radius': 20,
+    },
+}
+
+DENSE_EXTRA_CIRCLES = 12 # added to the default circles for the 'dense' density
+CLEARANCE = 1.5 # free space around every start and goal
+MIN_SEPARATION = 2.0 # between any two starts (or any two goals)
+MIN_TRAVEL = 15.0 # shortest start to goal distance
+
+
+def obstacles(density, rng):
+    # circles and rectangles for a density, rectangles are the (empty) defaults for now
+    e = env.Env()
+    if density == 'empty':
+        return [], e.obs_rectangle
+    if density == 'default':
+        return e.obs_circle, e.obs_rectangle
+    if density == 'dense':
+        circles = e.obs_circle
+        for _ in range(DENSE_EXTRA_CIRCLES):
+            r = float(rng.uniform(1.0, 2.5))
+            circles.append([float(rng.uniform(e.x_range[0] + 3, e.x_range[1] - 3)),
+                            float(rng.uniform(e.y_range[0] + 3, e.y_range[1] - 3)), r])
+        return circles, e.obs_rectangle
+    raise ValueError(f'unknown obstacle density {density!r}')
+
+
+def free_points(n, circles, rng, others=()):
+    # n points clear of the circles and MIN_SEPARATION apart, and MIN_TRAVEL from the matching point in others
+    e = env.Env()
+    points = []
+    for _ in range(1000 * n):
+        if len(points) == n:
+            return points
+        x = float(rng.uniform(e.x_range[0] + 2, e.x_range[1] - 2))
+        y = float(rng.uniform(e.y_range[0] + 2, e.y_range[1] - 2))
+        if any(np.hypot(x - cx, y - cy) < r + CLEARANCE for cx, cy, r in circles):
+            continue
+        if any(np.hypot(x - px, y - py) < MIN_SEPARATION for px, py in points):
+            continue
+        if others and np.hypot(x - others[len(points)][0], y - others[len(points)][1]) < MIN_TRAVEL:
+            continue
+        points.append((x, y))
+    raise ValueError(f'could not place {n} robots in free space')
+
+
+def set_obstacles(robot, circles, rectangles):
+    robot.obs_circle = [list(c) for c in circles]
+    robot.obs_rectangle = [list(r) for r in rectangles]
+    if isinstance(robot, Velocity_Obstacle):
+        robot.update_static_obstacles()
+    else:
+        robot.utils.update_obs(robot.obs_circle, robot.obs_boundary, robot.obs_rectangle)
+        if hasattr(robot, 'update_gamma'):
+            robot.update_gamma()
+
+
+def make_robot(planner, start, goal, node_limit, seed=None):
+    # seed: of the planner's random stream, Velocity Obstacle agents don't sample
+    p = planner_params[planner]
+    if planner == 'vel_obs':
+        return Velocity_Obstacle(start, goal, p['robot_radius'], p['move_dist'], p['iter_max'], p['obstacle_FOS'],
+                                 p['robot_FOS'], p['obstacle_radius'], headless=True)
+    starting_nodes = min(p['starting_nodes'], node_limit // 2)
+    if planner == 'rrtx':
+        return RRTX(start, goal, p['robot_radius'], p['step_len'], p['move_dist'], p['gamma_FOS'], p['epsilon'],
+                    p['bot_sample_rate'], starting_nodes, node_limit=node_limit, multi_robot=True, headless=True,
+                    seed=seed)
+    if planner == 'drrt':
+        return DRRT(start, goal, p['robot_radius'], p['step_len'], p['move_dist'], p['bot_sample_rate'],
+                    p['waypoint_sample_rate'], starting_nodes, node_limit=node_limit, multi_robot=True, headless=True,
+                    seed=seed)
+    if planner == 'drrt_star':
+        return DRRTStar(start, goal, p['robot_radius'], p['step_len'], p['move_dist'], p['gamma_FOS'],
+                        p['bot_sample_rate'], p['waypoint_sample_rate'], starting_nodes, node_limit=node_limit,
+                        multi_robot=True, headless=True, seed=seed)
+    raise ValueError(f'unknown planner {planner!r}')
+
+
+def make_scenario(planner, n_robots, density, node_limit, seed):
+    # returns the robots, already told about each other
+    rng = np.random.default_rng(seed)
+    circles, rectangles = obstacles(density, rng)
+    starts = free_points(n_robots, circles, rng)
+    goals = free_points(n_robots, circles, rng, starts)
+    robot_seeds = np.random.SeedSequence(seed).spawn(n_robots)
+    robots = [make_robot(planner, start, goal, node_limit, robot_seed)
+              for start, goal, robot_seed in zip(starts, goals, robot_seeds)]
+    for robot in robots:
+        set_obstacles(robot, circles, rectangles)
+        robot.set_other_robots([other for other in robots if other != robot])
+    return robots
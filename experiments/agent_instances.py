@@ -6,6 +6,7 @@ import sys
 sys.path.insert(1, '../')
 sys.path.insert(1, '../algorithms')
 
+import numpy as np
 
 from algorithms.rrtx import RRTX
 from algorithms.drrt import DRRT
@@ -36,6 +37,14 @@ r4_start = bottom_left_in
 r4_goal = top_right_out
 
 
+# planners never import matplotlib or keep plot-only state, multirobot_helpers still draws them if plotted
+headless = True
+
+def robot_seeds(seed, n=4):
+    # seeds of the planners' random streams, each robot gets its own spawned from seed
+    # None leaves every planner to draw one from np.random
+    return [None] * n if seed is None else np.random.SeedSequence(seed).spawn(n)
+
 plot_rrtx = False
 plot_drrt = False
 plot_drrt_star = False
@@ -54,7 +63,8 @@ algo_names = [
     'Velocity Obstacles'
 ]
 
-def get_rrtx_agents():
+def get_rrtx_agents(seed=None):
+    seeds = robot_seeds(seed)
 
     rrtx_params = {
         'iter_max': 10_000,
@@ -80,6 +90,8 @@ def get_rrtx_agents():
         starting_nodes = rrtx_params['starting_nodes'],
         node_limit = rrtx_params['node_limit'],
         multi_robot = True,
+        headless = headless,
+        seed = seeds[0],
         plot_params = {
             'robot': plot_rrtx,
             'goal': plot_rrtx,
@@ -104,6 +116,8 @@ def get_rrtx_agents():
         starting_nodes = rrtx_params['starting_nodes'],
         node_limit = rrtx_params['node_limit'],
         multi_robot = True,
+        headless = headless,
+        seed = seeds[1],
         plot_params = {
             'robot': plot_rrtx,
             'goal': plot_rrtx,
@@ -128,6 +142,8 @@ def get_rrtx_agents():
         starting_nodes = rrtx_params['starting_nodes'],
         node_limit = rrtx_params['node_limit'],
         multi_robot = True,
+        headless = headless,
+        seed = seeds[2],
         plot_params = {
             'robot': plot_rrtx,
             'goal': plot_rrtx,
@@ -152,6 +168,8 @@ def get_rrtx_agents():
         starting_nodes = rrtx_params['starting_nodes'],
         node_limit = rrtx_params['node_limit'],
         multi_robot = True,
+        headless = headless,
+        seed = seeds[3],
         plot_params = {
             'robot': plot_rrtx,
             'goal': plot_rrtx,
@@ -166,7 +184,8 @@ def get_rrtx_agents():
 
     return rrtx_params, [rrtx1, rrtx2, rrtx3, rrtx4]
 
-def get_drrt_agents():
+def get_drrt_agents(seed=None):
+    seeds = robot_seeds(seed)
 
     drrt_params = {
         'iter_max': 10_000,
@@ -192,6 +211,8 @@ def get_drrt_agents():
         starting_nodes = drrt_params['starting_nodes'],
         node_limit = drrt_params['node_limit'],
         multi_robot = True,
+        headless = headless,
+        seed = seeds[0],
         plot_params = {
             'robot': plot_drrt,
             'goal': plot_drrt,
@@ -215,6 +236,8 @@ def get_drrt_agents():
         starting_nodes = drrt_params['starting_nodes'],
         node_limit = drrt_params['node_limit'],
         multi_robot = True,
+        headless = headless,
+        seed = seeds[1],
         plot_params = {
             'robot': plot_drrt,
             'goal': plot_drrt,
@@ -238,6 +261,8 @@ def get_drrt_agents():
         starting_nodes = drrt_params['starting_nodes'],
         node_limit = drrt_params['node_limit'],
         multi_robot = True,
+        headless = headless,
+        seed = seeds[2],
         plot_params = {
             'robot': plot_drrt,
             'goal': plot_drrt,
@@ -261,6 +286,8 @@ def get_drrt_agents():
         starting_nodes = drrt_params['starting_nodes'],
         node_limit = drrt_params['node_limit'],
         multi_robot = True,
+        headless = headless,
+        seed = seeds[3],
         plot_params = {
             'robot': plot_drrt,
             'goal': plot_drrt,
@@ -275,7 +302,8 @@ def get_drrt_agents():
 
     return drrt_params, [drrt1, drrt2, drrt3, drrt4]
 
-def get_drrt_star_agents():
+def get_drrt_star_agents(seed=None):
+    seeds = robot_seeds(seed)
 
     drrt_star_params = {
         'iter_max': 10_000,
@@ -302,6 +330,8 @@ def get_drrt_star_agents():
         starting_nodes = drrt_star_params['starting_nodes'],
         node_limit = drrt_star_params['node_limit'],
         multi_robot = True,
+        headless = headless,
+        seed = seeds[0],
         plot_params = {
             'robot': plot_drrt_star,
             'goal': plot_drrt_star,
@@ -326,6 +356,8 @@ def get_drrt_star_agents():
         starting_nodes = drrt_star_params['starting_nodes'],
         node_limit = drrt_star_params['node_limit'],
         multi_robot = True,
+        headless = headless,
+        seed = seeds[1],
         plot_params = {
             'robot': plot_drrt_star,
             'goal': plot_drrt_star,
@@ -350,6 +382,8 @@ def get_drrt_star_agents():
         starting_nodes = drrt_star_params['starting_nodes'],
         node_limit = drrt_star_params['node_limit'],
         multi_robot = True,
+        headless = headless,
+        seed = seeds[2],
         plot_params = {
             'robot': plot_drrt_star,
             'goal': plot_drrt_star,
@@ -374,6 +408,8 @@ def get_drrt_star_agents():
         starting_nodes = drrt_star_params['starting_nodes'],
         node_limit = drrt_star_params['node_limit'],
         multi_robot = True,
+        headless = headless,
+        seed = seeds[3],
         plot_params = {
             'robot': plot_drrt_star,
             'goal': plot_drrt_star,
@@ -388,7 +424,8 @@ def get_drrt_star_agents():
 
     return drrt_star_params, [drrt_star1, drrt_star2, drrt_star3, drrt_star4]
 
-def get_vel_obs_agents():
+def get_vel_obs_agents(seed=None):
+    # seed is unused, Velocity Obstacle agents don't sample
 
     vel_obs_params = {
         'iter_max': 100_000,
@@ -402,6 +439,7 @@ def get_vel_obs_agents():
         robot_radius=vel_obs_params['robot_radius'],
         timestep=vel_obs_params['timestep'],
         iter_max=vel_obs_params['iter_max'],
+        headless=headless,
         plot_params = {
             'robot': plot_vel_obs,
             'goal': plot_vel_obs,
@@ -418,6 +456,7 @@ def get_vel_obs_agents():
         robot_radius=vel_obs_params['robot_radius'],
         timestep=vel_obs_params['timestep'],
         iter_max=vel_obs_params['iter_max'],
+        headless=headless,
         plot_params = {
             'robot': plot_vel_obs,
             'goal': plot_vel_obs,
@@ -434,6 +473,7 @@ def get_vel_obs_agents():
         robot_radius=vel_obs_params['robot_radius'],
         timestep=vel_obs_params['timestep'],
         iter_max=vel_obs_params['iter_max'],
+        headless=headless,
         plot_params = {
             'robot': plot_vel_obs,
             'goal': plot_vel_obs,
@@ -450,6 +490,7 @@ def get_vel_obs_agents():
         robot_radius=vel_obs_params['robot_radius'],
         timestep=vel_obs_params['timestep'],
         iter_max=vel_obs_params['iter_max'],
+        headless=headless,
         plot_params = {
             'robot': plot_vel_obs,
             'goal': plot_vel_obs,
@@ -0,0 +1,176 @@
+"""
+Steps many independent multi-robot scenarios in lockstep
+The parts of a step that are the same for every robot (motion along the tree, checking which other robots moved,
+goal checks and the Velocity Obstacle state update) are done for all robots of all scenarios in one NumPy pass,
+only the per-tree planning is still called robot by robot
+Robots move in lockstep: every robot moves first, then every robot plans, so a robot sees the positions the others
+have at the end of the same tick (run_simulation() steps robot by robot, where later robots already see earlier ones move)
+"""
+
+import time
+import numpy as np
+
+import sys
+sys.path.insert(1, '../')
+sys.path.insert(1, '../algorithms')
+
+from utils import Utils
+from algorithms.velocity_obstacle import Velocity_Obstacle, share_broad_phase
+
+
+class BatchSimulator:
+    def __init__(self, scenarios, iter_max):
+        # scenarios: list of robot lists, other robots are set up here like in run_simulation()
+        self.scenarios = scenarios
+        self.iter_max = iter_max
+        self.robots = [robot for robots in scenarios for robot in robots]
+        self.scenario_idx = np.repeat(np.arange(len(scenarios)), [len(robots) for robots in scenarios])
+        for robots in scenarios:
+            for robot in robots:
+                robot.set_other_robots([other for other in robots if other != robot])
+
+        # global index of each robot, used to look up other robots in the position array
+        index = {id(robot): i for i, robot in enumerate(self.robots)}
+        self.is_vo = np.array([isinstance(robot, Velocity_Obstacle) for robot in self.robots], dtype=bool)
+        self.tree_idx = np.flatnonzero(~self.is_vo)
+        self.vo_idx = np.flatnonzero(self.is_vo)
+        self.pos = np.array([robot.robot_position[:2] for robot in self.robots], dtype=float).reshape(-1, 2)
+
+        # (robot, other robot) pairs for robot obstacle refresh of the tree planners
+        # snapshot holds the position each robot last used for the other one's obstacle
+        pair_robot, pair_other, pair_slot, snapshot = [], [], [], []
+        for i in self.tree_idx:
+            robot = self.robots[i]
+            for slot, other in enumerate(robot.other_robots):
+                pair_robot.append(i)
+                pair_other.append(index[id(other)])
+                pair_slot.append(slot)
+                snapshot.append(robot.other_robot_obstacles[slot][:2])
+        self.pair_robot = np.array(pair_robot, dtype=int)
+        self.pair_other = np.array(pair_other, dtype=int)
+        self.pair_slot = np.array(pair_slot, dtype=int)
+        self.snapshot = np.array(snapshot, dtype=float).reshape(-1, 2)
+        self.delta = np.array([getattr(robot, 'robot_obs_delta', 0.0) for robot in self.robots])
+
+        # step length and goal of every robot
+        self.move_dist = np.array([
+            robot.timestep if vo else robot.robot_speed * robot.move_dist
+            for robot, vo in zip(self.robots, self.is_vo)
+        ])
+        self.goal = np.array([robot.goal[:2] if vo else robot.s_goal.n for robot, vo in zip(self.robots, self.is_vo)],
+                             dtype=float).reshape(-1, 2)
+
+        # one broad phase per scenario shared by its Velocity Obstacle agents, rebuilt once per tick
+        self.broad_phases = []
+        for robots in scenarios:
+            broad_phase = share_broad_phase(robots)
+            if broad_phase is not None:
+                self.broad_phases.append((broad_phase, robots))
+
+        self.reached_goal = np.array([robot.reached_goal for robot in self.robots], dtype=bool)
+        self.finish_time = [None] * len(scenarios)
+        self.iterations = 0
+
+    def step(self):
+        # one tick of every scenario that is still running
+        active = ~self.reached_goal # robots that step this tick, same as the early return in step()
+        tree_active = self.tree_idx[active[self.tree_idx]]
+        vo_active = self.vo_idx[active[self.vo_idx]]
+
+        self.move_tree_robots(tree_active)
+        self.move_vo_robots(vo_active)
+        self.plan_tree_robots(tree_active)
+
+        self.reached_goal[tree_active] = [self.robots[i].reached_goal for i in tree_active]
+        self.iterations += 1
+
+    def move_tree_robots(self, idxs):
+        moving = idxs[np.array([self.robots[i].ready_to_move() for i in idxs], dtype=bool)]
+        # robots whose node has no parent stay where they are, see update_robot_position()
+        stuck = [i for i in moving if not self.robots[i].s_bot.parent]
+        for i in stuck:
+            robot = self.robots[i]
+            robot.apply_motion(robot.s_bot, robot.robot_position)
+        sel = np.setdiff1d(moving, stuck)
+        if len(sel):
+            parents = [self.robots[i].s_bot.parent for i in sel]
+            target = np.array([parent.n for parent in parents], dtype=float)
+            new_pos, at_target = Utils.update_robot_positions(self.pos[sel], target, self.move_dist[sel])
+            self.pos[sel] = new_pos
+            for k, i in enumerate(sel):
+                robot = self.robots[i]
+                robot.apply_motion(parents[k] if at_target[k] else robot.s_bot, new_pos[k].tolist())
+        for i in idxs:
+            self.robots[i].check_goal()
+
+    def move_vo_robots(self, idxs):
+        if not len(idxs):
+            return
+        # robots that reached their goal do nothing at all, see Velocity_Obstacle.step()
+        idxs = idxs[~self.reached_goal[idxs]]
+        if not len(idxs):
+            return
+        agents = [self.robots[i] for i in idxs]
+        for broad_phase, robots in self.broad_phases:
+            broad_phase.rebuild(robots)
+        for agent in agents:
+            agent.started = True
+
+        # straight line to goal velocity, slowing down within one step of the goal
+        disp = self.goal[idxs] - self.pos[idxs]
+        norm = np.hypot(disp[:, 0], disp[:, 1])
+        vmax = np.array([agent.vmax for agent in agents])
+        speed = np.minimum(vmax, norm / self.move_dist[idxs])
+        # robots sitting exactly on their goal get no desired velocity instead of a NaN one
+        desired = speed[:, None] * disp / np.maximum(norm, 1e-12)[:, None]
+        for k, agent in enumerate(agents):
+            agent.desired_vel = desired[k]
+            agent.compute_velocity()
+
+        cmd_vel = np.array([agent.cmd_vel for agent in agents], dtype=float).reshape(-1, 2)
+        step = cmd_vel * self.move_dist[idxs, None]
+        states = np.hstack((self.pos[idxs] + step, cmd_vel))
+        travelled = np.hypot(step[:, 0], step[:, 1])
+        reached = np.hypot(*(states[:, :2] - self.goal[idxs]).T) < 1e-2
+        self.pos[idxs] = states[:, :2]
+        self.reached_goal[idxs] |= reached
+        for k, agent in enumerate(agents):
+            agent.robot_state = states[k]
+            agent.robot_position = agent.robot_state[:2]
+            agent.distance_travelled += travelled[k]
+            agent.reached_goal = agent.reached_goal or bool(reached[k])
+
+    def plan_tree_robots(self, idxs):
+        if not len(idxs):
+            return
+        # find which other robots moved far enough to be re-added as obstacles, for every robot at once
+        pairs = np.flatnonzero(np.isin(self.pair_robot, idxs))
+        d = self.pos[self.pair_other[pairs]] - self.snapshot[pairs]
+        moved = pairs[np.hypot(d[:, 0], d[:, 1]) > self.delta[self.pair_robot[pairs]]]
+        self.snapshot[moved] = self.pos[self.pair_other[moved]]
+        idx_changed = {i: [] for i in idxs}
+        for robot_i, slot in zip(self.pair_robot[moved], self.pair_slot[moved]):
+            idx_changed[robot_i].append(slot)
+        for i in idxs:
+            self.robots[i].plan(idx_changed[i])
+
+    def run(self):
+        # returns one result per scenario in the format of run_simulation()
+        # time is the wall time until the scenario finished, shared with the other scenarios in the batch
+        start_time = time.time()
+        running = np.ones(len(self.scenarios), dtype=bool)
+        while self.iterations < self.iter_max and running.any():
+            self.step()
+            # a scenario is finished once all of its robots reached their goal
+            finished = np.bincount(self.scenario_idx, weights=~self.reached_goal, minlength=len(self.scenarios)) == 0
+            for s in np.flatnonzero(finished & running):
+                self.finish_time[s] = time.time() - start_time
+            running &= ~finished
+
+        return [
+            {'time': None, 'path_lengths': []} if self.finish_time[s] is None else {
+                'time': self.finish_time[s],
+                'path_lengths': [robot.distance_travelled for robot in robots]
+            }
+            for s, robots in enumerate(self.scenarios)
+        ]
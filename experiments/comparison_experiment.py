@@ -3,7 +3,6 @@ This script runs each planner a user-selected number of times and saves the comp
 Data gets dumped into a pickle file :)
 """
 
-import matplotlib.pyplot as plt
 import numpy as np
 from functools import partial
 import multiprocessing
@@ -16,17 +15,25 @@ import sys
 
 
 from agent_instances import *
+from algorithms.velocity_obstacle import share_broad_phase
 
-import multirobot_helpers as mrh
+from batch_simulator import BatchSimulator
+from parallel_simulator import ParallelSimulator
+from planner_runtime import PlannerRuntime
 
-def run_simulation(exp_idx, agent_getter):
-    # get agents
-    params, robots = agent_getter()
+def run_simulation(exp_idx, agent_getter, seed=None):
+    # get agents, seed is passed on to agent_getter for the planners' random streams
+    params, robots = agent_getter(seed)
     for robot in robots:
         robot.set_other_robots([other for other in robots if other != robot])
+    # Velocity Obstacle agents share one broad phase, rebuilt once per tick
+    broad_phase = share_broad_phase(robots)
     
     # set up plotting
     if plot_algos[exp_idx]:
+        # only plotted runs import matplotlib
+        import matplotlib.pyplot as plt
+        import multirobot_helpers as mrh
         fig, ax = plt.subplots(figsize=(12, 8))
         fig.suptitle(algo_names[exp_idx])
         ax.set_xlim(robots[0].env.x_range[0], robots[0].env.x_range[1]+1)
@@ -44,6 +51,8 @@ def run_simulation(exp_idx, agent_getter):
 
     # simulation iterations
     for iter_idx in range(params['iter_max']):
+        if broad_phase is not None:
+            broad_phase.rebuild(robots)
         # RRTX step for each robot
         for robot in robots:
             robot.step()
@@ -83,6 +92,28 @@ def run_simulation(exp_idx, agent_getter):
             'path_lengths': [robot.distance_travelled for robot in robots]
         }
 
+def run_batch(seeds, agent_getter):
+    # runs a scenario for every seed in lockstep in this process, see batch_simulator.py (no plotting)
+    scenarios = []
+    for seed in seeds:
+        params, robots = agent_getter(seed)
+        scenarios.append(robots)
+    return BatchSimulator(scenarios, params['iter_max']).run()
+
+def run_parallel(exp_idx, agent_getter, seed=None):
+    # runs one scenario with every robot in its own process, see parallel_simulator.py (no plotting)
+    params, robots = agent_getter(seed)
+    return ParallelSimulator(robots, params['iter_max']).run()
+
+def run_runtime(exp_idx, agent_getter, seed=None):
+    # runs one scenario in real time, motion at a fixed rate and planning in between, see planner_runtime.py (no
+    # plotting), the result also holds the runtime's lateness and plan latency stats
+    params, robots = agent_getter(seed)
+    runtime = PlannerRuntime(robots, params['iter_max'])
+    result = runtime.run()
+    result['runtime'] = runtime.stats()
+    return result
+
 
 if __name__ == '__main__':
 
@@ -98,6 +129,28 @@ if __name__ == '__main__':
             100, # DRRT
             100, # DRRT*
             1   # Velocity Obstacle
+        ],
+        # scenarios stepped together by each worker, 1 runs them one at a time with run_simulation()
+        'batch_size': [
+            1, # RRTX
+            1, # DRRT
+            1, # DRRT*
+            1  # Velocity Obstacle
+        ],
+        # run the robots of a scenario in parallel processes, one scenario at a time (ignores batch_size)
+        'parallel_robots': [
+            False, # RRTX
+            False, # DRRT
+            False, # DRRT*
+            False  # Velocity Obstacle
+        ],
+        # run each scenario in real time with the anytime planning loop (ignores batch_size and parallel_robots),
+        # adds the control deadline and plan latency stats to the data
+        'anytime_runtime': [
+            False, # RRTX
+            False, # DRRT
+            False, # DRRT*
+            False  # Velocity Obstacle
         ]
     }
 
@@ -115,7 +168,10 @@ if __name__ == '__main__':
             'path_lengths': []
         }
 
-    # np.random.seed(0)
+    # every simulation gets its own seed spawned from this one, so workers never repeat each other's random numbers
+    # and a seeded experiment can be repeated, None for a different experiment every time
+    seed = None
+    algo_seeds = np.random.SeedSequence(seed).spawn(len(algo_names))
 
     experiment_start_time = time.time()
 
@@ -129,12 +185,27 @@ if __name__ == '__main__':
 
             pool = multiprocessing.Pool(processes=multiprocessing.cpu_count()//2)
 
-            for result in tqdm(pool.imap(
-                partial(run_simulation, agent_getter=agent_getters[exp_idx]), 
-                [exp_idx for _ in range(experiment_settings['num_sim'][exp_idx])]
-            )):
+            num_sim = experiment_settings['num_sim'][exp_idx]
+            batch_size = experiment_settings['batch_size'][exp_idx]
+            sim_seeds = algo_seeds[exp_idx].generate_state(num_sim).tolist()
+            if experiment_settings['anytime_runtime'][exp_idx]:
+                results = pool.imap(partial(run_runtime, exp_idx, agent_getters[exp_idx]), sim_seeds)
+            elif experiment_settings['parallel_robots'][exp_idx]:
+                # pool workers can't start processes of their own, so scenarios run here one after the other
+                results = (run_parallel(exp_idx, agent_getters[exp_idx], sim_seed) for sim_seed in sim_seeds)
+            elif batch_size > 1:
+                batches = [sim_seeds[k:k + batch_size] for k in range(0, num_sim, batch_size)]
+                results = (result for batch in pool.imap(
+                    partial(run_batch, agent_getter=agent_getters[exp_idx]), batches
+                ) for result in batch)
+            else:
+                results = pool.imap(partial(run_simulation, exp_idx, agent_getters[exp_idx]), sim_seeds)
+
+            for result in tqdm(results, total=num_sim):
                 data[algo_names[exp_idx]]['time'].append(result['time'])
                 data[algo_names[exp_idx]]['path_lengths'].append(result['path_lengths'])
+                if 'runtime' in result:
+                    data[algo_names[exp_idx]].setdefault('runtime', []).append(result['runtime'])
 
             # add data to dict
             # for result in out:
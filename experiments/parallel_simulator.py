@@ -0,0 +1,84 @@
+"""
+Runs the robots of one scenario in parallel, every robot's planner in its own process
+Robots see each other through a WorldBoard in shared memory instead of through object references, and a barrier
+keeps them in lockstep: in a tick every robot steps on the state all robots had at the end of the last tick
+(run_simulation() steps robot by robot, where later robots already see earlier ones move)
+"""
+
+import time
+import multiprocessing
+from threading import BrokenBarrierError
+
+import sys
+sys.path.insert(1, '../')
+sys.path.insert(1, '../algorithms')
+
+from world_board import WorldBoard, REACHED_GOAL, DISTANCE
+from algorithms.velocity_obstacle import share_broad_phase
+
+
+def run_robot(idx, robot, board, barrier, iter_max):
+    # loop of the process of robot idx, every planner samples from its own random stream (see sampling.py), so the
+    # forked processes don't all draw the same numbers
+    others = [board.view(other) for other in range(board.n_robots) if other != idx]
+    robot.set_other_robots(others)
+    # a Velocity Obstacle agent's broad phase is rebuilt from the board once per tick
+    broad_phase = share_broad_phase([robot])
+    try:
+        for _ in range(iter_max):
+            if broad_phase is not None:
+                broad_phase.rebuild(others)
+            robot.step()
+            board.write(idx, robot)
+            barrier.wait()
+            board.advance()
+            # every process reads the same buffer here, so they all stop at the same tick
+            if board.all_reached_goal():
+                break
+    except BrokenBarrierError:
+        pass # another robot failed and reports it
+    except BaseException:
+        barrier.abort() # don't leave the others waiting forever
+        raise
+    finally:
+        board.close()
+
+
+class ParallelSimulator:
+    def __init__(self, robots, iter_max, max_path_points=32, path_length=10.0):
+        # path_length should cover the prediction horizon of the planners (robot_horizon times the step length)
+        self.robots = robots
+        self.iter_max = iter_max
+        self.max_path_points = max_path_points
+        self.path_length = path_length
+
+    def run(self):
+        # returns the result in the format of run_simulation()
+        n_robots = len(self.robots)
+        board = WorldBoard(n_robots, self.max_path_points, self.path_length)
+        try:
+            for idx, robot in enumerate(self.robots):
+                board.write(idx, robot)
+            board.advance()
+            barrier = multiprocessing.Barrier(n_robots)
+            processes = [multiprocessing.Process(target=run_robot, args=(idx, robot, board, barrier, self.iter_max))
+                         for idx, robot in enumerate(self.robots)]
+
+            start_time = time.time()
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+            elapsed = time.time() - start_time
+
+            failed = [idx for idx, process in enumerate(processes) if process.exitcode != 0]
+            if failed:
+                raise RuntimeError(f'robot processes {failed} failed')
+            state = board.latest()
+        finally:
+            board.close()
+            board.unlink()
+
+        if not state[:, REACHED_GOAL].all():
+            return {'time': None, 'path_lengths': []}
+        return {'time': elapsed, 'path_lengths': state[:, DISTANCE].tolist()}
@@ -0,0 +1,146 @@
+"""
+Anytime planning loop, motion control at a fixed rate and tree growth in the time left over
+Two asyncio tasks share the robots of a scenario:
+- control moves every robot once per control period (a robot drives move_dist per move_robot(), so the default
+  period of move_dist / robot_speed is real time)
+- planning calls plan() of the tree planners round robin, as many times as fit in each period (plan_budget), instead
+  of exactly once per motion step like step() does
+The tasks only switch between plan() calls, so motion always follows a complete tree, a path is swapped in atomically
+once the plan() call that found it returns
+A plan() call can't be interrupted, a slow repair makes the next control tick late, which is what the lateness and
+plan latency stats measure
+After a late tick the schedule restarts from when the robots moved, so planning still gets plan_budget of a period
+before they move again (catching up on the old schedule would move them twice with no plan() call in between)
+A planner with nothing left to do (a full tree and a path, no repairs pending) would otherwise be called back to back
+until the tick, it waits for the next tick once IDLE_CALLS plan() calls in a row changed nothing
+"""
+
+import asyncio
+import time
+import numpy as np
+
+import sys
+sys.path.insert(1, '../')
+sys.path.insert(1, '../algorithms')
+
+from algorithms.velocity_obstacle import share_broad_phase
+
+IDLE_CALLS = 20 # plan() calls in a row without progress before a robot waits for the next control tick
+
+
+def plan_state(robot):
+    # what a plan() call that did something changes, a rejected sample leaves it as it was too, hence IDLE_CALLS
+    return (len(robot.tree_nodes), len(getattr(robot, 'Q', ())), len(getattr(robot, 'orphan_nodes', ())),
+            getattr(robot, 'propagating', False), robot.path_to_goal, id(robot.s_bot))
+
+
+class PlannerRuntime:
+    def __init__(self, robots, iter_max, control_period=None, plan_budget=1.0, clock=time.perf_counter):
+        # iter_max: control ticks before giving up
+        # plan_budget: fraction of every control period planning may use, the rest is left idle
+        self.robots = robots
+        self.iter_max = iter_max
+        self.plan_budget = plan_budget
+        self.clock = clock
+        for robot in robots:
+            robot.set_other_robots([other for other in robots if other != robot])
+        if control_period is None:
+            control_period = min(robot.timestep if not hasattr(robot, 'plan') else robot.move_dist / robot.robot_speed
+                                 for robot in robots)
+        self.control_period = control_period
+        self.planners = [robot for robot in robots if hasattr(robot, 'plan')] # Velocity Obstacle agents only step
+        self.broad_phase = share_broad_phase(robots) # of the Velocity Obstacle agents, rebuilt once per control tick
+
+        self.done = False
+        self.start_time = None
+        self.next_due = None # when the next control tick should start
+        self.ticks = 0
+        self.lateness = [] # per control tick, how long after its due time it started
+        self.plan_latency = [] # duration of every plan() call
+        self.plan_calls = [] # plan() calls per control period
+        self.idle_calls = {} # id(robot) -> plan() calls in a row that changed nothing, reset every control tick
+
+    def run(self):
+        # returns the result in the format of run_simulation()
+        asyncio.run(self.main())
+        if not all(robot.reached_goal for robot in self.robots):
+            return {'time': None, 'path_lengths': []}
+        return {
+            'time': self.finish_time,
+            'path_lengths': [robot.distance_travelled for robot in self.robots]
+        }
+
+    async def main(self):
+        self.start_time = self.next_due = self.clock()
+        await asyncio.gather(self.control_loop(), self.planning_loop())
+
+    async def control_loop(self):
+        calls = len(self.plan_latency)
+        while self.ticks < self.iter_max:
+            wait = self.next_due - self.clock()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            due = self.next_due
+            self.lateness.append(self.clock() - due)
+            self.plan_calls.append(len(self.plan_latency) - calls)
+            calls = len(self.plan_latency)
+
+            if self.broad_phase is not None:
+                self.broad_phase.rebuild(self.robots)
+            for robot in self.robots:
+                if robot.reached_goal:
+                    continue
+                if hasattr(robot, 'plan'):
+                    robot.move_robot()
+                else:
+                    robot.step()
+            self.ticks += 1
+            self.idle_calls = {} # the robots moved, so there may be work again
+            # a late tick does not make the next ones come sooner: once the fixed schedule would leave less than half
+            # of the planning budget before the next tick, the schedule restarts from now with a whole period
+            now = self.clock()
+            self.next_due = due + self.control_period
+            planning_left = self.next_due - (1.0 - self.plan_budget) * self.control_period - now
+            if planning_left < 0.5 * self.plan_budget * self.control_period:
+                self.next_due = now + self.control_period
+            if all(robot.reached_goal for robot in self.robots):
+                break
+        self.finish_time = self.clock() - self.start_time
+        self.done = True
+
+    async def planning_loop(self):
+        k = 0
+        while not self.done:
+            now = self.clock()
+            budget_end = self.next_due - (1.0 - self.plan_budget) * self.control_period
+            active = [robot for robot in self.planners
+                      if not robot.reached_goal and self.idle_calls.get(id(robot), 0) < IDLE_CALLS]
+            if not active or now >= budget_end:
+                # nothing to plan or this period's budget is used up, wait for the control tick
+                await asyncio.sleep(max(0.0, self.next_due - now))
+                continue
+            robot = active[k % len(active)]
+            k += 1
+            state = plan_state(robot)
+            robot.plan()
+            self.plan_latency.append(self.clock() - now)
+            self.idle_calls[id(robot)] = self.idle_calls.get(id(robot), 0) + 1 if plan_state(robot) == state else 0
+            if self.clock() >= self.next_due:
+                await asyncio.sleep(0) # let the control tick run
+
+    def stats(self):
+        # deadline misses are control ticks that started a whole period or more late
+        lateness = np.array(self.lateness)
+        latency = np.array(self.plan_latency)
+        return {
+            'ticks': self.ticks,
+            'control_period': self.control_period,
+            'deadline_misses': int((lateness >= self.control_period).sum()),
+            'lateness_mean': float(lateness.mean()) if len(lateness) else 0.0,
+            'lateness_max': float(lateness.max()) if len(lateness) else 0.0,
+            'plan_calls': len(latency),
+            'plan_calls_per_tick': float(np.mean(self.plan_calls)) if self.plan_calls else 0.0,
+            'plan_latency_mean': float(latency.mean()) if len(latency) else 0.0,
+            'plan_latency_p99': float(np.percentile(latency, 99)) if len(latency) else 0.0,
+            'plan_latency_max': float(latency.max()) if len(latency) else 0.0,
+        }
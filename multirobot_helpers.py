@@ -115,8 +115,9 @@ def single_bot_plot(ax, rrtx, sample_based = True):
 
     # stray nodes
     if params['nodes']:
-        if rrtx.all_nodes_coor:
+        nodes_coor = rrtx.all_nodes_coor # computed on demand
+        if len(nodes_coor):
             nodes_scatter = ax.scatter([], [], s=4, c='gray', alpha=0.5)
-            nodes_scatter.set_offsets(np.array(rrtx.all_nodes_coor))
+            nodes_scatter.set_offsets(np.array(nodes_coor))
             ax.draw_artist(nodes_scatter)
 
@@ -0,0 +1,115 @@
+"""
+Indexed binary min-heap used as the RRTX priority queue
+Keeps a node -> heap slot map so membership is O(1) and push/pop/update/remove are O(log n)
+"""
+
+
+class IndexedPriorityQueue:
+    def __init__(self):
+        self.heap = [] # list of [key, node] entries, heap ordered on key
+        self.slots = {} # id(node) -> index of its entry in self.heap
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __bool__(self):
+        return len(self.heap) > 0
+
+    def __contains__(self, node):
+        # membership is by identity on purpose, Node.__eq__ is too loose to tell queued nodes apart
+        return id(node) in self.slots
+
+    def __iter__(self):
+        # iterates over queued nodes in heap (not sorted) order
+        return (node for _, node in self.heap)
+
+    def top_key(self):
+        return self.heap[0][0]
+
+    def get_key(self, node):
+        idx = self.slots.get(id(node))
+        return None if idx is None else self.heap[idx][0]
+
+    def push(self, node, key):
+        # adds node, or updates its key if it is already queued
+        idx = self.slots.get(id(node))
+        if idx is not None:
+            self._update_at(idx, key)
+            return
+        self.heap.append([key, node])
+        self.slots[id(node)] = len(self.heap) - 1
+        self._sift_up(len(self.heap) - 1)
+
+    def update(self, node, key):
+        self._update_at(self.slots[id(node)], key)
+
+    def pop(self):
+        node = self.heap[0][1]
+        self._remove_at(0)
+        return node
+
+    def remove(self, node):
+        # returns False if node was not queued
+        idx = self.slots.get(id(node))
+        if idx is None:
+            return False
+        self._remove_at(idx)
+        return True
+
+    def clear(self):
+        self.heap = []
+        self.slots = {}
+
+    def _update_at(self, idx, key):
+        # public methods only call private helpers, so each call is one queue operation (see profiling.py)
+        old_key = self.heap[idx][0]
+        self.heap[idx][0] = key
+        if key < old_key:
+            self._sift_up(idx)
+        else:
+            self._sift_down(idx)
+
+    def _remove_at(self, idx):
+        removed = self.heap[idx]
+        last = self.heap.pop()
+        del self.slots[id(removed[1])]
+        if last is removed:
+            return
+        # move last entry into the hole and restore heap order
+        self.heap[idx] = last
+        self.slots[id(last[1])] = idx
+        self._sift_up(idx)
+        self._sift_down(self.slots[id(last[1])])
+
+    def _swap(self, i, j):
+        heap = self.heap
+        heap[i], heap[j] = heap[j], heap[i]
+        self.slots[id(heap[i][1])] = i
+        self.slots[id(heap[j][1])] = j
+
+    def _sift_up(self, idx):
+        heap = self.heap
+        while idx > 0:
+            parent = (idx - 1) >> 1
+            if heap[idx][0] < heap[parent][0]:
+                self._swap(idx, parent)
+                idx = parent
+            else:
+                break
+
+    def _sift_down(self, idx):
+        heap = self.heap
+        n = len(heap)
+        while True:
+            left = 2 * idx + 1
+            if left >= n:
+                break
+            smallest = left
+            right = left + 1
+            if right < n and heap[right][0] < heap[left][0]:
+                smallest = right
+            if heap[smallest][0] < heap[idx][0]:
+                self._swap(idx, smallest)
+                idx = smallest
+            else:
+                break
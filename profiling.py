@@ -0,0 +1,146 @@
+"""
+Opt-in per-phase timers and counters for the planners
+A StepProfiler shadows the hot methods of one planner instance with timed versions, planners that are not profiled
+run exactly the code they always did
+Every plan() call (the planning half of step()) becomes one record of a per-robot time series
+Phase times are exclusive: time spent in a nested phase (e.g. is_collision inside extend) only counts there
+"""
+
+import json
+import time
+from functools import wraps
+import numpy as np
+
+# phase -> planner methods timed as that phase, 'utils.' methods live on the planner's Utils
+PHASES = {
+    'random_node': ['random_node', 'random_node_regrow'],
+    'nearest': ['nearest', 'near', 'find_nodes_in_range'],
+    'saturate': ['saturate'],
+    'is_collision': ['utils.is_collision', 'utils.is_collision_segment', 'utils.is_collision_batch',
+                     'utils.is_collision_edges'],
+    'extend': ['extend', 'find_parent'],
+    'rewire': ['rewire', 'rewire_neighbours'],
+    'update_robot_obstacles': ['update_robot_obstacles'],
+    'propagate_descendants': ['propagate_descendants', 'remove_subtrees', 'validate'],
+    'reduce_inconsistency': ['reduce_inconsistency'],
+}
+
+COUNTERS = ['collision_checks', 'queue_ops', 'nodes_added', 'orphaned_nodes']
+
+
+class StepProfiler:
+    def __init__(self, planner, phases=PHASES, boundary='plan', series=True):
+        # boundary: the method whose calls split the time series into records
+        # series: keep every record, otherwise only the totals are kept
+        self.planner = planner
+        self.phases = phases
+        self.series = series
+        self.records = []
+        self.steps = 0
+        self.start_time = time.perf_counter()
+        self.totals = dict.fromkeys(phases, 0.0) # exclusive time per phase over the whole run
+        self.current = dict.fromkeys(phases, 0.0) # same, for the record being collected
+        self.counts = dict.fromkeys(COUNTERS, 0) # running totals
+        self.last_counts = dict(self.counts) # running totals at the last record
+        self.stack = [] # [start time, time in nested phases] of every phase currently running
+
+        for phase, names in phases.items():
+            for name in names:
+                owner, attr = self.owner_of(name)
+                if owner is not None and hasattr(owner, attr):
+                    setattr(owner, attr, self.timed(phase, getattr(owner, attr)))
+
+        # counters
+        utils = getattr(planner, 'utils', None)
+        if utils is not None:
+            self.count(utils, 'is_collision', 'collision_checks', lambda args: 1)
+            self.count(utils, 'is_collision_segment', 'collision_checks', lambda args: 1)
+            self.count(utils, 'is_collision_batch', 'collision_checks', lambda args: len(args[0]))
+            self.count(utils, 'is_collision_edges', 'collision_checks', lambda args: len(args[0]))
+        queue = getattr(planner, 'Q', None)
+        if queue is not None:
+            for name in ('push', 'update', 'pop', 'remove'):
+                self.count(queue, name, 'queue_ops', lambda args: 1)
+        if hasattr(planner, 'tree_nodes'):
+            self.count(planner, 'add_node', 'nodes_added', lambda args: args[0] not in planner.tree_nodes)
+
+        if hasattr(planner, boundary):
+            setattr(planner, boundary, self.recorded(getattr(planner, boundary)))
+
+    def owner_of(self, name):
+        if name.startswith('utils.'):
+            return getattr(self.planner, 'utils', None), name[len('utils.'):]
+        return self.planner, name
+
+    def timed(self, phase, method):
+        @wraps(method)
+        def timed_method(*args, **kwargs):
+            self.stack.append([time.perf_counter(), 0.0])
+            try:
+                return method(*args, **kwargs)
+            finally:
+                start, nested = self.stack.pop()
+                elapsed = time.perf_counter() - start
+                self.current[phase] += elapsed - nested
+                if self.stack:
+                    self.stack[-1][1] += elapsed
+        return timed_method
+
+    def count(self, owner, name, counter, amount):
+        method = getattr(owner, name, None)
+        if method is None:
+            return
+
+        @wraps(method)
+        def counted_method(*args, **kwargs):
+            self.counts[counter] += amount(args)
+            return method(*args, **kwargs)
+        setattr(owner, name, counted_method)
+
+    def recorded(self, method):
+        @wraps(method)
+        def recorded_method(*args, **kwargs):
+            size_before = len(getattr(self.planner, 'tree_nodes', ()))
+            added_before = self.counts['nodes_added']
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                total = time.perf_counter() - start
+                # nodes that left the tree this step, either orphaned (RRTX) or cut off with a subtree (DRRT, DRRT*)
+                added = self.counts['nodes_added'] - added_before
+                size_after = len(getattr(self.planner, 'tree_nodes', ()))
+                self.counts['orphaned_nodes'] += max(0, size_before + added - size_after)
+                self.record(start, total)
+        return recorded_method
+
+    def record(self, start, total):
+        record = {'step': self.steps, 'time': start - self.start_time, 'total': total}
+        for phase, t in self.current.items():
+            record[phase] = t
+            self.totals[phase] += t
+            self.current[phase] = 0.0
+        record['other'] = max(0.0, total - sum(record[phase] for phase in self.phases))
+        for counter, count in self.counts.items():
+            record[counter] = count - self.last_counts[counter]
+        self.last_counts = dict(self.counts)
+        record['tree_nodes'] = len(getattr(self.planner, 'tree_nodes', ()))
+        if self.series:
+            self.records.append(record)
+        self.steps += 1
+
+    def columns(self):
+        # the time series as name -> array, times are in seconds and counters are per step
+        names = ['step', 'time', 'total'] + list(self.phases) + ['other'] + COUNTERS + ['tree_nodes']
+        return {name: np.array([record[name] for record in self.records]) for name in names}
+
+    def slowest(self, n=10):
+        # the n slowest steps, longest first
+        return sorted(self.records, key=lambda record: record['total'], reverse=True)[:n]
+
+
+def export(profilers, path):
+    # writes the time series of every robot to a JSON file, {robot index: {name: [values per step]}}
+    with open(path, 'w') as f:
+        json.dump({str(i): {name: values.tolist() for name, values in profiler.columns().items()}
+                   for i, profiler in enumerate(profilers)}, f)
@@ -0,0 +1,96 @@
+"""
+Predicted swept volumes of other robots for the sampling based planners
+Each other robot is tracked with its velocity and, if it has one, its published path, and is predicted to sweep a
+chain of capsules (segments grown by its radius) over the next horizon steps
+A prediction is only redone once the robot strays from it, so planners repair their tree once per predicted conflict
+instead of every time a robot moves a fixed distance
+"""
+
+import math
+import numpy as np
+
+from utils import CollisionWorld
+
+
+class PredictedRobot:
+    def __init__(self, position, radius):
+        self.position = np.array(position[:2], dtype=float)
+        self.velocity = np.zeros(2) # displacement per step
+        self.radius = radius
+        self.speed = 0.0 # predicted distance per step along the corridor
+        self.corridor = np.array([np.append(self.position, self.position)]) # (K, 4) segments of the predicted path
+        self.arc = np.zeros(1) # path length at the start of each corridor segment
+        self.steps = 0 # steps since the prediction was made
+        self.epoch = 0 # bumped on every new prediction
+        self.cache = {} # (x1, y1, x2, y2) -> collides with the corridor, only valid for this epoch
+
+    def position_at(self, t):
+        # predicted position after t steps
+        s = self.speed * t
+        k = max(0, np.searchsorted(self.arc, s, side='right') - 1)
+        x1, y1, x2, y2 = self.corridor[k]
+        length = math.hypot(x2 - x1, y2 - y1)
+        f = 0.0 if length == 0 else min(1.0, (s - self.arc[k]) / length)
+        return np.array([x1 + f * (x2 - x1), y1 + f * (y2 - y1)])
+
+
+class RobotPredictor:
+    def __init__(self, horizon, delta):
+        self.horizon = horizon # how many steps ahead robots are predicted
+        self.delta = delta # how far a robot may stray from its prediction before it is redone
+        self.robots = {} # other robot index -> PredictedRobot
+
+    def observe(self, idx, robot):
+        # update the velocity estimate of robot idx, returns True if it got a new prediction
+        track = self.robots.get(idx)
+        if track is None:
+            track = self.robots[idx] = PredictedRobot(robot.robot_position, robot.robot_radius)
+            self.predict(track, robot)
+            return True
+        position = np.array(robot.robot_position[:2], dtype=float)
+        track.velocity = position - track.position
+        track.position = position
+        track.steps += 1
+        off_track = np.hypot(*(position - track.position_at(track.steps))) > self.delta
+        if off_track or track.steps >= self.horizon / 2:
+            self.predict(track, robot)
+            return True
+        return False
+
+    def predict(self, track, robot):
+        # corridor along the published path if the robot has one, along its velocity otherwise
+        track.speed = float(np.hypot(*track.velocity))
+        length = track.speed * self.horizon
+        path = robot.published_path(length) if hasattr(robot, 'published_path') else None
+        if not path or len(path) < 2:
+            path = [track.position, track.position + track.velocity * self.horizon]
+        path = np.array(path, dtype=float)
+        track.corridor = np.hstack((path[:-1], path[1:]))
+        seg_len = np.hypot(track.corridor[:, 2] - track.corridor[:, 0], track.corridor[:, 3] - track.corridor[:, 1])
+        track.arc = np.concatenate(([0.0], np.cumsum(seg_len)[:-1]))
+        track.steps = 0
+        track.epoch += 1
+        track.cache = {}
+
+    def clear(self):
+        self.robots = {}
+
+    def segments_collide(self, idx, segs):
+        # which of the segments (x1, y1, x2, y2) come within the radius of robot idx during the horizon
+        # results are cached per segment until the robot gets a new prediction
+        track = self.robots[idx]
+        hits = [track.cache.get(tuple(seg)) for seg in segs]
+        missing = [k for k, hit in enumerate(hits) if hit is None]
+        if missing:
+            d2 = CollisionWorld.segment_segment_dist2(np.array([segs[k] for k in missing], dtype=float).reshape(-1, 4),
+                                                      track.corridor)
+            for k, hit in zip(missing, (d2 <= track.radius**2).any(axis=1)):
+                hits[k] = track.cache[tuple(segs[k])] = bool(hit)
+        return hits
+
+    def search_regions(self, idx, margin):
+        # (x, y, r) circles that together cover every segment end within margin of the corridor of robot idx
+        corridor = self.robots[idx].corridor
+        mid = (corridor[:, :2] + corridor[:, 2:]) / 2
+        half = np.hypot(corridor[:, 2] - corridor[:, 0], corridor[:, 3] - corridor[:, 1]) / 2
+        return [(x, y, h + self.robots[idx].radius + margin) for (x, y), h in zip(mid.tolist(), half.tolist())]
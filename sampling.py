@@ -0,0 +1,200 @@
+"""
+Where the tree planners put new random nodes
+A sampler is passed as sampler= to RRTX, DRRT or DRRTStar, random_node() still samples the robot's position and the
+waypoints itself and asks the sampler for everything else
+- UniformSampler: uniform over the map, the default
+- InformedSampler: uniform over the ellipse of points that could shorten the path from the robot to the goal, once
+  there is one (Informed RRT*, see reference algorithms/rrt_2D/informed_rrt_star.py)
+- BoundarySampler: part of the samples just outside obstacles, where narrow passages and detours are
+- HaltonSampler: a low discrepancy Halton stream instead of random points, computed a block at a time
+Samplers with state (HaltonSampler) belong to one planner, give every robot its own
+Samplers draw their random numbers from planner.rng, the RandomStream of the planner (see seed= of the planners)
+"""
+
+import math
+import numpy as np
+
+BLOCK = 4096 # numbers a RandomStream draws from its generator at once
+
+
+class RandomStream:
+    '''
+    Uniform random numbers of one np.random.Generator, drawn a block at a time
+    - one Generator call per block instead of one np.random call per number, a number is then a list lookup
+    - every planner has its own, so its samples only depend on its seed and not on what other robots or processes
+      drew before (a forked process copies the global np.random state, so all of them drew the same numbers)
+    '''
+    def __init__(self, seed=None, block=BLOCK):
+        # seed: anything np.random.default_rng() takes, None draws one from np.random, so np.random.seed() still
+        # makes runs repeatable
+        if seed is None:
+            seed = np.random.randint(2**31)
+        self.generator = np.random.default_rng(seed)
+        self.block = block
+        self.values = iter(())
+
+    def random(self):
+        # uniform in [0, 1)
+        value = next(self.values, None)
+        if value is None:
+            self.values = iter(self.generator.random(self.block).tolist())
+            value = next(self.values)
+        return value
+
+    def uniform(self, low, high):
+        return low + (high - low) * self.random()
+
+    def integers(self, low, high):
+        # uniform integer in [low, high)
+        return min(low + int((high - low) * self.random()), high - 1)
+
+
+class Sampler:
+    # base of the samplers, which only need a sample(planner) method returning a point (x, y) inside planner.x_range
+    # and planner.y_range, at least planner.utils.delta from their edges (see bounds())
+    @staticmethod
+    def bounds(planner):
+        # (x_min, x_max, y_min, y_max) samples have to be in
+        delta = planner.utils.delta
+        return (planner.x_range[0] + delta, planner.x_range[1] - delta,
+                planner.y_range[0] + delta, planner.y_range[1] - delta)
+
+
+class UniformSampler(Sampler):
+    def sample(self, planner):
+        delta, rng = planner.utils.delta, planner.rng
+        return (rng.uniform(planner.x_range[0] + delta, planner.x_range[1] - delta),
+                rng.uniform(planner.y_range[0] + delta, planner.y_range[1] - delta))
+
+
+class InformedSampler(Sampler):
+    def __init__(self, fallback=None, max_tries=20):
+        # fallback: sampler used while there is no path, and when max_tries samples of the ellipse all land
+        # outside the map
+        self.fallback = UniformSampler() if fallback is None else fallback
+        self.max_tries = max_tries
+
+    @staticmethod
+    def path_cost(planner):
+        # length of the path from the robot's node to the goal, inf without one
+        if not planner.path_to_goal:
+            return math.inf
+        node = planner.s_bot
+        cost = getattr(node, 'cost_to_goal', None)
+        if cost is not None:
+            return cost
+        # DRRT does not keep costs, walk the path
+        cost = 0.0
+        while node.parent:
+            cost += math.hypot(node.x - node.parent.x, node.y - node.parent.y)
+            node = node.parent
+        return cost
+
+    def sample(self, planner):
+        c_best = self.path_cost(planner)
+        if c_best == math.inf:
+            return self.fallback.sample(planner)
+        # ellipse with the robot's node and the goal as foci, every point in it could be on a path shorter than c_best
+        x1, y1, x2, y2 = planner.s_bot.x, planner.s_bot.y, planner.s_goal.x, planner.s_goal.y
+        c_min = math.hypot(x2 - x1, y2 - y1)
+        a = c_best / 2.0
+        b = math.sqrt(max(c_best**2 - c_min**2, 0.0)) / 2.0
+        theta = math.atan2(y2 - y1, x2 - x1)
+        cos_t, sin_t = math.cos(theta), math.sin(theta)
+        cx, cy = (x1 + x2) / 2.0, (y1 + y2) / 2.0
+        x_min, x_max, y_min, y_max = self.bounds(planner)
+        rng = planner.rng
+        for _ in range(self.max_tries):
+            # uniform in the unit disk, stretched to the ellipse and rotated onto the line between the foci
+            r, phi = math.sqrt(rng.random()), 2 * math.pi * rng.random()
+            u, v = a * r * math.cos(phi), b * r * math.sin(phi)
+            x, y = cx + cos_t * u - sin_t * v, cy + sin_t * u + cos_t * v
+            if x_min <= x <= x_max and y_min <= y <= y_max:
+                return (x, y)
+        return self.fallback.sample(planner)
+
+
+class BoundarySampler(Sampler):
+    def __init__(self, bias=0.3, margin=1.0, fallback=None):
+        # bias: share of samples placed within margin of an obstacle (outside its grown boundary), the rest come from
+        # fallback
+        self.bias = bias
+        self.margin = margin
+        self.fallback = UniformSampler() if fallback is None else fallback
+
+    def sample(self, planner):
+        rng = planner.rng
+        if rng.random() >= self.bias:
+            return self.fallback.sample(planner)
+        circles, rectangles = planner.obs_circle, planner.obs_rectangle
+        # obstacles are picked by how long their boundary is, so the boundary is covered evenly
+        lengths = [2 * math.pi * r for _, _, r in circles] + [2 * (w + h) for _, _, w, h in rectangles]
+        total = sum(lengths)
+        if total <= 0:
+            return self.fallback.sample(planner)
+        gap = planner.utils.delta + self.margin * rng.random() # distance outside the obstacle
+        k = int(np.searchsorted(np.cumsum(lengths), rng.random() * total, side='right'))
+        k = min(k, len(lengths) - 1)
+        if k < len(circles):
+            x, y, r = circles[k]
+            phi = 2 * math.pi * rng.random()
+            point = (x + (r + gap) * math.cos(phi), y + (r + gap) * math.sin(phi))
+        else:
+            x, y, w, h = rectangles[k - len(circles)]
+            # a point on the rectangle grown by gap, corners are left square
+            x, y, w, h = x - gap, y - gap, w + 2 * gap, h + 2 * gap
+            t = rng.random() * 2 * (w + h)
+            if t < w:
+                point = (x + t, y)
+            elif t < w + h:
+                point = (x + w, y + t - w)
+            elif t < 2 * w + h:
+                point = (x + 2 * w + h - t, y + h)
+            else:
+                point = (x, y + 2 * (w + h) - t)
+        x_min, x_max, y_min, y_max = self.bounds(planner)
+        if not (x_min <= point[0] <= x_max and y_min <= point[1] <= y_max):
+            return self.fallback.sample(planner)
+        return point
+
+
+def radical_inverse(idx, base):
+    # van der Corput sequence in base for the integers idx, idx >= 0
+    idx = np.array(idx, dtype=np.int64)
+    result = np.zeros(idx.shape)
+    f = 1.0 / base
+    while idx.any():
+        result += f * (idx % base)
+        idx //= base
+        f /= base
+    return result
+
+
+class HaltonSampler(Sampler):
+    def __init__(self, block=1024, bases=(2, 3)):
+        # block: points computed at once, the stream continues where the last block ended
+        # the points are shifted by a random offset (Cranley-Patterson rotation) drawn from the planner's stream on the
+        # first sample, so seeded runs stay repeatable and robots sharing a map do not all sample the same points
+        self.block = block
+        self.bases = bases
+        self.next_index = 1 # index 0 is the corner of the map
+        self.shift = None
+        self.points = []
+        self.pos = 0
+
+    def fill(self, rng):
+        if self.shift is None:
+            self.shift = np.array([rng.random(), rng.random()])
+        idx = np.arange(self.next_index, self.next_index + self.block)
+        self.next_index += self.block
+        unit = np.column_stack([radical_inverse(idx, base) for base in self.bases])
+        self.points = ((unit + self.shift) % 1.0).tolist()
+        self.pos = 0
+
+    def sample(self, planner):
+        if self.pos >= len(self.points):
+            self.fill(planner.rng)
+        u, v = self.points[self.pos]
+        self.pos += 1
+        x_min, x_max, y_min, y_max = self.bounds(planner)
+        return (x_min + u * (x_max - x_min), y_min + v * (y_max - y_min))
@@ -0,0 +1,287 @@
+"""
+Uniform grid hashes
+SpatialIndex: nearest neighbour and radius queries on planner trees, replaces the recursive kdtree package,
+which never rebalances after add/remove
+PositionIndex: exact lookup of DRRT and DRRT* nodes by position, up to the tolerance their Node.__eq__ uses
+ObstacleGrid: broad phase for the Velocity Obstacle agents over circles, rectangles and robots
+"""
+
+import math
+import numpy as np
+
+REBUILD_FRACTION = 0.75 # SpatialIndex.bulk_remove() rebuilds the index instead when removing more than this share
+
+
+class SpatialIndex:
+    def __init__(self, cell_size, nodes=()):
+        self.cell_size = float(cell_size)
+        self.cells = {} # (i, j) -> {id(node): node}
+        self.size = 0
+        # bounds of every cell ever used, only grows, caps the ring search in nearest()
+        self.i_min = self.j_min = math.inf
+        self.i_max = self.j_max = -math.inf
+        for node in nodes:
+            self.insert(node)
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, node):
+        cell = self.cells.get(self.cell_of(node.x, node.y))
+        return cell is not None and id(node) in cell
+
+    def cell_of(self, x, y):
+        return (int(math.floor(x / self.cell_size)), int(math.floor(y / self.cell_size)))
+
+    def insert(self, node):
+        key = self.cell_of(node.x, node.y)
+        cell = self.cells.get(key)
+        if cell is None:
+            cell = self.cells[key] = {}
+            i, j = key
+            self.i_min, self.i_max = min(self.i_min, i), max(self.i_max, i)
+            self.j_min, self.j_max = min(self.j_min, j), max(self.j_max, j)
+        if id(node) not in cell:
+            cell[id(node)] = node
+            self.size += 1
+
+    def bulk_insert(self, nodes, coords=None):
+        # inserts many nodes at once, coords (N, 2) are their positions if already at hand
+        # cells of all nodes are computed in one NumPy pass and the bounds only updated once
+        nodes = list(nodes)
+        if not nodes:
+            return
+        if coords is None:
+            coords = [(node.x, node.y) for node in nodes]
+        keys = np.floor(np.asarray(coords, dtype=float).reshape(-1, 2) / self.cell_size).astype(np.int64)
+        lo, hi = keys.min(axis=0).tolist(), keys.max(axis=0).tolist()
+        self.i_min, self.i_max = min(self.i_min, lo[0]), max(self.i_max, hi[0])
+        self.j_min, self.j_max = min(self.j_min, lo[1]), max(self.j_max, hi[1])
+        cells = self.cells
+        for node, key in zip(nodes, map(tuple, keys.tolist())):
+            cell = cells.get(key)
+            if cell is None:
+                cell = cells[key] = {}
+            if id(node) not in cell:
+                cell[id(node)] = node
+                self.size += 1
+
+    def remove(self, node):
+        # returns False if node was not in the index
+        key = self.cell_of(node.x, node.y)
+        cell = self.cells.get(key)
+        if cell is None or cell.pop(id(node), None) is None:
+            return False
+        if not cell:
+            del self.cells[key]
+        self.size -= 1
+        return True
+
+    def bulk_remove(self, nodes):
+        # returns the number of nodes actually removed
+        # removing most of the index one by one is slower than inserting the nodes that stay again
+        if len(nodes) > REBUILD_FRACTION * self.size:
+            gone = {id(node) for node in nodes}
+            remaining = [node for cell in self.cells.values() for node in cell.values() if id(node) not in gone]
+            removed = self.size - len(remaining)
+            self.clear()
+            self.bulk_insert(remaining)
+            return removed
+        removed = 0
+        for node in nodes:
+            removed += self.remove(node)
+        return removed
+
+    def clear(self):
+        self.cells = {}
+        self.size = 0
+        self.i_min = self.j_min = math.inf
+        self.i_max = self.j_max = -math.inf
+
+    def nearest(self, pos):
+        # closest node to pos, None if the index is empty
+        if not self.size:
+            return None
+        x, y = pos
+        ci, cj = self.cell_of(x, y)
+        max_ring = max(ci - self.i_min, self.i_max - ci, cj - self.j_min, self.j_max - cj)
+        best, best_d2 = None, math.inf
+        ring = 0
+        while ring <= max_ring:
+            for key in self.ring_cells(ci, cj, ring):
+                cell = self.cells.get(key)
+                if not cell:
+                    continue
+                for node in cell.values():
+                    d2 = (node.x - x)**2 + (node.y - y)**2
+                    if d2 < best_d2:
+                        best, best_d2 = node, d2
+            # anything in the next ring is at least ring * cell_size away
+            if best is not None and best_d2 <= (ring * self.cell_size)**2:
+                break
+            ring += 1
+        return best
+
+    def radius_query(self, pos, r):
+        # all nodes strictly closer than r to pos
+        x, y = pos
+        r2 = r * r
+        i_lo, j_lo = self.cell_of(x - r, y - r)
+        i_hi, j_hi = self.cell_of(x + r, y + r)
+        results = []
+        if (i_hi - i_lo + 1) * (j_hi - j_lo + 1) > len(self.cells):
+            # query box covers more cells than are occupied, walk the occupied ones instead
+            keys = [key for key in self.cells if i_lo <= key[0] <= i_hi and j_lo <= key[1] <= j_hi]
+        else:
+            keys = [(i, j) for i in range(i_lo, i_hi + 1) for j in range(j_lo, j_hi + 1)]
+        for key in keys:
+            cell = self.cells.get(key)
+            if not cell:
+                continue
+            for node in cell.values():
+                if (node.x - x)**2 + (node.y - y)**2 < r2:
+                    results.append(node)
+        return results
+
+    @staticmethod
+    def ring_cells(ci, cj, ring):
+        # cells on the square ring at chebyshev distance ring from (ci, cj)
+        if ring == 0:
+            yield (ci, cj)
+            return
+        for i in range(ci - ring, ci + ring + 1):
+            yield (i, cj - ring)
+            yield (i, cj + ring)
+        for j in range(cj - ring + 1, cj + ring):
+            yield (ci - ring, j)
+            yield (ci + ring, j)
+
+
+class PositionIndex:
+    '''
+    Lookup of tree nodes by position, with the 1e-6 tolerance Node.__eq__ of DRRT and DRRT* uses
+    - Node.__hash__ hashes the exact coordinates, so a set only finds nodes at exactly the same position
+    - a node closer than tol to a point is in the point's cell, or in a neighbouring one if the point is closer than
+      tol to that side, which with cells much wider than tol is rare
+    '''
+    def __init__(self, nodes=(), tol=1e-6, cell_size=1e-3):
+        self.tol = tol
+        self.inv_cell = 1.0 / cell_size
+        self.tol_cells = tol / cell_size # tol in cell widths
+        self.cells = {} # (i, j) -> list of nodes, almost always just one
+        self.size = 0
+        for node in nodes:
+            self.insert(node)
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, node):
+        # whether a node equal to node (closer than tol) is indexed
+        return self.find(node.x, node.y) is not None
+
+    def cell_of(self, x, y):
+        return (math.floor(x * self.inv_cell), math.floor(y * self.inv_cell))
+
+    def insert(self, node):
+        self.cells.setdefault(self.cell_of(node.x, node.y), []).append(node)
+        self.size += 1
+
+    def remove(self, node):
+        # removes node itself (not an equal one), returns False if it was not indexed
+        key = self.cell_of(node.x, node.y)
+        cell = self.cells.get(key)
+        if not cell:
+            return False
+        for k, other in enumerate(cell):
+            if other is node:
+                del cell[k]
+                if not cell:
+                    del self.cells[key]
+                self.size -= 1
+                return True
+        return False
+
+    def find(self, x, y):
+        # an indexed node closer than tol to (x, y), None if there is none, the point's own cell is searched first
+        fx, fy = x * self.inv_cell, y * self.inv_cell
+        i, j = math.floor(fx), math.floor(fy)
+        di = -1 if fx - i < self.tol_cells else 1 if i + 1 - fx < self.tol_cells else 0
+        dj = -1 if fy - j < self.tol_cells else 1 if j + 1 - fy < self.tol_cells else 0
+        keys = [(i, j)]
+        if di:
+            keys.append((i + di, j))
+        if dj:
+            keys.append((i, j + dj))
+        if di and dj:
+            keys.append((i + di, j + dj))
+        cells = self.cells
+        for key in keys:
+            cell = cells.get(key)
+            if cell:
+                for node in cell:
+                    if math.hypot(node.x - x, node.y - y) < self.tol:
+                        return node
+        return None
+
+    def clear(self):
+        self.cells = {}
+        self.size = 0
+
+
+class ObstacleGrid:
+    def __init__(self, cell_size, circles=(), rectangles=()):
+        self.cell_size = float(cell_size)
+        self.set_static(circles, rectangles)
+        self.rebuild([])
+
+    def cell_range(self, x_min, y_min, x_max, y_max):
+        i_lo, j_lo = int(math.floor(x_min / self.cell_size)), int(math.floor(y_min / self.cell_size))
+        i_hi, j_hi = int(math.floor(x_max / self.cell_size)), int(math.floor(y_max / self.cell_size))
+        return [(i, j) for i in range(i_lo, i_hi + 1) for j in range(j_lo, j_hi + 1)]
+
+    def set_static(self, circles, rectangles):
+        # circles (x, y, r) are binned by centre, rectangles (x, y, w, h) into every cell they overlap
+        # call again whenever obstacles are added or removed
+        self.circles = np.array(circles, dtype=float).reshape(-1, 3)
+        self.rectangles = np.array(rectangles, dtype=float).reshape(-1, 4)
+        self.circle_cells = {}
+        for k, (x, y, _) in enumerate(self.circles.tolist()):
+            self.circle_cells.setdefault(self.cell_range(x, y, x, y)[0], []).append(k)
+        self.rectangle_cells = {}
+        for k, (x, y, w, h) in enumerate(self.rectangles.tolist()):
+            for key in self.cell_range(x, y, x + w, y + h):
+                self.rectangle_cells.setdefault(key, []).append(k)
+
+    def rebuild(self, robots):
+        # snapshot the state (x, y, vx, vy) of every robot, once per tick when shared between agents
+        self.robot_index = {id(robot): k for k, robot in enumerate(robots)}
+        self.robot_states = np.array([
+            robot.robot_state[:4] if hasattr(robot, 'robot_state') else (*robot.robot_position[:2], 0.0, 0.0)
+            for robot in robots
+        ], dtype=float).reshape(-1, 4)
+        self.robot_cells = {}
+        keys = np.floor(self.robot_states[:, :2] / self.cell_size).astype(int).tolist()
+        for k, key in enumerate(keys):
+            self.robot_cells.setdefault(tuple(key), []).append(k)
+
+    def query(self, pos, r, exclude=None, rectangle_r=None):
+        # everything closer than r to pos (centre distance for robots and circles, closest point for rectangles)
+        # returns robot states (K, 4), circles (C, 3) and the closest point of each rectangle as (x, y, 0) circles
+        # rectangles closer than rectangle_r instead when given, their cells are only searched that far
+        x, y = pos[0], pos[1]
+        keys = self.cell_range(x - r, y - r, x + r, y + r)
+        skip = self.robot_index.get(id(exclude))
+        robots = self.robot_states[[k for key in keys for k in self.robot_cells.get(key, ()) if k != skip]]
+        robots = robots[np.hypot(robots[:, 0] - x, robots[:, 1] - y) < r]
+        circles = self.circles[[k for key in keys for k in self.circle_cells.get(key, ())]]
+        circles = circles[np.hypot(circles[:, 0] - x, circles[:, 1] - y) < r]
+        if rectangle_r is not None:
+            r = rectangle_r
+            keys = self.cell_range(x - r, y - r, x + r, y + r)
+        rectangles = self.rectangles[sorted({k for key in keys for k in self.rectangle_cells.get(key, ())})]
+        closest = np.column_stack((np.clip(x, rectangles[:, 0], rectangles[:, 0] + rectangles[:, 2]),
+                                   np.clip(y, rectangles[:, 1], rectangles[:, 1] + rectangles[:, 3]),
+                                   np.zeros(len(rectangles))))
+        closest = closest[np.hypot(closest[:, 0] - x, closest[:, 1] - y) < r]
+        return robots, circles, closest
@@ -0,0 +1,110 @@
+"""
+Precomputed static obstacle geometry, shared by every planner in the process
+A grid over the obstacles holds the signed distance from each cell centre to the grown obstacles (circles grown by
+delta and the grown boxes, the set no endpoint may be in), from which
+- cells entirely outside or entirely inside the obstacles answer point checks with one lookup
+- the clearance of the two endpoints of a segment proves it free when together they exceed its length
+Cells an obstacle edge passes through are left undecided and CollisionWorld does the exact checks there, so answers
+are always the same as without the map
+"""
+
+import math
+import numpy as np
+
+FREE, MIXED, INSIDE = 0, 1, 2
+
+MAX_SHARED = 4 # maps kept by shared(), obstacles only change when added or removed by hand
+shared_maps = {}
+
+
+def shared(circles, boxes, delta, resolution):
+    # one map per obstacle set, every planner with the same obstacles gets the same (read only) map
+    key = (circles.tobytes(), boxes.tobytes(), delta, resolution)
+    static_map = shared_maps.get(key)
+    if static_map is None:
+        if len(shared_maps) >= MAX_SHARED:
+            del shared_maps[next(iter(shared_maps))] # oldest first
+        static_map = shared_maps[key] = StaticMap(circles, boxes, delta, resolution)
+    return static_map
+
+
+class StaticMap:
+    def __init__(self, circles, boxes, delta, resolution=0.25):
+        # circles (M, 3) as (x, y, r) and boxes (K, 4) as (x_min, y_min, x_max, y_max), already grown by delta
+        circles = np.asarray(circles, dtype=float).reshape(-1, 3)
+        boxes = np.asarray(boxes, dtype=float).reshape(-1, 4)
+        self.resolution = float(resolution)
+        self.inv_res = 1.0 / self.resolution
+
+        # grid over everything the obstacles cover plus one cell, points outside it are always undecided
+        reach = circles[:, 2:] + delta
+        extents = np.vstack((np.hstack((circles[:, :2] - reach, circles[:, :2] + reach)), boxes))
+        if not len(extents):
+            extents = np.zeros((1, 4))
+        self.x0 = float(extents[:, 0].min()) - self.resolution
+        self.y0 = float(extents[:, 1].min()) - self.resolution
+        self.nx = int(math.ceil((float(extents[:, 2].max()) + self.resolution - self.x0) * self.inv_res))
+        self.ny = int(math.ceil((float(extents[:, 3].max()) + self.resolution - self.y0) * self.inv_res))
+
+        cx, cy = np.meshgrid(self.x0 + (np.arange(self.nx) + 0.5) * self.resolution,
+                             self.y0 + (np.arange(self.ny) + 0.5) * self.resolution, indexing='ij')
+        sdf = np.full((self.nx, self.ny), np.inf)
+        for x, y, r in circles.tolist():
+            sdf = np.minimum(sdf, np.hypot(cx - x, cy - y) - (r + delta))
+        for x_min, y_min, x_max, y_max in boxes.tolist():
+            qx = np.maximum(x_min - cx, cx - x_max)
+            qy = np.maximum(y_min - cy, cy - y_max)
+            sdf = np.minimum(sdf, np.hypot(np.maximum(qx, 0.0), np.maximum(qy, 0.0)) + np.minimum(np.maximum(qx, qy), 0.0))
+        self.sdf = sdf
+
+        # the distance field changes by at most half a cell diagonal within a cell, plus a little for rounding
+        half_diag = self.resolution * math.sqrt(0.5) + 1e-9
+        self.clearance = np.maximum(sdf - half_diag, 0.0) # distance every point of the cell has to the obstacles
+        self.state = np.full((self.nx, self.ny), MIXED, dtype=np.int8)
+        self.state[sdf > half_diag] = FREE
+        self.state[sdf < -half_diag] = INSIDE
+        for a in (self.sdf, self.clearance, self.state):
+            a.flags.writeable = False
+        # plain lists for the single point path, indexing a NumPy array for one value is slow
+        self.state_list = self.state.tolist()
+        self.clearance_list = self.clearance.tolist()
+
+    def cell_of(self, x, y):
+        # (i, j) of the cell holding (x, y), None outside the grid
+        fx = (x - self.x0) * self.inv_res
+        fy = (y - self.y0) * self.inv_res
+        if 0.0 <= fx < self.nx and 0.0 <= fy < self.ny:
+            return int(fx), int(fy)
+        return None
+
+    def point_state(self, x, y):
+        cell = self.cell_of(x, y)
+        return MIXED if cell is None else self.state_list[cell[0]][cell[1]]
+
+    def point_clearance(self, x, y):
+        # distance (x, y) is at least from the obstacles, 0 if it is inside, undecided or off the grid
+        cell = self.cell_of(x, y)
+        return 0.0 if cell is None else self.clearance_list[cell[0]][cell[1]]
+
+    def cells_of(self, points):
+        # (N, 2) points -> cell indices (N,) (N,) and which points are on the grid
+        f = (np.asarray(points, dtype=float).reshape(-1, 2) - (self.x0, self.y0)) * self.inv_res
+        on_grid = ((f >= 0) & (f < (self.nx, self.ny))).all(axis=1)
+        idx = np.where(on_grid[:, None], f, 0).astype(int)
+        return idx[:, 0], idx[:, 1], on_grid
+
+    def points_state(self, points):
+        i, j, on_grid = self.cells_of(points)
+        return np.where(on_grid, self.state[i, j], MIXED)
+
+    def points_clearance(self, points):
+        i, j, on_grid = self.cells_of(points)
+        return np.where(on_grid, self.clearance[i, j], 0.0)
+
+    def segments_free(self, segs):
+        # (N, 4) segments -> bool[N], True where the clearance of the endpoints proves the segment free
+        # every point of a segment is closer than a to one endpoint or than b to the other when a + b > its length
+        segs = np.asarray(segs, dtype=float).reshape(-1, 4)
+        ab = self.points_clearance(segs.reshape(-1, 2)).reshape(-1, 2) # both endpoints in one lookup
+        length = np.hypot(segs[:, 2] - segs[:, 0], segs[:, 3] - segs[:, 1])
+        return (ab.min(axis=1) > 0) & (ab.sum(axis=1) > length)
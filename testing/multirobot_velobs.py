@@ -6,7 +6,7 @@ import sys
 sys.path.insert(1, '../')
 sys.path.insert(1, '../algorithms')
 
-from algorithms.velocity_obstacle import Velocity_Obstacle
+from algorithms.velocity_obstacle import Velocity_Obstacle, share_broad_phase
 import multirobot_helpers as mrh
 
 if __name__ == '__main__':
@@ -118,6 +118,7 @@ if __name__ == '__main__':
     robots = [r1, r2, r3, r4]
     for robot in robots:
         robot.set_other_robots([other for other in robots if other != robot])
+    broad_phase = share_broad_phase(robots) # rebuilt once per tick
     
     # plotting stuff
     matplotlib.use('Tkagg')
@@ -137,6 +138,7 @@ if __name__ == '__main__':
     
     for i in range(vel_obs_params['iter_max']):
         # Velocity Obstacle step for each robot
+        broad_phase.rebuild(robots)
         for robot in robots:
             robot.step()
 
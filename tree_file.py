@@ -0,0 +1,77 @@
+"""
+Planner trees saved to disk, so experiments can start from a tree grown once for a map and goal
+A tree is one uncompressed NumPy .npz file of flat arrays: node coordinates, parent indices and costs, plus the
+neighbour sets of RRTX as CSR index arrays (offsets into one flat array of slots)
+The goal and obstacles the tree was grown for are stored with it and checked on load, see save_tree() and
+load_tree() of RRTX, DRRT and DRRTStar
+"""
+
+import numpy as np
+
+VERSION = 1
+
+
+def map_arrays(planner):
+    # the obstacles a tree is only valid for
+    return {
+        'obs_circle': np.array(planner.obs_circle, dtype=float).reshape(-1, 3),
+        'obs_rectangle': np.array(planner.obs_rectangle, dtype=float).reshape(-1, 4),
+        'obs_boundary': np.array(planner.obs_boundary, dtype=float).reshape(-1, 4),
+    }
+
+
+def save(path, planner, kind, **arrays):
+    # kind: name of the planner class, trees of one planner can't be loaded into another
+    # np.savez adds .npz to path if it does not end with it
+    np.savez(path, version=VERSION, kind=kind, goal=np.array([planner.s_goal.x, planner.s_goal.y]),
+             **map_arrays(planner), **arrays)
+
+
+def load(path, planner, kind):
+    # returns the arrays saved with save(), ValueError if the tree is not one for this planner, goal and map
+    with np.load(path) as f:
+        data = {key: f[key] for key in f.files}
+    if int(data.get('version', -1)) != VERSION or str(data.get('kind')) != kind:
+        raise ValueError(f'{path} is not a saved {kind} tree')
+    if np.hypot(*(data['goal'] - (planner.s_goal.x, planner.s_goal.y))) >= 1e-6:
+        raise ValueError(f'{path} was grown for the goal {tuple(data["goal"].tolist())}')
+    for key, obstacles in map_arrays(planner).items():
+        if not np.array_equal(data[key], obstacles):
+            raise ValueError(f'{path} was grown for other obstacles ({key} differs)')
+    return data
+
+
+def node_arrays(nodes):
+    # coordinates (N, 2) and parent index (N,) of a list of Node objects, -1 for no parent or one not in the list
+    index = {id(node): i for i, node in enumerate(nodes)}
+    coords = np.array([(node.x, node.y) for node in nodes], dtype=float).reshape(-1, 2)
+    parent = np.array([-1 if node.parent is None else index.get(id(node.parent), -1) for node in nodes], dtype=np.int64)
+    return coords, parent
+
+
+def link(nodes, parent):
+    # sets parent and children of Node objects from the parent indices of node_arrays()
+    for node, p in zip(nodes, parent.tolist()):
+        if p >= 0:
+            node.parent = nodes[p]
+            nodes[p].children.add(node)
+
+
+def pack(relation, n):
+    # slot -> set of handles (with an idx) as offsets (n + 1,) and the flat slots of all sets, in slot order
+    counts = np.zeros(n, dtype=np.int64)
+    slots = []
+    for idx in sorted(relation):
+        nodes = relation[idx]
+        counts[idx] = len(nodes)
+        slots.extend(node.idx for node in nodes)
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets, np.array(slots, dtype=np.int64)
+
+
+def unpack(offsets, slots, handles):
+    # back to slot -> set of handles, only for the slots with a non-empty set
+    offsets, slots = offsets.tolist(), slots.tolist()
+    return {idx: set(map(handles.__getitem__, slots[offsets[idx]:offsets[idx + 1]]))
+            for idx in np.flatnonzero(np.diff(offsets)).tolist()}
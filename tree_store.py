@@ -0,0 +1,106 @@
+"""
+Struct-of-arrays storage for planner trees
+Coordinates, parent index, cost-to-goal and lmc of every node live in contiguous typed buffers
+(readable as NumPy arrays), nodes themselves are small __slots__ handles holding a slot index
+Neighbour sets are only allocated for the slots that actually use them
+"""
+
+import math
+from array import array
+import numpy as np
+
+NO_PARENT = -1
+EMPTY = frozenset() # returned for relations a node does not have yet
+
+
+class TreeStore:
+    def __init__(self, node_class):
+        self.node_class = node_class # handle type, constructed as node_class(store, idx)
+        self.x = array('d')
+        self.y = array('d')
+        self.cost_to_goal = array('d')
+        self.lmc = array('d')
+        self.parent = array('q')
+        self.handles = [] # slot -> node handle, None for free slots
+        self.free_slots = []
+
+        # adjacency, slot -> set of node handles, only for slots that have any
+        self.children = {}
+        self.infinite_dist_nodes = {} # nodes u where d_pi(v,u) has been set to infinity after adding an obstacle
+        self.N_o = {} # original neighbours, always added both ways so outgoing == incoming
+        self.N_r_plus = {} # outgoing running neighbours
+        self.N_r_minus = {} # incoming running neighbours
+
+    @classmethod
+    def from_arrays(cls, node_class, x, y, cost_to_goal, lmc, parent, free_slots):
+        # store holding the given per-slot arrays, with a handle for every slot not in free_slots (see tree_file.py)
+        # neighbour sets start empty, fill them in with the handles
+        tree = cls(node_class)
+        for name, values, dtype in (('x', x, float), ('y', y, float), ('cost_to_goal', cost_to_goal, float),
+                                    ('lmc', lmc, float), ('parent', parent, np.int64)):
+            getattr(tree, name).frombytes(np.ascontiguousarray(values, dtype=dtype).tobytes())
+        tree.free_slots = list(free_slots)
+        free = set(tree.free_slots)
+        tree.handles = [None if idx in free else node_class(tree, idx) for idx in range(len(tree.x))]
+        return tree
+
+    def __len__(self):
+        return len(self.handles) - len(self.free_slots)
+
+    def new_node(self, n, lmc=math.inf, cost_to_goal=math.inf):
+        if self.free_slots:
+            idx = self.free_slots.pop()
+            self.x[idx], self.y[idx] = n[0], n[1]
+            self.lmc[idx], self.cost_to_goal[idx] = lmc, cost_to_goal
+            self.parent[idx] = NO_PARENT
+        else:
+            idx = len(self.handles)
+            self.x.append(n[0])
+            self.y.append(n[1])
+            self.lmc.append(lmc)
+            self.cost_to_goal.append(cost_to_goal)
+            self.parent.append(NO_PARENT)
+            self.handles.append(None)
+        node = self.node_class(self, idx)
+        self.handles[idx] = node
+        return node
+
+    def release(self, node):
+        # hands a slot back for reuse, only for nodes nothing else refers to (e.g. rejected samples)
+        idx = node.idx
+        for relation in (self.children, self.infinite_dist_nodes, self.N_o, self.N_r_plus, self.N_r_minus):
+            relation.pop(idx, None)
+        self.handles[idx] = None
+        self.free_slots.append(idx)
+
+    def get(self, relation, idx):
+        return relation.get(idx, EMPTY)
+
+    def add(self, relation, idx, node):
+        nodes = relation.get(idx)
+        if nodes is None:
+            nodes = relation[idx] = set()
+        nodes.add(node)
+
+    def discard(self, relation, idx, node):
+        nodes = relation.get(idx)
+        if nodes is None or node not in nodes:
+            return False
+        nodes.remove(node)
+        if not nodes:
+            del relation[idx]
+        return True
+
+    def array(self, name):
+        # NumPy copy of one per-node buffer ('x', 'y', 'cost_to_goal', 'lmc' or 'parent')
+        # a copy, not a view, so the buffer can keep growing
+        return np.array(getattr(self, name))
+
+    def used_slots(self):
+        # slots that currently hold a node
+        return [idx for idx, node in enumerate(self.handles) if node is not None]
+
+    def coords(self, idxs=None):
+        # (N, 2) coordinates of the given slots (all slots if None)
+        xy = np.column_stack((np.frombuffer(self.x), np.frombuffer(self.y)))
+        return xy if idxs is None else xy[idxs]
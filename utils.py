@@ -2,121 +2,314 @@ import math
 import numpy as np
 import os
 import sys
-from shapely.geometry import LineString
-from shapely.geometry import Point
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)) +
                 "/../../Sampling_based_Planning/")
 
 import env
+import static_map
 # from rrtx import Node
 
 
+class CollisionWorld:
+    '''
+    Obstacles stored as contiguous arrays so segments can be checked against all of them at once
+    - circles are (x, y, r), rectangles and boundaries are stored as boxes (x_min, y_min, x_max, y_max)
+      already grown by delta
+    - same semantics as the old per-obstacle checks: an endpoint within r + delta of a circle or
+      inside a grown box collides, and so does a segment passing within r of a circle centre or
+      crossing a grown rectangle
+    - with a resolution, a StaticMap shared with every other world of the same obstacles answers the checks far
+      from obstacle edges, see static_map.py
+    '''
+    def __init__(self, obs_circle, obs_rectangle, obs_boundary, delta, resolution=None):
+        self.delta = delta
+        self.circles = np.array(obs_circle, dtype=float).reshape(-1, 3)
+        self.boxes = self.grow_boxes(obs_rectangle, delta)
+        self.boundary_boxes = self.grow_boxes(obs_boundary, delta)
+        self.all_boxes = np.vstack((self.boxes, self.boundary_boxes))
+        # plain tuples for the single segment path, numpy call overhead dominates for one segment
+        self.circle_list = [tuple(c) for c in self.circles.tolist()]
+        self.box_list = [tuple(b) for b in self.all_boxes.tolist()]
+        self.static_map = None if resolution is None else \
+            static_map.shared(self.circles, self.all_boxes, delta, resolution)
+
+    @staticmethod
+    def grow_boxes(obs_rec, delta):
+        rec = np.array(obs_rec, dtype=float).reshape(-1, 4)
+        return np.column_stack((rec[:, 0] - delta, rec[:, 1] - delta,
+                                rec[:, 0] + rec[:, 2] + delta, rec[:, 1] + rec[:, 3] + delta))
+
+    def points_inside(self, points):
+        # points: (N, 2) array -> bool[N]
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        if self.static_map is not None:
+            state = self.static_map.points_state(points)
+            inside = state == static_map.INSIDE
+            undecided = np.flatnonzero(state == static_map.MIXED)
+            if len(undecided) < len(points):
+                inside[undecided] = self.exact_points_inside(points[undecided])
+                return inside
+        return self.exact_points_inside(points)
+
+    def exact_points_inside(self, points):
+        inside = np.zeros(len(points), dtype=bool)
+        if len(self.circles):
+            d2 = (points[:, None, 0] - self.circles[None, :, 0])**2 + \
+                 (points[:, None, 1] - self.circles[None, :, 1])**2
+            inside |= (d2 <= (self.circles[None, :, 2] + self.delta)**2).any(axis=1)
+        if len(self.all_boxes):
+            b = self.all_boxes
+            inside |= ((points[:, None, 0] >= b[None, :, 0]) & (points[:, None, 0] <= b[None, :, 2]) &
+                       (points[:, None, 1] >= b[None, :, 1]) & (points[:, None, 1] <= b[None, :, 3])).any(axis=1)
+        return inside
+
+    def point_inside(self, x, y):
+        if self.static_map is not None:
+            state = self.static_map.point_state(x, y)
+            if state != static_map.MIXED:
+                return state == static_map.INSIDE
+        reach = self.delta
+        for (cx, cy, r) in self.circle_list:
+            if (x - cx)**2 + (y - cy)**2 <= (r + reach)**2:
+                return True
+        for (x_min, y_min, x_max, y_max) in self.box_list:
+            if x_min <= x <= x_max and y_min <= y <= y_max:
+                return True
+        return False
+
+    def segment_collides(self, x1, y1, x2, y2):
+        # single segment version of segments_collide
+        dx, dy = x2 - x1, y2 - y1
+        len2 = dx * dx + dy * dy
+        if self.static_map is not None:
+            a = self.static_map.point_clearance(x1, y1)
+            b = self.static_map.point_clearance(x2, y2)
+            if a > 0 and b > 0 and (a + b) * (a + b) > len2:
+                return False
+        if self.point_inside(x1, y1) or self.point_inside(x2, y2):
+            return True
+        sx_min, sx_max = (x1, x2) if x1 < x2 else (x2, x1)
+        sy_min, sy_max = (y1, y2) if y1 < y2 else (y2, y1)
+        for (cx, cy, r) in self.circle_list:
+            # fast preliminary check against the segment's bounding box
+            if cx + r < sx_min or cx - r > sx_max or cy + r < sy_min or cy - r > sy_max:
+                continue
+            t = 0.0 if len2 == 0 else min(1.0, max(0.0, ((cx - x1) * dx + (cy - y1) * dy) / len2))
+            if (x1 + t * dx - cx)**2 + (y1 + t * dy - cy)**2 <= r * r:
+                return True
+        for (x_min, y_min, x_max, y_max) in self.box_list:
+            if x_max < sx_min or x_min > sx_max or y_max < sy_min or y_min > sy_max:
+                continue
+            # bounding boxes overlap and neither endpoint is inside, so check the slabs
+            t_enter, t_exit = 0.0, 1.0
+            if dx != 0:
+                t1, t2 = (x_min - x1) / dx, (x_max - x1) / dx
+                t_enter, t_exit = max(t_enter, min(t1, t2)), min(t_exit, max(t1, t2))
+            if dy != 0:
+                t1, t2 = (y_min - y1) / dy, (y_max - y1) / dy
+                t_enter, t_exit = max(t_enter, min(t1, t2)), min(t_exit, max(t1, t2))
+            if t_enter <= t_exit:
+                return True
+        return False
+
+    def segments_collide(self, segs):
+        # segs: (N, 4) array of x1, y1, x2, y2 -> bool[N]
+        segs = np.asarray(segs, dtype=float).reshape(-1, 4)
+        if self.static_map is not None:
+            hit = np.zeros(len(segs), dtype=bool)
+            check = np.flatnonzero(~self.static_map.segments_free(segs))
+            if len(check):
+                hit[check] = self.exact_segments_collide(segs[check])
+            return hit
+        return self.exact_segments_collide(segs)
+
+    def exact_segments_collide(self, segs):
+        hit = self.exact_points_inside(np.vstack((segs[:, :2], segs[:, 2:]))).reshape(2, -1).any(axis=0)
+        if len(self.circles):
+            hit |= self.segments_hit_circles(segs, self.circles)
+        if len(self.all_boxes):
+            hit |= self.segments_hit_boxes(segs, self.all_boxes)
+        return hit
+
+    @staticmethod
+    def segments_hit_circles(segs, circles):
+        # closed form segment to centre distance, (N, 4) segments vs (M, 3) circles -> bool[N]
+        return (CollisionWorld.segment_circle_dist2(segs, circles[:, :2]) <= circles[None, :, 2]**2).any(axis=1)
+
+    @staticmethod
+    def segment_circle_dist2(segs, centres):
+        # squared distance from every segment to every centre, (N, M)
+        ax, ay = segs[:, 0, None], segs[:, 1, None]
+        dx, dy = segs[:, 2, None] - ax, segs[:, 3, None] - ay
+        len2 = np.maximum(dx**2 + dy**2, 1e-12) # zero length segments give t = 0
+        t = np.clip(((centres[None, :, 0] - ax) * dx + (centres[None, :, 1] - ay) * dy) / len2, 0.0, 1.0)
+        return (ax + t * dx - centres[None, :, 0])**2 + (ay + t * dy - centres[None, :, 1])**2
+
+    @staticmethod
+    def segment_segment_dist2(segs, others):
+        # squared distance between every segment in segs (N, 4) and every segment in others (M, 4), (N, M)
+        # closest points of two segments that do not cross are always at one of the four endpoints
+        d2 = np.minimum(CollisionWorld.segment_circle_dist2(segs, others[:, :2]),
+                        CollisionWorld.segment_circle_dist2(segs, others[:, 2:]))
+        d2 = np.minimum(d2, CollisionWorld.segment_circle_dist2(others, segs[:, :2]).T)
+        d2 = np.minimum(d2, CollisionWorld.segment_circle_dist2(others, segs[:, 2:]).T)
+
+        # segments that properly cross are at distance 0
+        def side(p, a, b):
+            # sign of the cross product (b - a) x (p - a)
+            return np.sign((b[..., 0] - a[..., 0]) * (p[..., 1] - a[..., 1]) - (b[..., 1] - a[..., 1]) * (p[..., 0] - a[..., 0]))
+        p1, p2 = segs[:, None, :2], segs[:, None, 2:]
+        q1, q2 = others[None, :, :2], others[None, :, 2:]
+        crossing = (side(q1, p1, p2) * side(q2, p1, p2) < 0) & (side(p1, q1, q2) * side(p2, q1, q2) < 0)
+        d2[crossing] = 0.0
+        return d2
+
+    @staticmethod
+    def segments_hit_boxes(segs, boxes):
+        # slab test, (N, 4) segments vs (K, 4) boxes -> bool[N]
+        o = segs[:, :2]
+        d = segs[:, 2:] - o
+        d[d == 0] = 1e-12 # parallel to a slab: entry/exit go to +-inf unless the segment lies inside it
+        t1 = (boxes[None, :, :2] - o[:, None, :]) / d[:, None, :] # (N, K, 2)
+        t2 = (boxes[None, :, 2:] - o[:, None, :]) / d[:, None, :]
+        t_enter = np.maximum(np.minimum(t1, t2).max(axis=2), 0.0)
+        t_exit = np.minimum(np.maximum(t1, t2).min(axis=2), 1.0)
+        return (t_enter <= t_exit).any(axis=1)
+
+
 class Utils:
-    def __init__(self):
+    def __init__(self, cache_edges=False):
         self.env = env.Env()
 
         self.delta = 0.5
+        self.batch_min = 8 # fewest edges worth a vectorized check
+        self.map_resolution = 0.25 # cell size of the shared StaticMap, None to always check every obstacle
         self.obs_circle = self.env.obs_circle
         self.obs_rectangle = self.env.obs_rectangle
         self.obs_boundary = self.env.obs_boundary
+        self.world = CollisionWorld(self.obs_circle, self.obs_rectangle, self.obs_boundary, self.delta,
+                                    self.map_resolution)
+
+        # edge collision cache, an entry is only valid while the epoch of its region has not moved on
+        # keyed by the endpoint coordinates (in sorted order) since node slots and ids get reused for new samples
+        # only worth it for planners that check the same edges again, a lookup costs about a sixth of a check
+        self.cache_edges = cache_edges
+        self.edge_cache = {} # (x1, y1, x2, y2) -> (collides, region epoch when checked)
+        self.region_size = 2.0 # regions are square cells, an edge belongs to the cell of its first endpoint
+        self.region_epoch = {} # (i, j) -> number of obstacle changes that could reach edges of the region
+        self.max_edge = 0.0 # longest edge ever cached, how far from its region an edge can reach
+        self.cache_limit = 500_000 # entries, the cache starts over once it is full
 
     def update_obs(self, obs_cir, obs_bound, obs_rec):
+        old_world = self.world
         self.obs_circle = obs_cir
         self.obs_boundary = obs_bound
         self.obs_rectangle = obs_rec
-
-    def get_obs_vertex(self):
-        delta = self.delta
-        obs_list = []
-
-        for (ox, oy, w, h) in self.obs_rectangle:
-            vertex_list = [[ox - delta, oy - delta],
-                           [ox + w + delta, oy - delta],
-                           [ox + w + delta, oy + h + delta],
-                           [ox - delta, oy + h + delta]]
-            obs_list.append(vertex_list)
-
-        return obs_list
-
-    def is_intersect_rec(self, start, end, o, d, a, b):
-        v1 = [o[0] - a[0], o[1] - a[1]]
-        v2 = [b[0] - a[0], b[1] - a[1]]
-        v3 = [-d[1], d[0]]
-
-        div = np.dot(v2, v3)
-
-        if div == 0:
-            return False
-
-        t1 = np.linalg.norm(np.cross(v2, v1)) / div
-        t2 = np.dot(v1, v3) / div
-
-        if t1 >= 0 and 0 <= t2 <= 1:
-            # shot = Node((o[0] + t1 * d[0], o[1] + t1 * d[1]))
-            # dist_obs = self.get_dist(start, shot)
-            dist_obs = math.hypot(start.x - (o[0] + t1 * d[0]), 
-                                  start.y - (o[1] + t1 * d[1]))
-            dist_seg = self.get_dist(start, end)
-            if dist_obs <= dist_seg:
-                return True
-
-        return False
+        self.world = CollisionWorld(self.obs_circle, self.obs_rectangle, self.obs_boundary, self.delta,
+                                    self.map_resolution)
+        self.invalidate_changes(old_world, self.world)
+
+    def invalidate_changes(self, old_world, new_world):
+        # moves on the epoch of every region with cached edges that an added or removed obstacle can reach
+        # the obstacle lists are changed in place by the planners, so the old world holds the only copy of them
+        circles = set(map(tuple, old_world.circles.tolist())) ^ set(map(tuple, new_world.circles.tolist()))
+        boxes = set(map(tuple, old_world.all_boxes.tolist())) ^ set(map(tuple, new_world.all_boxes.tolist()))
+        reach = self.delta
+        boxes.update((x - r - reach, y - r - reach, x + r + reach, y + r + reach) for x, y, r in circles)
+        for x_min, y_min, x_max, y_max in boxes:
+            i_lo, j_lo = self.region_of(x_min - self.max_edge, y_min - self.max_edge)
+            i_hi, j_hi = self.region_of(x_max + self.max_edge, y_max + self.max_edge)
+            for i in range(i_lo, i_hi + 1):
+                for j in range(j_lo, j_hi + 1):
+                    self.region_epoch[(i, j)] = self.region_epoch.get((i, j), 0) + 1
+
+    def region_of(self, x, y):
+        return int(x // self.region_size), int(y // self.region_size)
+
+    def cached_collision(self, x1, y1, x2, y2):
+        # returns the cache key, the current epoch of its region and the cached result (None if there is none)
+        key = (x1, y1, x2, y2) if (x1, y1) <= (x2, y2) else (x2, y2, x1, y1)
+        epoch = self.region_epoch.get((int(key[0] // self.region_size), int(key[1] // self.region_size)), 0)
+        entry = self.edge_cache.get(key)
+        if entry is not None and entry[1] == epoch:
+            return key, epoch, entry[0]
+        return key, epoch, None
+
+    def cache_collision(self, key, epoch, collides):
+        if len(self.edge_cache) >= self.cache_limit:
+            self.edge_cache = {}
+        self.edge_cache[key] = (collides, epoch)
+        length = math.hypot(key[2] - key[0], key[3] - key[1])
+        if length > self.max_edge:
+            self.max_edge = length
 
     def is_intersect_circle(self, ln1, ln2, a, r):
-
-        # fast preliminary check
-        unsafe_dist = r + math.hypot(ln1[0] - ln2[0], ln1[1] - ln2[1]) + self.delta
-        if math.hypot(a[0] - ln2[0], a[1] - ln2[1]) > unsafe_dist or \
-                math.hypot(a[0] - ln1[0], a[1] - ln1[1]) > unsafe_dist:
-            return False
-
-        p = Point(*a)
-        c = p.buffer(r).boundary
-        l = LineString([ln1, ln2])
-        return c.intersects(l)
-
+        # closed form distance from circle centre to the segment
+        dx, dy = ln2[0] - ln1[0], ln2[1] - ln1[1]
+        len2 = dx * dx + dy * dy
+        t = 0.0 if len2 == 0 else min(1.0, max(0.0, ((a[0] - ln1[0]) * dx + (a[1] - ln1[1]) * dy) / len2))
+        return math.hypot(ln1[0] + t * dx - a[0], ln1[1] + t * dy - a[1]) <= r
+
+    def is_intersect_circles_batch(self, segs, circles):
+        # (N, 4) segments vs (M, 3) circles -> bool[N, M]
+        segs = np.asarray(segs, dtype=float).reshape(-1, 4)
+        circles = np.asarray(circles, dtype=float).reshape(-1, 3)
+        return CollisionWorld.segment_circle_dist2(segs, circles[:, :2]) <= circles[None, :, 2]**2
+
+    # the public is_collision* methods only call the private _check_* helpers and not each other, so a profiler
+    # wrapping all of them counts and times every check once (see profiling.py)
     def is_collision(self, start, end):
-        if self.is_inside_obs(start) or self.is_inside_obs(end):
-            return True
-
-        o, d = self.get_ray(start, end)
-        obs_vertex = self.get_obs_vertex()
-
-        for (v1, v2, v3, v4) in obs_vertex:
-            if self.is_intersect_rec(start, end, o, d, v1, v2):
-                return True
-            if self.is_intersect_rec(start, end, o, d, v2, v3):
-                return True
-            if self.is_intersect_rec(start, end, o, d, v3, v4):
-                return True
-            if self.is_intersect_rec(start, end, o, d, v4, v1):
-                return True
-
-        for (x, y, r) in self.obs_circle:
-            if self.is_intersect_circle(start, end, [x, y], r):
-                return True
-
-        return False
+        return self._check_segment(start.x, start.y, end.x, end.y)
+
+    def is_collision_segment(self, x1, y1, x2, y2):
+        # is_collision() for an edge given by its endpoints, e.g. to a sample that is not a node yet
+        return self._check_segment(x1, y1, x2, y2)
+
+    def is_collision_batch(self, starts, end):
+        # checks the edges from every node in starts to end in one call -> bool[len(starts)]
+        return self._check_edges([(u, end) for u in starts])
+
+    def is_collision_edges(self, edges):
+        # checks the edges (a, b) between pairs of nodes -> bool[len(edges)], only the ones not cached are computed
+        return self._check_edges(edges)
+
+    def _check_segment(self, x1, y1, x2, y2):
+        if not self.cache_edges:
+            return self.world.segment_collides(x1, y1, x2, y2)
+        key, epoch, collides = self.cached_collision(x1, y1, x2, y2)
+        if collides is None:
+            collides = self.world.segment_collides(x1, y1, x2, y2)
+            self.cache_collision(key, epoch, collides)
+        return collides
+
+    def _check_edges(self, edges):
+        if not self.cache_edges:
+            segs = [(a.x, a.y, b.x, b.y) for a, b in edges]
+            if len(segs) < self.batch_min:
+                # numpy call overhead is larger than a few single segment checks
+                return np.array([self.world.segment_collides(*seg) for seg in segs], dtype=bool)
+            return self.world.segments_collide(segs)
+        result = np.zeros(len(edges), dtype=bool)
+        missing = []
+        for k, (a, b) in enumerate(edges):
+            key, epoch, collides = self.cached_collision(a.x, a.y, b.x, b.y)
+            if collides is None:
+                missing.append((k, key, epoch, (a.x, a.y, b.x, b.y)))
+            else:
+                result[k] = collides
+        if len(missing) < self.batch_min:
+            # numpy call overhead is larger than a few single segment checks
+            hits = [self.world.segment_collides(*seg) for _, _, _, seg in missing]
+        else:
+            hits = self.world.segments_collide([seg for _, _, _, seg in missing]).tolist()
+        for (k, key, epoch, _), collides in zip(missing, hits):
+            result[k] = collides
+            self.cache_collision(key, epoch, collides)
+        return result
 
     def is_inside_obs(self, node):
-        delta = self.delta
-
-        for (x, y, r) in self.obs_circle:
-            if math.hypot(node.x - x, node.y - y) <= r + delta:
-                return True
-
-        for (x, y, w, h) in self.obs_rectangle:
-            if 0 <= node.x - (x - delta) <= w + 2 * delta \
-                    and 0 <= node.y - (y - delta) <= h + 2 * delta:
-                return True
-
-        for (x, y, w, h) in self.obs_boundary:
-            if 0 <= node.x - (x - delta) <= w + 2 * delta \
-                    and 0 <= node.y - (y - delta) <= h + 2 * delta:
-                return True
-
-        return False
+        return self.world.point_inside(node.x, node.y)
 
     @staticmethod
     def update_robot_position(pos, bot, speed, dt):
@@ -135,6 +328,16 @@ class Utils:
         else:
             return bot.parent, new_pos
 
+    @staticmethod
+    def update_robot_positions(pos, target, dist):
+        # update_robot_position() for N robots at once
+        # pos, target: (N, 2), target is the parent of each robot's node, dist: (N,) speed * dt
+        # returns the (N, 2) new positions and an (N,) mask of robots that have reached their target node
+        d = target - pos
+        angle = np.arctan2(d[:, 1], d[:, 0])
+        new_pos = pos + dist[:, None] * np.column_stack((np.cos(angle), np.sin(angle)))
+        return new_pos, np.hypot(d[:, 0], d[:, 1]) <= 0.05
+
     @staticmethod
     def get_ray(start, end):
         orig = [start.x, start.y]
@@ -0,0 +1,140 @@
+"""
+World state of every robot of a scenario in shared memory, so each robot's planner can run in its own process
+Every robot writes its pose, velocity, radius and the path it is about to drive once per tick, and reads the others
+through RobotView objects that stand in for the robot objects planners otherwise get from set_other_robots()
+The board is double buffered: during a tick robots read the state everyone wrote last tick and write the next one,
+so nobody reads a half written entry and results do not depend on the order the processes run in
+"""
+
+import math
+from multiprocessing import shared_memory
+import numpy as np
+
+# columns of the state of each robot
+X, Y, VX, VY, RADIUS, HAS_STATE, REACHED_GOAL, DISTANCE, TICK, PATH_LEN = range(10)
+N_COLUMNS = 10
+
+
+class WorldBoard:
+    def __init__(self, n_robots, max_path_points=32, path_length=10.0, name=None):
+        # name: attach to the board another process created, None creates a new one (call unlink() when done)
+        # path_length: how far ahead (m) the paths of robots are published, max_path_points caps their size
+        self.n_robots = n_robots
+        self.max_path_points = max_path_points
+        self.path_length = path_length
+        self.state_size = 2 * n_robots * N_COLUMNS
+        size = 8 * (self.state_size + 2 * n_robots * max_path_points * 2)
+        self.shm = shared_memory.SharedMemory(name=name, create=name is None, size=size)
+        self.name = self.shm.name
+        self.tick = 0 # this process' tick, buffer tick % 2 is read and the other one is written
+        self.map_arrays()
+        if name is None:
+            self.state[:] = 0.0
+
+    def map_arrays(self):
+        self.state = np.ndarray((2, self.n_robots, N_COLUMNS), dtype=float, buffer=self.shm.buf)
+        self.paths = np.ndarray((2, self.n_robots, self.max_path_points, 2), dtype=float, buffer=self.shm.buf,
+                                offset=8 * self.state_size)
+
+    def __getstate__(self):
+        # processes that are not forked attach to the same memory by name
+        return {'n_robots': self.n_robots, 'max_path_points': self.max_path_points, 'path_length': self.path_length,
+                'name': self.name, 'tick': self.tick}
+
+    def __setstate__(self, state):
+        self.__init__(state['n_robots'], state['max_path_points'], state['path_length'], state['name'])
+        self.tick = state['tick']
+
+    def close(self):
+        del self.state, self.paths # numpy views must go before the memory can be closed
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+    @property
+    def current(self):
+        return self.state[self.tick % 2]
+
+    def write(self, idx, robot):
+        # publish the state of robot idx for the next tick
+        buf = (self.tick + 1) % 2
+        row = self.state[buf, idx]
+        x, y = robot.robot_position[0], robot.robot_position[1]
+        has_state = hasattr(robot, 'robot_state')
+        if has_state:
+            vx, vy = robot.robot_state[2], robot.robot_state[3]
+        else:
+            # displacement since the last tick
+            last = self.state[self.tick % 2, idx]
+            vx, vy = x - last[X], y - last[Y]
+        row[:PATH_LEN] = (x, y, vx, vy, robot.robot_radius, has_state, robot.reached_goal,
+                          robot.distance_travelled, self.tick + 1)
+        path = robot.published_path(self.path_length)[:self.max_path_points] if hasattr(robot, 'published_path') \
+            else [(x, y)]
+        row[PATH_LEN] = len(path)
+        self.paths[buf, idx, :len(path)] = path
+
+    def advance(self):
+        # every robot has written the next tick (wait at a barrier before calling this)
+        self.tick += 1
+
+    def all_reached_goal(self):
+        return bool(self.current[:, REACHED_GOAL].all())
+
+    def latest(self):
+        # the newest state of every robot, whichever buffer it is in (N, N_COLUMNS)
+        newest = np.argmax(self.state[:, :, TICK], axis=0)
+        return self.state[newest, np.arange(self.n_robots)].copy()
+
+    def view(self, idx):
+        return RobotView(self, idx)
+
+
+class RobotView:
+    '''
+    Read only stand in for robot idx, with the attributes planners read from other robots
+    - robot_state only exists if the robot has one (Velocity Obstacle agents), like on the robot itself
+    '''
+    def __init__(self, board, idx):
+        self.board = board
+        self.idx = idx
+
+    @property
+    def row(self):
+        return self.board.current[self.idx]
+
+    @property
+    def robot_position(self):
+        row = self.row
+        return [float(row[X]), float(row[Y])]
+
+    @property
+    def robot_radius(self):
+        return float(self.row[RADIUS])
+
+    @property
+    def robot_state(self):
+        row = self.row
+        if not row[HAS_STATE]:
+            raise AttributeError('robot_state') # so hasattr() is False, like for the tree planners
+        return row[X:VY + 1].copy()
+
+    @property
+    def reached_goal(self):
+        return bool(self.row[REACHED_GOAL])
+
+    @property
+    def distance_travelled(self):
+        return float(self.row[DISTANCE])
+
+    def published_path(self, length):
+        # the published path cut to length the way the robot itself does it, up to the board's path_length
+        points = self.board.paths[self.board.tick % 2, self.idx, :int(self.row[PATH_LEN])].tolist()
+        path = [tuple(points[0])]
+        for x, y in points[1:]:
+            if length <= 0:
+                break
+            length -= math.hypot(x - path[-1][0], y - path[-1][1])
+            path.append((x, y))
+        return path